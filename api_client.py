@@ -0,0 +1,287 @@
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+from usage import BudgetExceeded, BudgetStatus
+
+USER_HEADER = "X-Knowval-User"
+
+
+class APIError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class KnowvalClient:
+    """
+    Thin synchronous client for `api_server.py`. Every call acts on behalf of `user`,
+    sent in the X-Knowval-User header next to the service token.
+    """
+
+    def __init__(self, base_url: str, token: str = None, timeout: float = 60, poll_interval: float = 0.5):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.http = requests.Session()
+        if token:
+            self.http.headers["Authorization"] = f"Bearer {token}"
+
+    def request(self, method: str, path: str, user: str = None, stream: bool = False, **kwargs) -> requests.Response:
+        headers = {USER_HEADER: user} if user else {}
+        response = self.http.request(method, self.base_url + path, headers=headers, stream=stream,
+                                     timeout=kwargs.pop("timeout", self.timeout), **kwargs)
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("error", response.reason)
+            except ValueError:
+                message = response.text or response.reason
+            if response.status_code == 429:
+                raise BudgetExceeded(message)
+            raise APIError(response.status_code, message)
+        return response
+
+    def health(self) -> Dict[str, Any]:
+        response = self.http.get(self.base_url + "/health", timeout=self.timeout)
+        return response.json()
+
+    def wait_for_job(self, job_id: str, user: str, timeout: float = 600) -> Any:
+        """Polls a job until it finishes and returns its result."""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.request("GET", f"/jobs/{job_id}", user).json()
+            if job["status"] == "done":
+                return job["result"]
+            if job["status"] == "failed":
+                if (job["error"] or "").startswith("budget_exceeded"):
+                    raise BudgetExceeded(job["error"])
+                raise APIError(500, job["error"] or "Job failed")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Job {job_id} did not finish within {timeout}s")
+            time.sleep(self.poll_interval)
+
+    def ingest(self, files: List[Tuple[str, Any]], user: str, session_id: str = None, wait: bool = True):
+        """Uploads (name, bytes or file object) pairs. Returns the job result, or the job id with wait=False."""
+        parts = [("files", (name, data.getvalue() if hasattr(data, "getvalue") else data)) for name, data in files]
+        job = self.request("POST", "/ingest", user, data={"session_id": session_id or ""}, files=parts).json()
+        return self.wait_for_job(job["job_id"], user) if wait else job["job_id"]
+
+    def stream_quiz(self, user: str, **quiz_args) -> Iterator[List[Dict[str, Any]]]:
+        """Yields quiz items batch by batch as the server generates them."""
+        with self.request("POST", "/quiz/stream", user, json=quiz_args, stream=True, timeout=None) as response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                message = json.loads(line)
+                if message["type"] == "batch":
+                    yield message["items"]
+                elif message["type"] == "error":
+                    if message.get("status") == 429:
+                        raise BudgetExceeded(message["error"])
+                    raise APIError(message.get("status", 500), message["error"])
+
+
+class _Remote:
+    def __init__(self, client: KnowvalClient, current_user: Callable[[], Optional[str]]):
+        self.client = client
+        self.current_user = current_user
+
+
+class RemoteSessionManager(_Remote):
+    """SessionManager over HTTP. Failures are printed and reported like the local manager does."""
+
+    def create_session(self, user_id, name=None, session_id=None):
+        try:
+            return self.client.request("POST", "/sessions", user_id, json={"name": name, "session_id": session_id}).json()["id"]
+        except (APIError, requests.RequestException) as e:
+            print(f"Error creating session: {e}")
+            return None
+
+    def update_session_name(self, session_id, new_name):
+        try:
+            self.client.request("PATCH", f"/sessions/{session_id}", self.current_user(), json={"name": new_name})
+            return True
+        except (APIError, requests.RequestException) as e:
+            print(f"Error updating session name: {e}")
+            return False
+
+    def start_quiz(self, session_id, quiz_data, current_index=0, user_answers=None, score=0, answer_submitted=False):
+        try:
+            self.client.request("POST", f"/sessions/{session_id}/quiz", self.current_user(), json={
+                "quiz_data": quiz_data, "current_index": current_index, "user_answers": user_answers,
+                "score": score, "answer_submitted": answer_submitted})
+            return True
+        except (APIError, requests.RequestException) as e:
+            print(f"Error saving quiz: {e}")
+            return False
+
+    def record_answer(self, session_id, question_index, answer, score, answer_submitted=True):
+        try:
+            self.client.request("POST", f"/sessions/{session_id}/answers", self.current_user(), json={
+                "question_index": question_index, "answer": answer, "score": score,
+                "answer_submitted": answer_submitted})
+            return True
+        except (APIError, requests.RequestException) as e:
+            print(f"Error recording answer: {e}")
+            return False
+
+    def update_progress(self, session_id, current_index, score, answer_submitted):
+        try:
+            self.client.request("PUT", f"/sessions/{session_id}/progress", self.current_user(), json={
+                "current_index": current_index, "score": score, "answer_submitted": answer_submitted})
+            return True
+        except (APIError, requests.RequestException) as e:
+            print(f"Error updating progress: {e}")
+            return False
+
+    def flush(self):
+        """Writes are queued and flushed by the server."""
+
+    def load_quiz_state(self, session_id):
+        try:
+            state = self.client.request("GET", f"/sessions/{session_id}/quiz", self.current_user()).json()
+        except APIError as e:
+            if e.status != 404:
+                print(f"Error loading quiz state: {e}")
+            return None
+        except requests.RequestException as e:
+            print(f"Error loading quiz state: {e}")
+            return None
+        # JSON turned the question indexes into strings
+        state["user_answers"] = {int(k): v for k, v in state["user_answers"].items()}
+        return state
+
+    def get_session(self, session_id):
+        try:
+            return self.client.request("GET", f"/sessions/{session_id}", self.current_user()).json()
+        except (APIError, requests.RequestException) as e:
+            print(f"Error fetching session: {e}")
+            return None
+
+    def list_user_sessions(self, user_id, limit=50, offset=0, search=None):
+        try:
+            params = {"limit": limit, "offset": offset, **({"search": search} if search else {})}
+            return self.client.request("GET", "/sessions", user_id, params=params).json()["sessions"]
+        except (APIError, requests.RequestException) as e:
+            print(f"Error listing sessions: {e}")
+            return []
+
+    def count_user_sessions(self, user_id, search=None):
+        try:
+            params = {"limit": 0, **({"search": search} if search else {})}
+            return self.client.request("GET", "/sessions", user_id, params=params).json()["total"]
+        except (APIError, requests.RequestException) as e:
+            print(f"Error counting sessions: {e}")
+            return 0
+
+    def delete_session(self, session_id):
+        try:
+            return self.client.request("DELETE", f"/sessions/{session_id}", self.current_user()).json()["deleted"]
+        except (APIError, requests.RequestException) as e:
+            print(f"Error deleting session: {e}")
+            return False
+
+
+class RemoteIngestionManager(_Remote):
+    def ingest_buffers(self, files, username=None, session_id=None):
+        return self.client.ingest(files, username or self.current_user(), session_id)
+
+
+class RemoteTopicManager(_Remote):
+    def discover_topics(self, username=None, session_id=None):
+        return self.client.request("POST", "/topics", username or self.current_user(),
+                                   json={"session_id": session_id}).json()["topics"]
+
+
+class RemoteQuizGenerator(_Remote):
+    def iter_quiz_batches(self, topic, num_chunks=None, difficulty="Medium", username=None, session_id=None,
+                          exclude_questions=None):
+        return self.client.stream_quiz(username or self.current_user(), topic=topic, num_chunks=num_chunks,
+                                       difficulty=difficulty, session_id=session_id,
+                                       exclude_questions=exclude_questions)
+
+    def generate_quiz(self, topic, num_chunks=None, difficulty="Medium", username=None, session_id=None,
+                      exclude_questions=None):
+        return [item for batch in self.iter_quiz_batches(topic, num_chunks, difficulty, username, session_id,
+                                                         exclude_questions)
+                for item in batch]
+
+
+class RemotePrefetcher(_Remote):
+    def prefetch(self, topic, difficulty="Medium", username=None, session_id=None, exclude_questions=None,
+                 num_chunks=None):
+        return self.client.request("POST", "/quiz/prefetch", username or self.current_user(), json={
+            "topic": topic, "difficulty": difficulty, "session_id": session_id,
+            "exclude_questions": exclude_questions, "num_chunks": num_chunks}).json()["scheduled"]
+
+    def take(self, topic, difficulty="Medium", username=None, session_id=None, wait=None):
+        return self.client.request("POST", "/quiz/take", username or self.current_user(), json={
+            "topic": topic, "difficulty": difficulty, "session_id": session_id, "wait": wait}).json()["quiz"]
+
+    def invalidate(self, session_id):
+        """The server drops a session's prefetched quizzes itself after ingestion and deletion."""
+
+
+class RemoteEvaluator(_Remote):
+    def evaluate_answer(self, question, user_answer, chunk_content, keywords, username=None, session_id=None):
+        return self.client.request("POST", "/evaluate", username or self.current_user(), json={
+            "question": question, "user_answer": user_answer, "chunk_content": chunk_content,
+            "keywords": keywords, "session_id": session_id}).json()
+
+
+class RemoteUsageTracker(_Remote):
+    def check(self, user_id=None, pending_tokens=0):
+        budget = self.client.request("GET", "/usage", user_id or self.current_user()).json()["budget"]
+        return BudgetStatus(budget["tokens"], budget["cost"], budget["token_limit"], budget["cost_limit"])
+
+
+class RemoteRegistry:
+    """
+    Drop-in for ManagerRegistry when the app runs against the HTTP API (KNOWVAL_API_URL).
+
+    Sign-in stays local to the UI (users.db); everything else goes through the API, which
+    trusts the X-Knowval-User header from callers holding the service token.
+    """
+
+    def __init__(self, base_url: str, current_user: Callable[[], Optional[str]], token: str = None,
+                 users_db: str = "users.db"):
+        self.client = KnowvalClient(base_url, token or os.getenv("KNOWVAL_API_TOKEN"))
+        self.users_db = users_db
+        self._auth = None
+        self.sessions = RemoteSessionManager(self.client, current_user)
+        self.ingestion = RemoteIngestionManager(self.client, current_user)
+        self.topics = RemoteTopicManager(self.client, current_user)
+        self.generator = RemoteQuizGenerator(self.client, current_user)
+        self.prefetcher = RemotePrefetcher(self.client, current_user)
+        self.evaluator = RemoteEvaluator(self.client, current_user)
+        self.usage = RemoteUsageTracker(self.client, current_user)
+
+    @property
+    def auth(self):
+        if self._auth is None:
+            from auth import AuthManager
+            self._auth = AuthManager(self.users_db)
+        return self._auth
+
+    def lazy(self, name: str):
+        return getattr(self, name)
+
+    def start_background_tasks(self):
+        """Background work runs in the API server."""
+
+    def health(self) -> Dict[str, Dict[str, Any]]:
+        start = time.perf_counter()
+        try:
+            components = self.client.health()["components"]
+            api = {"ok": True, "detail": self.client.base_url}
+        except (requests.RequestException, ValueError, KeyError) as e:
+            components, api = {}, {"ok": False, "detail": str(e)}
+        api["latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return {"api": api, **components}
+
+    def close(self):
+        self.client.http.close()
@@ -0,0 +1,477 @@
+__import__('pysqlite3')
+import sys
+sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+
+import asyncio
+import io
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+from aiohttp import web
+
+from jobs import JobStore
+from resources import ManagerRegistry
+from usage import BudgetExceeded, get_usage_tracker
+
+# The authenticated user is passed by the (trusted) client, e.g. the Streamlit app
+USER_HEADER = "X-Knowval-User"
+DEFAULT_MAX_UPLOAD_MB = 200
+
+REGISTRY = web.AppKey("registry", object)
+JOBS = web.AppKey("jobs", JobStore)
+EXECUTOR = web.AppKey("executor", ThreadPoolExecutor)
+TOKEN = web.AppKey("token", object)
+MAX_UPLOAD = web.AppKey("max_upload", int)
+TASKS = web.AppKey("tasks", set)
+USER = web.RequestKey("user", str)
+
+routes = web.RouteTableDef()
+
+
+def _error(status: int, message: str) -> web.Response:
+    return web.json_response({"error": message}, status=status)
+
+
+async def _run(request: web.Request, func: Callable, *args, **kwargs):
+    """Runs a blocking manager call on the worker thread pool, keeping the event loop free."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(request.app[EXECUTOR], partial(func, *args, **kwargs))
+
+
+async def _body(request: web.Request) -> Dict[str, Any]:
+    if not request.can_read_body:
+        return {}
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise web.HTTPBadRequest(text=json.dumps({"error": "Request body must be JSON"}),
+                                 content_type="application/json")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text=json.dumps({"error": "Request body must be a JSON object"}),
+                                 content_type="application/json")
+    return body
+
+
+@web.middleware
+async def identity_middleware(request: web.Request, handler):
+    """Checks the service token, attaches the calling user and maps budget errors to 429."""
+    if request.path == "/health":
+        return await handler(request)
+    token = request.app[TOKEN]
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return _error(401, "Missing or invalid API token")
+    user = request.headers.get(USER_HEADER, "").strip()
+    if not user:
+        return _error(401, f"Missing {USER_HEADER} header")
+    request[USER] = user
+    try:
+        return await handler(request)
+    except BudgetExceeded as e:
+        return _error(429, str(e))
+
+
+async def _owned_session(request: web.Request, session_id: str = None) -> str:
+    """The session id from the URL (or given), if it belongs to the caller (other users' sessions look missing)."""
+    session_id = session_id or request.match_info["session_id"]
+    registry = request.app[REGISTRY]
+    owner = await _run(request, registry.sessions.get_session_owner, session_id)
+    if owner != request[USER]:
+        raise web.HTTPNotFound(text=json.dumps({"error": "Session not found"}), content_type="application/json")
+    return session_id
+
+
+async def _body_session(request: web.Request, body: Dict[str, Any]) -> Optional[str]:
+    """The body's optional session_id, checked like a URL one; without it the call covers all the caller's sessions."""
+    session_id = body.get("session_id")
+    return await _owned_session(request, session_id) if session_id else None
+
+
+async def _start_job(request: web.Request, kind: str, func: Callable[[], Any]) -> web.Response:
+    """Records a job, runs `func` in the background and answers 202 with a handle to poll."""
+    app = request.app
+    job_id = await _run(request, app[JOBS].create, request[USER], kind)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(app[EXECUTOR], app[JOBS].start, job_id)
+            result = await loop.run_in_executor(app[EXECUTOR], func)
+            await loop.run_in_executor(app[EXECUTOR], app[JOBS].finish, job_id, result)
+        except Exception as e:
+            print(f"API job {kind} {job_id} failed: {e}")
+            status = "budget_exceeded" if isinstance(e, BudgetExceeded) else "error"
+            await loop.run_in_executor(app[EXECUTOR], app[JOBS].fail, job_id, f"{status}: {e}")
+
+    task = asyncio.create_task(run())
+    app[TASKS].add(task)
+    task.add_done_callback(app[TASKS].discard)
+    return web.json_response({"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}, status=202)
+
+
+@routes.get("/health")
+async def health(request: web.Request):
+    components = await _run(request, request.app[REGISTRY].health)
+    ok = all(status["ok"] for status in components.values())
+    return web.json_response({"ok": ok, "worker_pid": os.getpid(), "components": components},
+                             status=200 if ok else 503)
+
+
+@routes.get("/sessions")
+async def list_sessions(request: web.Request):
+    sessions = request.app[REGISTRY].sessions
+    search = request.query.get("search") or None
+    try:
+        limit = int(request.query.get("limit", 50))
+        offset = int(request.query.get("offset", 0))
+    except ValueError:
+        return _error(400, "limit and offset must be integers")
+    page = await _run(request, sessions.list_user_sessions, request[USER], limit=limit, offset=offset, search=search)
+    total = await _run(request, sessions.count_user_sessions, request[USER], search=search)
+    return web.json_response({"sessions": page, "total": total})
+
+
+@routes.post("/sessions")
+async def create_session(request: web.Request):
+    body = await _body(request)
+    sessions = request.app[REGISTRY].sessions
+    session_id = await _run(request, sessions.create_session, request[USER], name=body.get("name"),
+                            session_id=body.get("session_id"))
+    if not session_id:
+        return _error(409, "Session could not be created")
+    return web.json_response({"id": session_id}, status=201)
+
+
+@routes.get("/sessions/{session_id}")
+async def get_session(request: web.Request):
+    session_id = await _owned_session(request)
+    return web.json_response(await _run(request, request.app[REGISTRY].sessions.get_session, session_id))
+
+
+@routes.patch("/sessions/{session_id}")
+async def rename_session(request: web.Request):
+    session_id = await _owned_session(request)
+    name = (await _body(request)).get("name")
+    if not name:
+        return _error(400, "name is required")
+    await _run(request, request.app[REGISTRY].sessions.update_session_name, session_id, name)
+    return web.json_response({"id": session_id, "name": name})
+
+
+@routes.delete("/sessions/{session_id}")
+async def delete_session(request: web.Request):
+    session_id = await _owned_session(request)
+    # Also deletes the session's chunks and prefetched quizzes through the manager's delete hooks
+    deleted = await _run(request, request.app[REGISTRY].sessions.delete_session, session_id)
+    return web.json_response({"deleted": bool(deleted)})
+
+
+@routes.get("/sessions/{session_id}/quiz")
+async def load_quiz(request: web.Request):
+    session_id = await _owned_session(request)
+    state = await _run(request, request.app[REGISTRY].sessions.load_quiz_state, session_id)
+    if not state:
+        return _error(404, "No saved quiz for this session")
+    # JSON object keys are strings; the client restores the integer question indexes
+    return web.json_response(state)
+
+
+@routes.post("/sessions/{session_id}/quiz")
+async def start_quiz(request: web.Request):
+    session_id = await _owned_session(request)
+    body = await _body(request)
+    if not isinstance(body.get("quiz_data"), list):
+        return _error(400, "quiz_data must be a list")
+    await _run(request, request.app[REGISTRY].sessions.start_quiz, session_id, body["quiz_data"],
+               current_index=body.get("current_index", 0), user_answers=body.get("user_answers"),
+               score=body.get("score", 0), answer_submitted=body.get("answer_submitted", False))
+    return web.json_response({"ok": True})
+
+
+@routes.post("/sessions/{session_id}/answers")
+async def record_answer(request: web.Request):
+    session_id = await _owned_session(request)
+    body = await _body(request)
+    try:
+        question_index = int(body["question_index"])
+        answer, score = body["answer"], body["score"]
+    except (KeyError, TypeError, ValueError):
+        return _error(400, "question_index, answer and score are required")
+    await _run(request, request.app[REGISTRY].sessions.record_answer, session_id, question_index, answer, score,
+               answer_submitted=body.get("answer_submitted", True))
+    return web.json_response({"ok": True})
+
+
+@routes.put("/sessions/{session_id}/progress")
+async def update_progress(request: web.Request):
+    session_id = await _owned_session(request)
+    body = await _body(request)
+    try:
+        args = (int(body["current_index"]), body["score"], bool(body["answer_submitted"]))
+    except (KeyError, TypeError, ValueError):
+        return _error(400, "current_index, score and answer_submitted are required")
+    await _run(request, request.app[REGISTRY].sessions.update_progress, session_id, *args)
+    return web.json_response({"ok": True})
+
+
+@routes.post("/ingest")
+async def ingest(request: web.Request):
+    """
+    Multipart upload: a `session_id` field and one or more `files` parts. Returns a job handle.
+    A session id that doesn't exist yet is created for the caller.
+    """
+    if not request.content_type.startswith("multipart/"):
+        return _error(400, "Expected a multipart/form-data upload")
+    max_upload = request.app[MAX_UPLOAD]
+    session_id, files, total = None, [], 0
+    reader = await request.multipart()
+    async for part in reader:
+        if part.name == "session_id":
+            session_id = (await part.text()).strip() or None
+        elif part.filename:
+            data = await part.read()
+            total += len(data)
+            if total > max_upload:
+                return _error(413, f"Upload exceeds {max_upload // (1024 * 1024)} MB")
+            # Kept in memory and parsed from there, like uploads in the Streamlit app
+            files.append((part.filename, io.BytesIO(data)))
+    if not files:
+        return _error(400, "No files uploaded")
+
+    registry, user = request.app[REGISTRY], request[USER]
+    if session_id:
+        owner = await _run(request, registry.sessions.get_session_owner, session_id)
+        if owner is None:
+            # Uploading into a new session creates it for the caller, as the Streamlit app does
+            await _run(request, registry.sessions.create_session, user, f"Quiz: {files[0][0]}", session_id)
+            owner = await _run(request, registry.sessions.get_session_owner, session_id)
+        if owner != user:
+            return _error(404, "Session not found")
+
+    def run():
+        registry.ingestion.ingest_buffers(files, username=user, session_id=session_id)
+        # Quizzes prefetched before this upload don't cover the new documents
+        registry.prefetcher.invalidate(session_id)
+        return {"files": [name for name, _ in files], "session_id": session_id}
+
+    return await _start_job(request, "ingest", run)
+
+
+@routes.get("/jobs/{job_id}")
+async def get_job(request: web.Request):
+    job = await _run(request, request.app[JOBS].get, request.match_info["job_id"], request[USER])
+    if not job:
+        return _error(404, "Job not found")
+    return web.json_response({key: job[key] for key in ("id", "kind", "status", "result", "error",
+                                                        "created_at", "updated_at")})
+
+
+@routes.post("/topics")
+async def discover_topics(request: web.Request):
+    body = await _body(request)
+    topics = await _run(request, request.app[REGISTRY].topics.discover_topics, username=request[USER],
+                        session_id=await _body_session(request, body))
+    return web.json_response({"topics": topics})
+
+
+async def _quiz_args(request: web.Request, body: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(topic=body.get("topic") or "General Knowledge", difficulty=body.get("difficulty", "Medium"),
+                username=request[USER], session_id=await _body_session(request, body))
+
+
+@routes.post("/quiz")
+async def generate_quiz(request: web.Request):
+    """Generates a whole quiz in the background. Poll the returned job for the questions."""
+    body = await _body(request)
+    generator = request.app[REGISTRY].generator
+    quiz_args = await _quiz_args(request, body)
+    return await _start_job(request, "quiz", lambda: generator.generate_quiz(
+        num_chunks=body.get("num_chunks"), exclude_questions=body.get("exclude_questions"), **quiz_args))
+
+
+@routes.post("/quiz/stream")
+async def stream_quiz(request: web.Request):
+    """
+    Streams a quiz as newline-delimited JSON: one {"type": "batch", "items": [...]} line per
+    LLM batch, then {"type": "done", "questions": n} (or {"type": "error", ...}).
+    """
+    body = await _body(request)
+    generator = request.app[REGISTRY].generator
+    quiz_args = await _quiz_args(request, body)
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def produce():
+        # The batch generator holds tracing/usage context, so it is consumed on this one thread
+        batches = None
+        try:
+            batches = generator.iter_quiz_batches(num_chunks=body.get("num_chunks"),
+                                                  exclude_questions=body.get("exclude_questions"), **quiz_args)
+            for batch in batches:
+                loop.call_soon_threadsafe(queue.put_nowait, ("batch", batch))
+                if cancelled.is_set():
+                    break
+            loop.call_soon_threadsafe(queue.put_nowait, ("done", None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, ("error", e))
+        finally:
+            if hasattr(batches, "close"):
+                batches.close()
+
+    producer = loop.run_in_executor(request.app[EXECUTOR], produce)
+    kind, payload = await queue.get()
+    if kind == "error":
+        # Nothing sent yet, so the failure can still be reported through the status code
+        await producer
+        if isinstance(payload, BudgetExceeded):
+            return _error(429, str(payload))
+        return _error(500, f"Quiz generation failed: {payload}")
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    questions = 0
+    try:
+        while True:
+            if kind == "batch":
+                questions += len(payload)
+                line = {"type": "batch", "items": payload}
+            elif kind == "done":
+                line = {"type": "done", "questions": questions}
+            else:
+                line = {"type": "error", "status": 429 if isinstance(payload, BudgetExceeded) else 500,
+                        "error": str(payload)}
+            await response.write((json.dumps(line) + "\n").encode("utf-8"))
+            if kind != "batch":
+                break
+            kind, payload = await queue.get()
+    except (ConnectionResetError, asyncio.CancelledError):
+        # Client went away: stop generating after the current batch
+        cancelled.set()
+        raise
+    await producer
+    await response.write_eof()
+    return response
+
+
+@routes.post("/quiz/prefetch")
+async def prefetch_quiz(request: web.Request):
+    """
+    Schedules the next quiz for these settings. Prefetched quizzes live in the worker process
+    that generated them, so route each user to one worker (sticky on the user header) to hit them.
+    """
+    body = await _body(request)
+    quiz_args = await _quiz_args(request, body)
+    scheduled = await _run(request, request.app[REGISTRY].prefetcher.prefetch,
+                           exclude_questions=body.get("exclude_questions"), num_chunks=body.get("num_chunks"),
+                           **quiz_args)
+    return web.json_response({"scheduled": scheduled})
+
+
+@routes.post("/quiz/take")
+async def take_prefetched(request: web.Request):
+    body = await _body(request)
+    quiz_args = await _quiz_args(request, body)
+    wait = body.get("wait")
+    quiz = await _run(request, request.app[REGISTRY].prefetcher.take,
+                      wait=float(wait) if wait is not None else None, **quiz_args)
+    return web.json_response({"quiz": quiz})
+
+
+@routes.post("/evaluate")
+async def evaluate(request: web.Request):
+    body = await _body(request)
+    if not body.get("question") or "user_answer" not in body:
+        return _error(400, "question and user_answer are required")
+    registry, user, session_id = request.app[REGISTRY], request[USER], await _body_session(request, body)
+    chunk_content = body.get("chunk_content")
+    if not chunk_content and body.get("chunk_ref"):
+        chunk_content = await _run(request, registry.generator.resolve_chunk_content,
+                                   {"chunk_ref": body["chunk_ref"]}, user, session_id)
+    result = await _run(request, registry.evaluator.evaluate_answer, body["question"], body["user_answer"],
+                        chunk_content or "", body.get("keywords") or [], username=user, session_id=session_id)
+    return web.json_response(result)
+
+
+@routes.get("/usage")
+async def usage(request: web.Request):
+    tracker = get_usage_tracker()
+    budget = await _run(request, tracker.check, request[USER])
+    totals = await _run(request, tracker.usage_for, request[USER])
+    return web.json_response({"budget": budget.to_dict(), "usage": totals})
+
+
+def create_app(registry: ManagerRegistry = None, job_store: JobStore = None, token: str = None,
+               executor_workers: int = 8, max_upload_mb: int = None) -> web.Application:
+    """
+    Builds the API application. Blocking manager calls run on a thread pool of
+    `executor_workers`; `token` (default: KNOWVAL_API_TOKEN) is required as a Bearer token.
+    """
+    app = web.Application(middlewares=[identity_middleware])
+    owns_registry = registry is None
+    app[REGISTRY] = registry or ManagerRegistry()
+    app[JOBS] = job_store or JobStore(os.getenv("KNOWVAL_JOBS_DB", "jobs.db"))
+    app[EXECUTOR] = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix="api")
+    app[TOKEN] = token if token is not None else os.getenv("KNOWVAL_API_TOKEN")
+    app[MAX_UPLOAD] = (max_upload_mb or int(os.getenv("KNOWVAL_API_MAX_UPLOAD_MB", DEFAULT_MAX_UPLOAD_MB))) * 1024 * 1024
+    app[TASKS] = set()
+    app.add_routes(routes)
+
+    async def on_startup(app):
+        if owns_registry:
+            app[REGISTRY].start_background_tasks()
+        orphaned = await asyncio.get_running_loop().run_in_executor(app[EXECUTOR], app[JOBS].reap)
+        if orphaned:
+            print(f"Marked {orphaned} jobs of exited workers as failed")
+
+    async def on_cleanup(app):
+        if app[TASKS]:
+            await asyncio.gather(*app[TASKS], return_exceptions=True)
+        app[EXECUTOR].shutdown(wait=True)
+        if owns_registry:
+            app[REGISTRY].close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def _serve(host: str, port: int, executor_workers: int, reuse_port: bool):
+    web.run_app(create_app(executor_workers=executor_workers), host=host, port=port, reuse_port=reuse_port,
+                print=lambda msg: print(f"[worker {os.getpid()}] {msg}"))
+
+
+if __name__ == "__main__":
+    import argparse
+    import multiprocessing
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Serve the Knowval HTTP API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes sharing the port (SO_REUSEPORT)")
+    parser.add_argument("--threads", type=int, default=8, help="Blocking-call threads per worker")
+    args = parser.parse_args()
+
+    if not os.getenv("KNOWVAL_API_TOKEN"):
+        print(f"Warning: KNOWVAL_API_TOKEN is not set; any caller can act as any user via {USER_HEADER}")
+
+    if args.workers <= 1:
+        _serve(args.host, args.port, args.threads, reuse_port=False)
+    else:
+        # Each worker has its own event loop and managers; the kernel balances connections across them
+        context = multiprocessing.get_context("spawn")
+        workers = [context.Process(target=_serve, args=(args.host, args.port, args.threads, True))
+                   for _ in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
@@ -8,24 +8,44 @@ load_dotenv()
 import streamlit as st
 import extra_streamlit_components as stx
 import os
-import tempfile
 import uuid
 import datetime
-from auth import AuthManager
-from ingestion import IngestionManager
-from generator import QuizGenerator
-from evaluator import AnswerEvaluator
-from topic_discovery import TopicManager
+import atexit
+from model_router import get_model_router
+from resources import ManagerRegistry
+from tracing import tracer
+from usage import BudgetExceeded
 
-from session_manager import SessionManager
 
-# Initialize Managers
-auth_manager = AuthManager()
-ingestion_manager = IngestionManager()
-quiz_generator = QuizGenerator()
-evaluator = AnswerEvaluator()
-topic_manager = TopicManager()
-session_manager = SessionManager()
+@st.cache_resource
+def get_registry():
+    """One set of managers per process, shared by every browser session and rerun."""
+    api_url = os.getenv("KNOWVAL_API_URL")
+    if api_url:
+        # Headless mode: the managers run in api_server.py and this app is one of its clients
+        from api_client import RemoteRegistry
+        return RemoteRegistry(api_url, current_user=lambda: st.session_state.get('username'))
+    registry = ManagerRegistry()
+    # Deleting a session also deletes its chunks; a background job sweeps chunks of unsaved sessions
+    registry.start_background_tasks()
+    atexit.register(registry.close)
+    return registry
+
+
+# Initialize Managers. The LangChain/Chroma-backed ones are built on first use, so a user who
+# only logs in or resumes a saved quiz never waits for those imports.
+registry = get_registry()
+auth_manager = registry.auth
+ingestion_manager = registry.lazy("ingestion")
+quiz_generator = registry.lazy("generator")
+evaluator = registry.lazy("evaluator")
+topic_manager = registry.lazy("topics")
+quiz_prefetcher = registry.lazy("prefetcher")
+# Quiz progress is persisted by a background write-behind queue so clicks don't wait on disk
+session_manager = registry.sessions
+
+# Number of sessions listed in the sidebar per page
+SESSION_PAGE_SIZE = 50
 
 # Initialize Cookie Manager
 cookie_manager = stx.CookieManager()
@@ -104,6 +124,32 @@ def login_page():
             else:
                 st.error("Registration failed.")
 
+def debug_panel():
+    """Per-stage timings and the latest traces recorded in this process."""
+    with st.expander("Pipeline traces", expanded=True):
+        summary = tracer.summary()
+        if not summary:
+            st.caption("No traces recorded yet.")
+            return
+        st.dataframe(summary, use_container_width=True)
+        routes = get_model_router().stats()
+        if routes:
+            st.caption("Model routes")
+            st.dataframe(routes, use_container_width=True)
+        for trace in tracer.recent_traces(limit=5):
+            st.markdown(f"**{trace['name']}**: {trace['duration_ms']:.0f} ms")
+            depth = {}
+            lines = []
+            for s in trace['spans']:
+                depth[s['span_id']] = depth.get(s['parent_id'], -1) + 1
+                attributes = ", ".join(f"{k}={v}" for k, v in s['attributes'].items())
+                error = f"  ERROR {s['error']}" if s['error'] else ""
+                lines.append(f"{'  ' * depth[s['span_id']]}{s['name']}  {s['duration_ms']:.1f} ms  {attributes}{error}")
+            st.code("\n".join(lines), language=None)
+        if st.button("Clear traces"):
+            tracer.clear()
+            st.rerun()
+
 def dashboard_page():
     st.title(f"Welcome, {st.session_state['username']}!")
     
@@ -117,8 +163,20 @@ def dashboard_page():
         st.session_state['quiz_data'] = []
         st.rerun()
             
-    # List Existing Sessions
-    user_sessions = session_manager.get_user_sessions(st.session_state['username'])
+    # List Existing Sessions (one cached page at a time, optionally filtered by name)
+    session_search = st.sidebar.text_input("Search sessions", key="session_search").strip()
+    session_limit = st.session_state.get('session_list_limit', SESSION_PAGE_SIZE)
+    user_sessions = session_manager.list_user_sessions(
+        st.session_state['username'], limit=session_limit, search=session_search or None
+    )
+    total_sessions = session_manager.count_user_sessions(st.session_state['username'], search=session_search or None)
+    
+    # Keep the current saved session selectable even if it is outside the loaded page or search results
+    listed_ids = {s['id'] for s in user_sessions}
+    if st.session_state.get('session_saved') and st.session_state['current_session_id'] and st.session_state['current_session_id'] not in listed_ids:
+        current = session_manager.get_session(st.session_state['current_session_id'])
+        if current:
+            user_sessions.append(current)
     session_options = {s['id']: f"{s['name']} ({s['created_at'][:10]})" for s in user_sessions}
     
     # Auto-select most recent if none selected
@@ -142,6 +200,10 @@ def dashboard_page():
             index=display_options.index(st.session_state['current_session_id']) if st.session_state['current_session_id'] in display_options else 0
         )
         
+        if total_sessions > session_limit and st.sidebar.button("Show more sessions"):
+            st.session_state['session_list_limit'] = session_limit + SESSION_PAGE_SIZE
+            st.rerun()
+        
         if selected_session_id != st.session_state['current_session_id']:
             st.session_state['current_session_id'] = selected_session_id
             st.session_state['session_saved'] = True
@@ -170,10 +232,35 @@ def dashboard_page():
     current_session_name = session_options.get(st.session_state['current_session_id'], "New Quiz Session (Unsaved)")
     st.markdown(f"**Current Session:** {current_session_name}")
 
+    if st.session_state.get('session_saved') and st.sidebar.button("Delete Session"):
+        session_manager.delete_session(st.session_state['current_session_id'])
+        st.session_state['current_session_id'] = None
+        st.session_state['session_saved'] = False
+        st.session_state['quiz_data'] = []
+        st.session_state['page'] = "dashboard"
+        st.rerun()
+
+    with st.sidebar.expander("Usage (last 24h)"):
+        budget = registry.usage.check(st.session_state['username'])
+        st.write(f"{budget.tokens:,} tokens, ${budget.cost:.4f}")
+        if budget.token_limit or budget.cost_limit:
+            st.progress(min(1.0, budget.used_fraction), text=f"{budget.used_fraction:.0%} of daily budget")
+
+    with st.sidebar.expander("System health"):
+        if st.button("Run checks"):
+            for component, status in registry.health().items():
+                icon = "✅" if status["ok"] else "❌"
+                st.write(f"{icon} **{component}** ({status['latency_ms']} ms): {status['detail']}")
+
+    if st.sidebar.checkbox("Show pipeline traces", key="show_traces"):
+        debug_panel()
+
     # Sidebar for Logout
     st.sidebar.markdown("---")
-    
+
     if st.sidebar.button("Logout"):
+        # Make sure queued quiz progress is on disk before the session ends
+        session_manager.flush()
         st.session_state['logged_in'] = False
         st.session_state['page'] = "login"
         st.session_state['current_session_id'] = None
@@ -193,16 +280,7 @@ def dashboard_page():
         if current_file_names != last_file_names:
             st.session_state['last_uploaded_files'] = current_file_names
             
-            file_paths = []
             with st.spinner("Auto-ingesting documents..."):
-                # Save uploaded files to temp directory
-                temp_dir = tempfile.mkdtemp()
-                for uploaded_file in uploaded_files:
-                    path = os.path.join(temp_dir, uploaded_file.name)
-                    with open(path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                    file_paths.append(path)
-                
                 # Save session if not saved
                 if not st.session_state.get('session_saved'):
                     session_name = f"Quiz: {uploaded_files[0].name}"
@@ -213,11 +291,18 @@ def dashboard_page():
                     )
                     st.session_state['session_saved'] = True
 
-                ingestion_manager.ingest_files(
-                    file_paths, 
-                    username=st.session_state['username'],
-                    session_id=st.session_state['current_session_id']
-                )
+                # Uploads are read straight from memory; nothing is written to disk
+                try:
+                    ingestion_manager.ingest_buffers(
+                        [(uploaded_file.name, uploaded_file) for uploaded_file in uploaded_files],
+                        username=st.session_state['username'],
+                        session_id=st.session_state['current_session_id']
+                    )
+                except BudgetExceeded:
+                    st.error("You've reached your usage limit for today. Please try again later.")
+                    return
+                # Quizzes prefetched before this upload don't cover the new documents
+                quiz_prefetcher.invalidate(st.session_state['current_session_id'])
                 st.success("Ingestion successful!")
                 st.rerun() # Rerun to update session list name
 
@@ -247,17 +332,33 @@ def dashboard_page():
              session_manager.update_session_name(st.session_state['current_session_id'], topic)
         
     difficulty = st.selectbox("Difficulty", ["Easy", "Medium", "Hard"], index=1)
+    prefetch_next = st.checkbox(
+        "Prepare the next quiz in the background", key="prefetch_next",
+        help="While you answer, a follow-up quiz with the same topic and difficulty is generated so it starts instantly."
+    )
     
     if st.button("Start Quiz"):
         with st.spinner("Generating Quiz..."):
-            # Pass num_chunks=None for dynamic sizing
-            quiz = quiz_generator.generate_quiz(
-                topic, 
-                num_chunks=None, 
-                difficulty=difficulty, 
+            quiz_args = dict(
+                topic=topic,
+                difficulty=difficulty,
                 username=st.session_state['username'],
                 session_id=st.session_state['current_session_id']
             )
+            # A prefetched quiz costs nothing more, so it is served even when the budget is used up
+            quiz = quiz_prefetcher.take(**quiz_args) if prefetch_next else None
+            budget = registry.usage.check(st.session_state['username'])
+            if not quiz:
+                try:
+                    # Pass num_chunks=None for dynamic sizing
+                    quiz = quiz_generator.generate_quiz(num_chunks=None, **quiz_args)
+                except BudgetExceeded:
+                    st.error("You've reached your usage limit for today. Please try again later.")
+                    return
+            if budget.degraded:
+                st.warning("You're close to your daily usage limit, so quizzes are shorter for now.")
+            if quiz and prefetch_next and not budget.degraded:
+                quiz_prefetcher.prefetch(exclude_questions=[q['question'] for q in quiz], **quiz_args)
             if quiz:
                 st.session_state['quiz_data'] = quiz
                 st.session_state['current_question_index'] = 0
@@ -266,15 +367,11 @@ def dashboard_page():
                 st.session_state['answer_submitted'] = False
                 st.session_state['page'] = "quiz"
                 
-                # Save initial state
+                # Save initial state (the questions are only written here)
                 if st.session_state.get('session_saved'):
-                    session_manager.save_quiz_state(
+                    session_manager.start_quiz(
                         st.session_state['current_session_id'],
-                        st.session_state['quiz_data'],
-                        st.session_state['current_question_index'],
-                        st.session_state['user_answers'],
-                        st.session_state['score'],
-                        st.session_state['answer_submitted']
+                        st.session_state['quiz_data']
                     )
                 
                 st.rerun()
@@ -326,15 +423,13 @@ def quiz_page():
                 
                 st.session_state['answer_submitted'] = True
                 
-                # Save state after answer submission
+                # Save only the new answer and score
                 if st.session_state.get('session_saved'):
-                    session_manager.save_quiz_state(
+                    session_manager.record_answer(
                         st.session_state['current_session_id'],
-                        st.session_state['quiz_data'],
-                        st.session_state['current_question_index'],
-                        st.session_state['user_answers'],
-                        st.session_state['score'],
-                        st.session_state['answer_submitted']
+                        idx,
+                        st.session_state['user_answers'][idx],
+                        st.session_state['score']
                     )
                 
                 st.rerun()
@@ -353,13 +448,11 @@ def quiz_page():
                 st.session_state['current_question_index'] += 1
                 st.session_state['answer_submitted'] = False
                 
-                # Save state
+                # Save only the cursor
                 if st.session_state.get('session_saved'):
-                    session_manager.save_quiz_state(
+                    session_manager.update_progress(
                         st.session_state['current_session_id'],
-                        st.session_state['quiz_data'],
                         st.session_state['current_question_index'],
-                        st.session_state['user_answers'],
                         st.session_state['score'],
                         st.session_state['answer_submitted']
                     )
@@ -1,21 +1,23 @@
 import sqlite3
 import hashlib
 import re
-import dns.resolver
+from db import get_pool
+from lazy_imports import LazyImport
+
+# Only needed to validate a new account's email domain
+dns_resolver = LazyImport("dns.resolver")
 
 class AuthManager:
     def __init__(self, db_path="users.db"):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
         self._init_db()
 
     def _init_db(self):
         """Initialize the users table."""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS users
-                     (username TEXT PRIMARY KEY, password TEXT)''')
-        conn.commit()
-        conn.close()
+        with self.pool.transaction() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS users
+                         (username TEXT PRIMARY KEY, password TEXT)''')
 
     def _hash_password(self, password):
         """Hash password using SHA-256."""
@@ -31,9 +33,9 @@ class AuthManager:
         # 2. Domain MX Record Check
         domain = email.split('@')[1]
         try:
-            dns.resolver.resolve(domain, 'MX')
+            dns_resolver.resolve(domain, 'MX')
             return True, "Valid"
-        except (dns.resolver.NoAnswer, dns.resolver.NXDOMAIN):
+        except (dns_resolver.NoAnswer, dns_resolver.NXDOMAIN):
             return False, f"Domain '{domain}' does not exist or has no mail server."
         except Exception as e:
             # Fallback: If DNS check fails due to network, assume valid to avoid blocking users
@@ -51,12 +53,9 @@ class AuthManager:
             return msg
             
         try:
-            conn = sqlite3.connect(self.db_path)
-            c = conn.cursor()
             hashed_pw = self._hash_password(password)
-            c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed_pw))
-            conn.commit()
-            conn.close()
+            with self.pool.transaction() as conn:
+                conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed_pw))
             return True
         except sqlite3.IntegrityError:
             return False
@@ -69,10 +68,7 @@ class AuthManager:
         # Normalize username
         username = username.strip().lower()
         
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
         hashed_pw = self._hash_password(password)
-        c.execute("SELECT * FROM users WHERE username=? AND password=?", (username, hashed_pw))
-        user = c.fetchone()
-        conn.close()
+        with self.pool.read() as conn:
+            user = conn.execute("SELECT 1 FROM users WHERE username=? AND password=?", (username, hashed_pw)).fetchone()
         return user is not None
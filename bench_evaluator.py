@@ -0,0 +1,105 @@
+"""
+Benchmarks the local lexical pre-scorer against LLM grading.
+
+Usage:
+    python bench_evaluator.py samples.jsonl [--live] [--calibrate] [--output report.json]
+
+Each line of the samples file is a JSON object with "question", "user_answer",
+"chunk_content", "keywords" and, optionally, a reference "llm_score". With --live,
+samples without a reference score are graded by the LLM evaluator first (requires
+OPENAI_API_KEY). --calibrate fits the raw->score line and saves it to the file the
+evaluator's pre-scorer loads (see lexical_scorer.load_calibration).
+"""
+import argparse
+import json
+import time
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from lexical_scorer import LexicalScorer, load_calibration, save_calibration
+
+
+def load_samples(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def grade_missing_with_llm(samples):
+    from evaluator import AnswerEvaluator
+    evaluator = AnswerEvaluator(use_pre_scorer=False)
+    for sample in samples:
+        if sample.get("llm_score") is None:
+            result = evaluator.evaluate_with_llm(
+                sample["question"], sample["user_answer"], sample["chunk_content"], sample["keywords"]
+            )
+            sample["llm_score"] = result.get("score", 0)
+
+
+def run_benchmark(samples, scorer):
+    """Compares local decisions with reference LLM scores and returns a metrics dict."""
+    local, escalated, raw_pairs = [], 0, []
+    start = time.perf_counter()
+    for sample in samples:
+        result = scorer.prescore(sample["question"], sample["user_answer"], sample["chunk_content"], sample["keywords"])
+        raw_pairs.append((result["raw_score"], sample["llm_score"]))
+        if result["decision"] == "local":
+            local.append((result["score"], sample["llm_score"]))
+        else:
+            escalated += 1
+    elapsed = time.perf_counter() - start
+
+    n_local = len(local)
+    errors = [abs(pred - ref) for pred, ref in local]
+    return {
+        "samples": len(samples),
+        "graded_locally": n_local,
+        "escalated": escalated,
+        "escalation_rate": escalated / len(samples) if samples else 0.0,
+        "local_mae": sum(errors) / n_local if n_local else None,
+        "local_within_2": sum(1 for e in errors if e <= 2) / n_local if n_local else None,
+        "local_pass_fail_agreement": (
+            sum(1 for pred, ref in local if (pred >= 5) == (ref >= 5)) / n_local if n_local else None
+        ),
+        "avg_prescore_ms": elapsed * 1000 / len(samples) if samples else 0.0,
+        "raw_pairs": raw_pairs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("samples", help="JSONL file of graded answers")
+    parser.add_argument("--live", action="store_true", help="Grade samples missing 'llm_score' with the LLM")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="Fit the raw->score calibration and save it where the evaluator loads it "
+                             "(KNOWVAL_SCORER_CALIBRATION, default scorer_calibration.json)")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    samples = load_samples(args.samples)
+    if args.live:
+        grade_missing_with_llm(samples)
+    unscored = [s for s in samples if s.get("llm_score") is None]
+    if unscored:
+        parser.error(f"{len(unscored)} samples have no 'llm_score'; rerun with --live")
+
+    scorer = LexicalScorer()
+    report = run_benchmark(samples, scorer)
+    if args.calibrate:
+        slope, intercept = scorer.calibrate(report["raw_pairs"])
+        report["calibration"] = {"slope": slope, "intercept": intercept}
+        # Keep a tuned off-topic threshold; only the calibration line is refitted here
+        settings = {**load_calibration(), **report["calibration"]}
+        report["calibration_file"] = save_calibration(settings)
+        report["calibrated"] = {k: v for k, v in run_benchmark(samples, scorer).items() if k != "raw_pairs"}
+    del report["raw_pairs"]
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
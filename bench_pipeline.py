@@ -0,0 +1,347 @@
+"""
+End-to-end benchmark of ingestion, retrieval and quiz generation.
+
+Usage:
+    python bench_pipeline.py [--pages 40] [--output results.json] [--baseline previous.json]
+
+Builds synthetic corpora from sample.txt (TXT, generated PDF and DOCX, and a ZIP of them),
+ingests them through the real managers into a temporary Chroma store and measures load
+pages/s, split and store chunks/s, embedding batch throughput, retrieval latency, topic
+discovery, time to first question, full quiz latency and peak RSS.
+
+By default the LLM and embeddings are served by fake_openai.py in-process, so results are
+reproducible and need no network; --live uses the configured OpenAI API instead. With
+--baseline, metrics more than --tolerance worse than the baseline are reported and the
+exit status is 1.
+"""
+__import__('pysqlite3')
+import sys
+sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import tempfile
+import time
+import zipfile
+from typing import Dict, List, Tuple
+
+from dotenv import load_dotenv
+load_dotenv()
+
+USER = "bench-user"
+TOPICS = ["Python design philosophy", "Python history", "Dynamic typing and garbage collection"]
+# Metric name suffix -> whether a larger value is better
+DIRECTIONS = (("_per_s", True), ("_ms", False), ("_s", False), ("_mb", False))
+
+
+# --- synthetic corpora --------------------------------------------------------
+
+def synthetic_text(source: str, pages: int, seed: int, chars_per_page: int = 3000) -> List[str]:
+    """
+    `pages` pages of text made by shuffling the sentences of `source`. Each paragraph carries
+    a unique marker term, so the corpora differ (no deduplication) and retrieval has exact terms.
+    """
+    rng = random.Random(seed)
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", source) if s.strip()]
+    result, paragraph = [], 0
+    for page in range(pages):
+        parts = [f"Section {seed}.{page + 1}"]
+        length = 0
+        while length < chars_per_page:
+            paragraph += 1
+            body = " ".join(rng.choice(sentences) for _ in range(rng.randint(3, 6)))
+            text = f"{body} Marker term bench{seed}x{paragraph} appears here."
+            parts.append(text)
+            length += len(text)
+        result.append("\n\n".join(parts))
+    return result
+
+
+def _pdf_escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").encode("latin-1", "replace").decode("latin-1")
+
+
+def make_pdf(pages: List[str]) -> bytes:
+    """A minimal text PDF, one page per string, readable by pypdf (no PDF library needed)."""
+    bodies = [b"", b"<< /Type /Catalog /Pages 2 0 R >>", b"",
+              b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        lines = []
+        for paragraph in text.split("\n"):
+            words, line = paragraph.split(), ""
+            for word in words:
+                if len(line) + len(word) > 95:
+                    lines.append(line)
+                    line = ""
+                line = f"{line} {word}".strip()
+            lines.append(line)
+        stream = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({_pdf_escape(l)}) Tj T*" for l in lines[:70]) + " ET"
+        stream = stream.encode("latin-1")
+        bodies.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_ref = len(bodies) - 1
+        bodies.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                      b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref)
+        kids.append(len(bodies) - 1)
+    bodies[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        " ".join(f"{k} 0 R" for k in kids).encode(), len(kids))
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = [0]
+    for number, body in enumerate(bodies[1:], start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % len(bodies))
+    for offset in offsets[1:]:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(bodies), xref))
+    return out.getvalue()
+
+
+def make_docx(pages: List[str]) -> bytes:
+    """A minimal DOCX (just word/document.xml and its package parts), readable by docx2txt."""
+    from xml.sax.saxutils import escape
+    paragraphs = "".join(f"<w:p><w:r><w:t xml:space=\"preserve\">{escape(p)}</w:t></w:r></w:p>"
+                         for page in pages for p in page.split("\n\n"))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml",
+                      '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                      '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                      '<Default Extension="xml" ContentType="application/xml"/>'
+                      '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>')
+        docx.writestr("_rels/.rels",
+                      '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                      '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/></Relationships>')
+        docx.writestr("word/document.xml",
+                      '<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                      f"<w:body>{paragraphs}</w:body></w:document>")
+    return buffer.getvalue()
+
+
+def make_zip(files: List[Tuple[str, bytes]]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files:
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def build_corpora(pages: int, source_path: str = "sample.txt") -> Dict[str, Tuple[str, bytes]]:
+    """One upload per format, each `pages` pages long: format -> (file name, bytes)."""
+    with open(source_path, encoding="utf-8") as f:
+        source = f.read()
+    half = max(1, pages // 2)
+    return {
+        "txt": ("corpus.txt", "\n\n".join(synthetic_text(source, pages, seed=1)).encode("utf-8")),
+        "pdf": ("corpus.pdf", make_pdf(synthetic_text(source, pages, seed=2))),
+        "docx": ("corpus.docx", make_docx(synthetic_text(source, pages, seed=3))),
+        "zip": ("corpus.zip", make_zip([
+            ("part1.txt", "\n\n".join(synthetic_text(source, half, seed=4)).encode("utf-8")),
+            ("part2.pdf", make_pdf(synthetic_text(source, half, seed=5))),
+        ])),
+    }
+
+
+# --- measurements ---------------------------------------------------------------
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def bench_ingestion(ingestion, corpora) -> Tuple[Dict[str, float], List[str]]:
+    """Load, split and store timings per format. Returns the metrics and every chunk's text."""
+    metrics, texts = {}, []
+    for fmt, (name, data) in corpora.items():
+        start = time.perf_counter()
+        docs = ingestion.load_buffer(name, data)
+        loaded = time.perf_counter()
+        chunks = ingestion.split_documents(docs)
+        split = time.perf_counter()
+        ingestion.store_in_vector_db(chunks, USER, f"bench-{fmt}")
+        stored = time.perf_counter()
+        texts.extend(chunk.page_content for chunk in chunks)
+        metrics.update({
+            f"ingest_{fmt}_pages": len(docs),
+            f"ingest_{fmt}_chunks": len(chunks),
+            f"ingest_{fmt}_load_pages_per_s": round(len(docs) / max(loaded - start, 1e-9), 1),
+            f"ingest_{fmt}_split_chunks_per_s": round(len(chunks) / max(split - loaded, 1e-9), 1),
+            f"ingest_{fmt}_store_chunks_per_s": round(len(chunks) / max(stored - split, 1e-9), 1),
+            f"ingest_{fmt}_total_s": round(stored - start, 3),
+        })
+    return metrics, texts
+
+
+def bench_embeddings(embeddings, texts: List[str], batch_sizes=(16, 64, 256)) -> Dict[str, float]:
+    metrics = {}
+    for size in batch_sizes:
+        batch = (texts * (size // max(len(texts), 1) + 1))[:size]
+        start = time.perf_counter()
+        embeddings.embed_documents(batch)
+        metrics[f"embed_batch{size}_texts_per_s"] = round(size / max(time.perf_counter() - start, 1e-9), 1)
+    return metrics
+
+
+def bench_retrieval(router, queries: List[str], rounds: int = 5) -> Dict[str, float]:
+    store, filter_dict = router.scope(USER, "bench-txt")
+    similarity, mmr = [], []
+    for _ in range(rounds):
+        for query in queries:
+            start = time.perf_counter()
+            store.similarity_search(query, k=10, filter=filter_dict)
+            similarity.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            store.max_marginal_relevance_search(query, k=10, fetch_k=40, filter=filter_dict)
+            mmr.append((time.perf_counter() - start) * 1000)
+    return {
+        "retrieval_similarity_p50_ms": round(percentile(similarity, 0.5), 2),
+        "retrieval_similarity_p95_ms": round(percentile(similarity, 0.95), 2),
+        "retrieval_mmr_p50_ms": round(percentile(mmr, 0.5), 2),
+        "retrieval_mmr_p95_ms": round(percentile(mmr, 0.95), 2),
+    }
+
+
+def bench_quiz(generator, topics_manager, runs: int, questions: int) -> Dict[str, float]:
+    start = time.perf_counter()
+    topics_manager.discover_topics(USER, "bench-pdf")
+    metrics = {"discover_topics_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+    first, full, counts = [], [], []
+    for run in range(runs):
+        topic = TOPICS[run % len(TOPICS)]
+        start = time.perf_counter()
+        produced = 0
+        for batch in generator.iter_quiz_batches(topic, num_chunks=questions, username=USER, session_id="bench-txt"):
+            if batch and not produced:
+                first.append((time.perf_counter() - start) * 1000)
+            produced += len(batch)
+        full.append((time.perf_counter() - start) * 1000)
+        counts.append(produced)
+    metrics.update({
+        "quiz_first_question_p50_ms": round(percentile(first, 0.5), 1),
+        "quiz_full_p50_ms": round(percentile(full, 0.5), 1),
+        "quiz_full_max_ms": round(max(full), 1) if full else 0.0,
+        "quiz_questions_avg": round(sum(counts) / len(counts), 1) if counts else 0.0,
+    })
+    return metrics
+
+
+def run_benchmark(workdir: str, pages: int, quiz_runs: int, questions: int) -> Dict[str, float]:
+    from resources import ManagerRegistry
+    registry = ManagerRegistry(persist_directory=os.path.join(workdir, "chroma"),
+                               users_db=os.path.join(workdir, "users.db"),
+                               sessions_db=os.path.join(workdir, "sessions.db"),
+                               documents_db=os.path.join(workdir, "documents.db"),
+                               lexical_db=os.path.join(workdir, "lexical.db"),
+                               vectors_db=os.path.join(workdir, "vectors.db"))
+    try:
+        # Imports, the Chroma client and the first collection are set up outside the timings
+        warmup = registry.ingestion.split_documents(registry.ingestion.load_buffer("warmup.txt", b"Warm up text."))
+        registry.ingestion.store_in_vector_db(warmup, USER, "bench-warmup")
+
+        start = time.perf_counter()
+        corpora = build_corpora(pages)
+        metrics = {"corpus_build_s": round(time.perf_counter() - start, 3)}
+        ingestion_metrics, texts = bench_ingestion(registry.ingestion, corpora)
+        metrics.update(ingestion_metrics)
+        metrics.update(bench_embeddings(registry.router.embeddings, texts))
+        metrics.update(bench_retrieval(registry.router, TOPICS))
+        metrics.update(bench_quiz(registry.generator, registry.topics, quiz_runs, questions))
+        metrics["peak_rss_mb"] = round(peak_rss_mb(), 1)
+        return metrics
+    finally:
+        registry.close()
+
+
+# --- regression check -------------------------------------------------------------
+
+def compare(baseline: Dict[str, float], current: Dict[str, float], tolerance: float) -> List[str]:
+    """Metrics more than `tolerance` (a fraction) worse than the baseline, as readable lines."""
+    regressions = []
+    for name, old in baseline.items():
+        new = current.get(name)
+        direction = next((higher for suffix, higher in DIRECTIONS if name.endswith(suffix)), None)
+        if direction is None or new is None or not old:
+            continue
+        change = (new - old) / abs(old)
+        if (direction and change < -tolerance) or (not direction and change > tolerance):
+            regressions.append(f"{name}: {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=40, help="Pages per synthetic document")
+    parser.add_argument("--quiz-runs", type=int, default=3)
+    parser.add_argument("--questions", type=int, default=10, help="Questions per quiz")
+    parser.add_argument("--live", action="store_true", help="Use the configured OpenAI API instead of the fake")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Fake chat latency (median)")
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0, help="Fake embeddings latency (median)")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--baseline", help="Earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before a metric regresses")
+    parser.add_argument("--verbose", action="store_true", help="Show the managers' own output")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="knowval-bench-")
+    # Usage and rate-limit state stay out of the real databases
+    os.environ["KNOWVAL_USAGE_DB"] = os.path.join(workdir, "usage.db")
+    os.environ.pop("KNOWVAL_RATE_LIMIT_DB", None)
+    server = None
+    if not args.live:
+        from fake_openai import FakeOpenAI, FakeOpenAIServer
+        server = FakeOpenAIServer(FakeOpenAI(latency_ms=args.latency_ms, embed_latency_ms=args.embed_latency_ms)).start()
+        os.environ.update(server.environment())
+    try:
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            metrics = run_benchmark(workdir, args.pages, args.quiz_runs, args.questions)
+    finally:
+        if server:
+            server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "benchmark": "pipeline",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"pages": args.pages, "quiz_runs": args.quiz_runs, "questions": args.questions,
+                   "backend": "live" if args.live else "fake", "latency_ms": args.latency_ms,
+                   "embed_latency_ms": args.embed_latency_ms},
+        "metrics": metrics,
+    }
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f)["metrics"], metrics, args.tolerance)
+        results["regressions"] = regressions
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed beyond {args.tolerance:.0%}:", file=sys.stderr)
+        for line in regressions:
+            print(f"  {line}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
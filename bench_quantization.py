@@ -0,0 +1,250 @@
+"""
+Recall-vs-footprint benchmark of compact (quantized) vector storage.
+
+Usage:
+    python bench_quantization.py [--pages 300] [--quizzes 10] [--output quantization.json]
+
+Ingests a synthetic corpus from sample.txt through the real managers once per storage type
+(plain Chroma, then compact float32, float16 and int8), each in a fresh process. The plain
+run records the retrieval queries the app itself issues (`discover_topics` and
+`generate_quiz` for the discovered topics) and their exact float32 neighbours. Every run
+reports recall@k of those queries and search latency per re-rank factor, and its footprint:
+the Chroma directory and compact index on disk, the memory of the cached codes, and the
+process RSS once the queries ran.
+
+By default the LLM and embeddings are served by fake_openai.py with --dimensions-sized
+vectors; --live uses the configured OpenAI API, whose embeddings give more representative
+recall figures.
+"""
+__import__('pysqlite3')
+import sys
+sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from bench_pipeline import peak_rss_mb, percentile, synthetic_text
+
+USER = "bench-user"
+SESSION = "bench-quantization"
+RERANK_FACTORS = (0, 2, 4, 8)
+# "none" is the default storage: the vectors in Chroma, searched through its HNSW index
+STORAGE_TYPES = ("none", "float32", "float16", "int8")
+
+
+def _directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+
+def rss_mb() -> float:
+    """Current resident memory; the peak where /proc isn't available."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def record_queries(registry, quizzes: int, questions: int) -> List[Tuple[str, int]]:
+    """(query, k) for every retrieval made by topic discovery and quiz generation on the corpus."""
+    queries: List[Tuple[str, int]] = []
+
+    def recording(retriever):
+        search = retriever.search
+
+        def wrapper(query, k, *args, **kwargs):
+            queries.append((query, k))
+            return search(query, k, *args, **kwargs)
+        retriever.search = wrapper
+
+    recording(registry.topics.retriever)
+    recording(registry.generator.retriever)
+    topics = registry.topics.discover_topics(username=USER, session_id=SESSION) or ["General Knowledge"]
+    for topic in topics[:quizzes]:
+        registry.generator.generate_quiz(topic, num_chunks=questions, username=USER, session_id=SESSION)
+    return queries
+
+
+def exact_neighbours(corpus: Dict[str, Any], embedded: List[List[float]], ks: List[int]) -> List[Dict[str, Any]]:
+    """Per query, the exact cosine scores and the k-th best: chunks tied with it count as correct too."""
+    import numpy as np
+    from quantized_index import normalize
+
+    vectors = normalize(corpus["embeddings"])
+    exact = []
+    for query, k in zip(embedded, ks):
+        scores = vectors @ normalize(query)[0]
+        exact.append({"scores": dict(zip(corpus["ids"], scores.tolist())),
+                      "kth": float(np.sort(scores)[::-1][min(k, len(scores)) - 1])})
+    return exact
+
+
+def measure(workdir: str, text: str, storage: str, recorded: Optional[Dict[str, Any]], quizzes: int,
+            questions: int, verbose: bool) -> Dict[str, Any]:
+    """Ingests and searches the corpus with one storage type; runs in its own process."""
+    os.environ["KNOWVAL_VECTOR_QUANTIZATION"] = storage
+    from resources import ManagerRegistry
+    directory = os.path.join(workdir, storage)
+    os.makedirs(directory, exist_ok=True)
+    registry = ManagerRegistry(persist_directory=os.path.join(directory, "chroma"),
+                               users_db=os.path.join(directory, "users.db"),
+                               sessions_db=os.path.join(directory, "sessions.db"),
+                               documents_db=os.path.join(directory, "documents.db"),
+                               lexical_db=os.path.join(directory, "lexical.db"),
+                               vectors_db=os.path.join(directory, "vectors.db"))
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with output:
+            registry.ingestion.ingest_buffers([("corpus.txt", text.encode("utf-8"))], username=USER,
+                                              session_id=SESSION)
+            router, index = registry.router, registry.vectors
+            hashes = router.content_hashes(USER, SESSION)
+            result: Dict[str, Any] = {"storage": storage}
+            if recorded is None:
+                queries = record_queries(registry, quizzes, questions)
+                store, where = router.scope(USER, SESSION)
+                corpus = store.get(where=where, include=["embeddings"])
+                embedded = [router.embed_query(query) for query, _ in queries]
+                recorded = {"queries": queries, "embedded": embedded,
+                            "exact": exact_neighbours(corpus, embedded, [k for _, k in queries])}
+                result.update(recorded, chunks=len(corpus["ids"]), dimensions=len(corpus["embeddings"][0]))
+
+            def search(query, k):
+                if index is None:
+                    store, where = router.scope(USER, SESSION)
+                    return [doc.id for doc in store.similarity_search_by_vector(query, k=k, filter=where)]
+                return index.search(query, k, username=USER, session_id=SESSION, hashes=hashes)
+
+            rows = []
+            for factor in RERANK_FACTORS if storage in ("float16", "int8") else (0,):
+                if index is not None:
+                    index.rerank_factor = factor
+                recalls, latencies = [], []
+                for (_, k), query, exact in zip(recorded["queries"], recorded["embedded"], recorded["exact"]):
+                    start = time.perf_counter()
+                    found = search(query, k)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    scores = exact["scores"]
+                    hits = sum(1 for doc_id in found if scores.get(doc_id, -1.0) >= exact["kth"] - 1e-6)
+                    recalls.append(hits / min(k, len(scores)))
+                rows.append({
+                    "storage": storage, "rerank_factor": factor,
+                    "recall_at_k": round(sum(recalls) / len(recalls), 4), "min_recall": round(min(recalls), 4),
+                    "search_p50_ms": round(percentile(latencies, 0.5), 2),
+                    "search_p95_ms": round(percentile(latencies, 0.95), 2),
+                })
+            chroma = _directory_size(router.persist_directory)
+            sidecar = 0
+            if index is not None:
+                # Steady-state size: the write-ahead log folded back into the database
+                with index.pool.read() as conn:
+                    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                sidecar = index.disk_bytes()
+            result.update(rows=rows, footprint={
+                "chroma_disk_mb": round(chroma / 1e6, 2), "index_disk_mb": round(sidecar / 1e6, 2),
+                "total_disk_mb": round((chroma + sidecar) / 1e6, 2),
+                "codes_mb": round(index.resident_bytes() / 1e6, 3) if index is not None else 0.0,
+                "rss_mb": round(rss_mb(), 1),
+            })
+            return result
+    finally:
+        registry.close()
+
+
+def run_benchmark(workdir: str, pages: int, quizzes: int, questions: int, verbose: bool) -> Dict[str, Any]:
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample.txt"), encoding="utf-8") as f:
+        text = "\n\n".join(synthetic_text(f.read(), pages=pages, seed=7))
+    # A fresh process per storage type, so its RSS holds only what that storage loads
+    context = multiprocessing.get_context("spawn")
+    results, recorded = [], None
+    for storage in STORAGE_TYPES:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(measure, workdir, text, storage, recorded, quizzes, questions, verbose).result()
+        if recorded is None:
+            recorded = {key: result.pop(key) for key in ("queries", "embedded", "exact")}
+            report = {"chunks": result.pop("chunks"), "dimensions": result.pop("dimensions"),
+                      "queries": len(recorded["queries"]),
+                      "query_mix": sorted({query for query, _ in recorded["queries"]})}
+        results.append(result)
+
+    baseline = results[0]["footprint"]
+    rows = []
+    for result in results:
+        footprint = dict(result["footprint"])
+        footprint["disk_vs_chroma"] = round(footprint["total_disk_mb"] / baseline["total_disk_mb"], 3)
+        footprint["rss_vs_chroma"] = round(footprint["rss_mb"] / baseline["rss_mb"], 3)
+        rows.extend({**row, **footprint} for row in result["rows"])
+    return {**report, "results": rows}
+
+
+def print_table(report: Dict[str, Any]):
+    print(f"{report['chunks']} chunks x {report['dimensions']} dims, {report['queries']} queries", file=sys.stderr)
+    print(f"{'storage':<8} {'rerank':>6} {'recall@k':>9} {'min':>6} {'p50 ms':>8} {'p95 ms':>8} {'chroma MB':>10} "
+          f"{'index MB':>9} {'codes MB':>9} {'RSS MB':>8} {'disk':>6} {'RSS':>6}", file=sys.stderr)
+    for row in report["results"]:
+        print(f"{row['storage']:<8} {row['rerank_factor']:>6} {row['recall_at_k']:>9.4f} {row['min_recall']:>6.3f} "
+              f"{row['search_p50_ms']:>8.2f} {row['search_p95_ms']:>8.2f} {row['chroma_disk_mb']:>10.2f} "
+              f"{row['index_disk_mb']:>9.2f} {row['codes_mb']:>9.3f} {row['rss_mb']:>8.1f} "
+              f"{row['disk_vs_chroma']:>6.0%} {row['rss_vs_chroma']:>6.0%}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300, help="Pages in the synthetic corpus")
+    parser.add_argument("--quizzes", type=int, default=10, help="Quizzes generated from the discovered topics (at most)")
+    parser.add_argument("--questions", type=int, default=10, help="Questions per quiz")
+    parser.add_argument("--dimensions", type=int, default=1536, help="Fake embedding size")
+    parser.add_argument("--live", action="store_true", help="Use the configured OpenAI API instead of the fake")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the managers' own output")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="knowval-quant-")
+    # Usage and rate-limit state stay out of the real databases (the worker processes inherit this)
+    os.environ["KNOWVAL_USAGE_DB"] = os.path.join(workdir, "usage.db")
+    os.environ.pop("KNOWVAL_RATE_LIMIT_DB", None)
+    server = None
+    if not args.live:
+        from fake_openai import FakeOpenAI, FakeOpenAIServer
+        server = FakeOpenAIServer(FakeOpenAI(latency_ms=5.0, embed_latency_ms=1.0, dimensions=args.dimensions)).start()
+        os.environ.update(server.environment())
+    try:
+        report = run_benchmark(workdir, args.pages, args.quizzes, args.questions, args.verbose)
+    finally:
+        if server:
+            server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "benchmark": "quantization",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"pages": args.pages, "quizzes": args.quizzes, "questions": args.questions,
+                   "backend": "live" if args.live else "fake",
+                   "dimensions": None if args.live else args.dimensions},
+        **report,
+    }
+    print_table(report)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    """
+    Hands out one persistent SQLite connection per thread for a database file.
+
+    Connections are opened in WAL mode so readers never block on a writer, with a
+    busy timeout so concurrent writers wait instead of failing with "database is locked".
+    Connections run in autocommit mode; use `transaction()` to group writes.
+    """
+
+    def __init__(self, db_path: str, busy_timeout_ms: int = 5000, synchronous: str = "NORMAL"):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # id(conn) -> (weakref to owning thread, conn); used to close connections of dead threads.
+        self._connections = {}
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        return conn
+
+    def _prune_dead_threads(self):
+        """Closes connections whose owning thread has exited. Caller holds the lock."""
+        for key, (thread_ref, conn) in list(self._connections.items()):
+            thread = thread_ref()
+            if thread is None or not thread.is_alive():
+                conn.close()
+                del self._connections[key]
+
+    def get_connection(self):
+        """Returns this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.depth = 0
+            with self._lock:
+                self._prune_dead_threads()
+                self._connections[id(conn)] = (weakref.ref(threading.current_thread()), conn)
+        return conn
+
+    @contextmanager
+    def read(self):
+        """Yields this thread's connection for autocommit reads."""
+        yield self.get_connection()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Yields this thread's connection inside a write transaction.
+        BEGIN IMMEDIATE takes the write lock up front, so the busy timeout applies instead of
+        failing when a read transaction later tries to upgrade. Nested calls join the outer one.
+        """
+        conn = self.get_connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn.execute("BEGIN IMMEDIATE")
+        self._local.depth = 1
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            self._local.depth = 0
+
+    @property
+    def open_connections(self) -> int:
+        with self._lock:
+            return len(self._connections)
+
+    def close_all(self):
+        """Closes every connection opened by this pool, e.g. on shutdown or in tests."""
+        with self._lock:
+            for _, conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str) -> ConnectionPool:
+    """Returns the process-wide pool for a database file, creating it on first use."""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is not None and not os.path.exists(db_path):
+            # The file was removed underneath us; don't keep writing to the unlinked inode.
+            pool.close_all()
+            pool = None
+        if pool is None:
+            pool = ConnectionPool(db_path)
+            _pools[key] = pool
+        return pool
+
+
+def close_all_pools():
+    """Closes every pooled connection in the process."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close_all()
+        _pools.clear()
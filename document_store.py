@@ -0,0 +1,190 @@
+import hashlib
+import time
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+from db import get_pool
+
+
+def content_hash(data) -> str:
+    """SHA-256 of a file's bytes. Accepts bytes-like objects or readable binary streams (rewound afterwards)."""
+    digest = hashlib.sha256()
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        digest.update(data)
+        return digest.hexdigest()
+    if hasattr(data, "getbuffer"):
+        # BytesIO (and Streamlit's UploadedFile) expose their buffer without a copy
+        digest.update(data.getbuffer())
+        return digest.hexdigest()
+    data.seek(0)
+    for block in iter(lambda: data.read(1 << 20), b""):
+        digest.update(block)
+    data.seek(0)
+    return digest.hexdigest()
+
+
+class DocumentStore:
+    """
+    Content-addressed registry of ingested files.
+
+    Each distinct file (by content hash) is parsed and embedded once. A user's session holds
+    a reference to the hash, recording the collection its chunks are stored in: sessions
+    sharing a collection share one copy, and other collections get a copy of the stored
+    embeddings rather than embedding the file again. `documents.collection` names a copy to
+    take them from. A copy is deleted when the last reference in its collection is released.
+    """
+
+    def __init__(self, db_path: str = "documents.db"):
+        self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self._init_db()
+
+    def _init_db(self):
+        with self.pool.transaction() as conn:
+            # chunk_count is NULL while the first uploader is still embedding the file
+            conn.execute('''CREATE TABLE IF NOT EXISTS documents
+                         (content_hash TEXT PRIMARY KEY, name TEXT, size INTEGER, chunk_count INTEGER,
+                          created_at REAL)''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS document_refs
+                         (content_hash TEXT, user_id TEXT, session_id TEXT, name TEXT, created_at REAL,
+                          PRIMARY KEY (user_id, session_id, content_hash))''')
+            for table in ("documents", "document_refs"):
+                columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                if "collection" not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN collection TEXT DEFAULT ''")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_document_refs_hash ON document_refs (content_hash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_document_refs_session ON document_refs (session_id)")
+
+    def acquire(self, digest: str, user_id: str, session_id: str, name: str, size: int = None,
+                collection: str = "") -> bool:
+        """
+        Adds a (user, session) reference to a file stored in `collection`. Returns True if the
+        file is new and the caller must embed it (then call `mark_ready`, or `abort` on failure).
+        """
+        now = time.time()
+        with self.pool.transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO document_refs (content_hash, user_id, session_id, name, created_at, "
+                         "collection) VALUES (?, ?, ?, ?, ?, ?)",
+                         (digest, user_id or "", session_id or "", name, now, collection))
+            return self._claim(conn, digest, name, size, collection)
+
+    @staticmethod
+    def _claim(conn, digest: str, name: str, size: Optional[int], collection: str) -> bool:
+        return conn.execute("INSERT OR IGNORE INTO documents (content_hash, name, size, chunk_count, created_at, "
+                            "collection) VALUES (?, ?, ?, NULL, ?, ?)",
+                            (digest, name, size, time.time(), collection)).rowcount == 1
+
+    def wait_until_ready(self, digest: str, name: str, size: int = None, poll: float = 0.5,
+                         stale_after: float = 600, collection: str = "", timeout: float = None) -> bool:
+        """
+        Waits while another uploader embeds the file. Returns False once its chunks are ready, or
+        True if the caller must embed it instead: the owner aborted, or its claim is older than
+        `stale_after` seconds (a crashed upload). Deterministic chunk ids make a takeover safe.
+        Raises TimeoutError after `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.pool.transaction() as conn:
+                row = conn.execute("SELECT chunk_count, created_at FROM documents WHERE content_hash = ?",
+                                   (digest,)).fetchone()
+                if row is None:
+                    # The owner aborted; the first waiter to claim the file embeds it
+                    return self._claim(conn, digest, name, size, collection)
+                if row["chunk_count"] is not None:
+                    return False
+                if time.time() - row["created_at"] > stale_after:
+                    return conn.execute("UPDATE documents SET created_at = ?, collection = ? WHERE content_hash = ? "
+                                        "AND chunk_count IS NULL AND created_at = ?",
+                                        (time.time(), collection, digest, row["created_at"])).rowcount == 1
+            if deadline is not None and time.monotonic() + poll > deadline:
+                raise TimeoutError(f"{name} is still being ingested by another upload")
+            time.sleep(poll)
+
+    def mark_ready(self, digest: str, chunk_count: int, collection: str = None):
+        """Records the file's chunks as stored (in `collection`, which later copies are taken from)."""
+        with self.pool.transaction() as conn:
+            conn.execute("UPDATE documents SET chunk_count = ?, collection = COALESCE(?, collection) "
+                         "WHERE content_hash = ?", (chunk_count, collection, digest))
+
+    def abort(self, digest: str, user_id: str, session_id: str, claimed: bool = True):
+        """
+        Gives up embedding a file: drops the caller's reference and, if the caller `claimed` it,
+        the unfinished claim, so a waiting uploader (or the next upload) embeds it. Other users'
+        references are kept.
+        """
+        with self.pool.transaction() as conn:
+            conn.execute("DELETE FROM document_refs WHERE content_hash = ? AND user_id = ? AND session_id = ?",
+                         (digest, user_id or "", session_id or ""))
+            if claimed:
+                conn.execute("DELETE FROM documents WHERE content_hash = ? AND chunk_count IS NULL", (digest,))
+
+    def hashes_for(self, user_id: str = None, session_id: str = None) -> List[str]:
+        """Content hashes referenced by a user's session (or by all of a user's sessions)."""
+        query = "SELECT DISTINCT content_hash FROM document_refs WHERE user_id = ?"
+        params = [user_id or ""]
+        if session_id:
+            query += " AND session_id = ?"
+            params.append(session_id)
+        with self.pool.read() as conn:
+            return [row[0] for row in conn.execute(query, params)]
+
+    def release(self, session_id: str, user_id: str = None) -> List[Tuple[str, str]]:
+        """
+        Drops a session's references. Returns the (hash, collection) copies nobody references
+        any more; their chunks must be deleted from that collection.
+        """
+        query = "SELECT content_hash, collection FROM document_refs WHERE session_id = ?"
+        params = [session_id]
+        if user_id:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        with self.pool.transaction() as conn:
+            copies = {(row[0], row[1]) for row in conn.execute(query, params)}
+            conn.execute(query.replace("SELECT content_hash, collection", "DELETE"), params)
+            return self._drop_unreferenced(conn, copies)
+
+    def release_orphans(self, live_session_ids: Iterable[str], older_than: float) -> List[Tuple[str, str]]:
+        """Drops references held by sessions that no longer exist. Returns the now-unreferenced copies."""
+        live = set(live_session_ids)
+        with self.pool.transaction() as conn:
+            stale = [(row[0], row[1], row[2]) for row in conn.execute(
+                "SELECT content_hash, session_id, collection FROM document_refs WHERE session_id != '' "
+                "AND created_at < ?", (older_than,)) if row[1] not in live]
+            conn.executemany("DELETE FROM document_refs WHERE content_hash = ? AND session_id = ?",
+                             [(digest, session_id) for digest, session_id, _ in stale])
+            return self._drop_unreferenced(conn, {(digest, collection) for digest, _, collection in stale})
+
+    def _drop_unreferenced(self, conn, copies) -> List[Tuple[str, str]]:
+        dropped = []
+        for digest, collection in copies:
+            if conn.execute("SELECT 1 FROM document_refs WHERE content_hash = ? AND collection = ? LIMIT 1",
+                            (digest, collection)).fetchone():
+                continue
+            dropped.append((digest, collection))
+            other = conn.execute("SELECT collection FROM document_refs WHERE content_hash = ? LIMIT 1",
+                                 (digest,)).fetchone()
+            if other is None:
+                conn.execute("DELETE FROM documents WHERE content_hash = ?", (digest,))
+            else:
+                # Later copies are taken from a collection that still holds the chunks
+                conn.execute("UPDATE documents SET collection = ? WHERE content_hash = ? AND collection = ?",
+                             (other[0], digest, collection))
+        return dropped
+
+    def get(self, digest: str) -> Optional[Dict[str, Any]]:
+        with self.pool.read() as conn:
+            row = conn.execute("SELECT * FROM documents WHERE content_hash = ?", (digest,)).fetchone()
+        if not row:
+            return None
+        document = dict(row)
+        with self.pool.read() as conn:
+            document["refcount"] = conn.execute("SELECT COUNT(*) FROM document_refs WHERE content_hash = ?",
+                                                (digest,)).fetchone()[0]
+        return document
+
+    def stats(self) -> Dict[str, int]:
+        """Distinct files, stored copies and references; references minus copies is the number of copies avoided."""
+        with self.pool.read() as conn:
+            documents, chunks = conn.execute("SELECT COUNT(*), COALESCE(SUM(chunk_count), 0) FROM documents").fetchone()
+            refs, copies = conn.execute("SELECT COUNT(*), COUNT(DISTINCT content_hash || '/' || collection) "
+                                        "FROM document_refs").fetchone()
+        return {"documents": documents, "chunks": chunks, "copies": copies, "references": refs,
+                "deduplicated": max(0, refs - copies)}
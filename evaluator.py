@@ -1,20 +1,60 @@
 import json
 from typing import List, Dict, Any
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import PromptTemplate
+from lazy_imports import LazyImport
+from lexical_scorer import LexicalScorer
+from llm_client import DeadlineExceeded
+from model_router import RoutingError, invoke_routed
+from tracing import span
+from usage import BudgetExceeded, get_usage_tracker, usage_scope
+
+# Only needed when an answer is escalated to the LLM, so loaded on first use
+ChatOpenAI = LazyImport("langchain_openai", "ChatOpenAI")
+PromptTemplate = LazyImport("langchain_core.prompts", "PromptTemplate")
+
+# Scores a cheaper model isn't trusted with; these are re-graded by the next model tier
+BORDERLINE_SCORES = (4, 6)
 
 class AnswerEvaluator:
-    def __init__(self):
-        # Initialize LLM lazily or here if preferred
-        pass
+    def __init__(self, embeddings=None, use_pre_scorer: bool = True):
+        # LLM is created per call; the lexical pre-scorer grades clear-cut answers locally.
+        # Pass `embeddings` to let the pre-scorer match semantic equivalents of keywords.
+        self.pre_scorer = LexicalScorer(embeddings=embeddings) if use_pre_scorer else None
 
-    def evaluate_answer(self, question: str, user_answer: str, chunk_content: str, keywords: List[str]) -> Dict[str, Any]:
+    def evaluate_answer(self, question: str, user_answer: str, chunk_content: str, keywords: List[str],
+                        username: str = None, session_id: str = None) -> Dict[str, Any]:
         """
         Evaluates the user's answer against the chunk content and keywords.
         Returns a score out of 10 and feedback.
+        Empty and complete keyword answers are graded locally; the rest go to the LLM.
+        Once the user's usage budget is nearly used up, every answer is graded locally, and an
+        LLM call that runs out of time falls back to the local grade.
+        """
+        with span("evaluate_answer") as eval_span, usage_scope(username, session_id):
+            if self.pre_scorer:
+                result = self.pre_scorer.prescore(question, user_answer, chunk_content, keywords)
+                if result["decision"] == "local" or get_usage_tracker().check(username).degraded:
+                    result["graded_by"] = "local"
+                    eval_span.set(graded_by="local")
+                    return result
+
+            try:
+                result = self.evaluate_with_llm(question, user_answer, chunk_content, keywords)
+            except (BudgetExceeded, DeadlineExceeded):
+                if not self.pre_scorer:
+                    raise
+                result = self.pre_scorer.prescore(question, user_answer, chunk_content, keywords)
+                result["graded_by"] = "local"
+                eval_span.set(graded_by="local")
+                return result
+            result["graded_by"] = "llm"
+            eval_span.set(graded_by="llm")
+            return result
+
+    def evaluate_with_llm(self, question: str, user_answer: str, chunk_content: str, keywords: List[str]) -> Dict[str, Any]:
+        """
+        Evaluates the answer with the LLM, bypassing the local pre-scorer. A cheap model's
+        malformed or borderline grade is escalated to the next model in the route.
         """
-        llm = ChatOpenAI(model="gpt-4o", temperature=0.3)
-        
         prompt_template = """
         You are Knowval AI, an expert Knowledge Evaluator using Bloom's Taxonomy.
         
@@ -51,20 +91,30 @@ class AnswerEvaluator:
             template=prompt_template
         )
         
-        chain = prompt | llm
-        response = chain.invoke({
-            "chunk_content": chunk_content,
-            "question": question,
-            "user_answer": user_answer,
-            "keywords": keywords
-        })
-        
+        def parse(response):
+            with span("json_parse"):
+                content = response.content.strip()
+                if content.startswith("```json"):
+                    content = content.replace("```json", "").replace("```", "")
+                result = json.loads(content)
+            score = result.get("score") if isinstance(result, dict) else None
+            if isinstance(score, bool) or not isinstance(score, (int, float)) or not 0 <= score <= 10:
+                return None
+            return result
+
+        def confident(result):
+            low, high = BORDERLINE_SCORES
+            return not low <= result["score"] <= high
+
         try:
-            content = response.content.strip()
-            if content.startswith("```json"):
-                content = content.replace("```json", "").replace("```", "")
-            return json.loads(content)
-        except Exception as e:
+            return invoke_routed("evaluate_answer",
+                                 lambda model: prompt | ChatOpenAI(model=model, temperature=0.3, max_retries=0), {
+                "chunk_content": chunk_content,
+                "question": question,
+                "user_answer": user_answer,
+                "keywords": keywords
+            }, parse, confident)
+        except RoutingError as e:
             print(f"Error parsing Evaluation response: {e}")
             return {
                 "score": 0, 
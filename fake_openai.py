@@ -0,0 +1,346 @@
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import struct
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+# Words ignored when picking keywords and topics out of a prompt
+STOPWORDS = {
+    "the", "and", "for", "that", "with", "this", "from", "are", "was", "were", "which", "their", "there",
+    "have", "has", "had", "been", "into", "its", "they", "them", "than", "then", "also", "such", "these",
+    "those", "about", "over", "under", "between", "each", "other", "more", "most", "some", "what", "when",
+    "where", "will", "would", "could", "should", "can", "not", "but", "all", "any", "may", "one", "two",
+}
+
+FAKE = web.AppKey("fake", object)
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z][a-z0-9\-]{2,}", text.lower())
+
+
+def _keywords(text: str, limit: int) -> List[str]:
+    """The most frequent non-stopwords of `text`, ties broken alphabetically so output is stable."""
+    counts: Dict[str, int] = {}
+    for word in _words(text):
+        if word not in STOPWORDS:
+            counts[word] = counts.get(word, 0) + 1
+    return [w for w, _ in sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:limit]]
+
+
+def _digest(text: str) -> int:
+    # Python's hash() is salted per process; embeddings and answers must match across runs
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def hash_embedding(text: str, dimensions: int = 256) -> List[float]:
+    """
+    A deterministic unit vector built by feature-hashing the words of `text`, so texts that
+    share words land close together and retrieval behaves plausibly without a model.
+    """
+    vector = [0.0] * dimensions
+    for word in _words(text) or [text]:
+        digest = _digest(word)
+        vector[digest % dimensions] += 1.0 if (digest >> 32) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def _token_estimate(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class FakeOpenAI:
+    """
+    A stand-in for the OpenAI chat and embeddings APIs, for benchmarks and tests that must not
+    touch the network. Answers are derived from the prompt (quiz batches, topic expansion,
+    relevance checks, topic discovery, grading), so the app runs end to end.
+
+    Latency is log-normal around `latency_ms` (plus `ms_per_token` per completion token);
+    `rpm` caps requests per minute and `rate_limit_rate` rejects a random share of requests,
+    both with OpenAI-style 429s; `malformed_rate` truncates a share of chat answers mid-JSON.
+    Faults are drawn from a generator seeded with `seed`, so a run is reproducible.
+    """
+
+    def __init__(self, latency_ms: float = 300.0, latency_sigma: float = 0.4, ms_per_token: float = 0.0,
+                 embed_latency_ms: float = 20.0, rpm: int = 0, rate_limit_rate: float = 0.0,
+                 malformed_rate: float = 0.0, dimensions: int = 256, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.ms_per_token = ms_per_token
+        self.embed_latency_ms = embed_latency_ms
+        self.rpm = rpm
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.dimensions = dimensions
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent: deque = deque()
+        self.counters = {"chat": 0, "embeddings": 0, "embedded_inputs": 0, "rate_limited": 0, "malformed": 0}
+
+    # --- faults and latency -------------------------------------------------
+
+    def _draw(self) -> float:
+        with self._lock:
+            return self._random.random()
+
+    def _latency(self, median_ms: float, tokens: int = 0) -> float:
+        with self._lock:
+            jitter = self._random.lognormvariate(0.0, self.latency_sigma) if self.latency_sigma else 1.0
+        return (median_ms * jitter + tokens * self.ms_per_token) / 1000.0
+
+    def _throttle(self) -> Optional[float]:
+        """Seconds to tell the client to wait if this request is rate limited, else None."""
+        now = time.monotonic()
+        with self._lock:
+            if self.rpm:
+                while self._recent and now - self._recent[0] >= 60:
+                    self._recent.popleft()
+                if len(self._recent) >= self.rpm:
+                    self.counters["rate_limited"] += 1
+                    return max(0.05, 60 - (now - self._recent[0]))
+                self._recent.append(now)
+        if self.rate_limit_rate and self._draw() < self.rate_limit_rate:
+            with self._lock:
+                self.counters["rate_limited"] += 1
+            return 0.1
+        return None
+
+    # --- canned answers -------------------------------------------------------
+
+    def answer(self, prompt: str) -> str:
+        """The completion for a prompt, recognised by the instructions each Knowval prompt carries."""
+        chunks = re.split(r"--- CHUNK \d+ ---\n", prompt)
+        if len(chunks) > 1:
+            return json.dumps([self._question(i, chunk) for i, chunk in enumerate(chunks[1:])], indent=2)
+        if "Output only YES or NO" in prompt:
+            chunk = prompt.split("Text Chunk:", 1)[-1]
+            return "YES" if len(_keywords(chunk, 5)) >= 3 else "NO"
+        if "Generate a search query" in prompt:
+            topic = re.search(r"topic: '(.*?)'", prompt)
+            topic = topic.group(1) if topic else "the topic"
+            return f"{topic} core concepts, key principles, definitions, mechanisms, examples"
+        if "JSON array of strings" in prompt:
+            sample = prompt.split("Text Segments:", 1)[-1]
+            topics = [w.replace("-", " ").title() for w in _keywords(sample, 8)]
+            return json.dumps(topics if len(topics) >= 2 else ["General Knowledge", "Key Concepts"])
+        if "score out of 10" in prompt:
+            return json.dumps(self._grade(prompt))
+        return f"Acknowledged: {' '.join(_keywords(prompt, 5))}"
+
+    def _question(self, index: int, chunk: str) -> Dict[str, Any]:
+        keywords = _keywords(chunk, 4) or ["concept"]
+        digest = _digest(chunk)
+        correct = "ABCD"[digest % 4]
+        distractors = iter(["An unrelated definition", "A common misconception", "The opposite effect"])
+        # Quote a stretch of the chunk so questions differ enough to survive the generator's dedup
+        words = chunk.split()
+        offset = digest % max(1, len(words) - 12)
+        excerpt = " ".join(words[offset:offset + 12])
+        return {
+            "chunk_index": index,
+            "question": f"What role does {keywords[0]} play in: \"{excerpt}\"?",
+            "options": {letter: (f"It relates {keywords[0]} to {', '.join(keywords[1:]) or 'its context'}"
+                                 if letter == correct else next(distractors)) for letter in "ABCD"},
+            "correct_answer": correct,
+            "explanation": f"The source text links {keywords[0]} with {', '.join(keywords[1:]) or 'its context'}.",
+            "keywords": keywords,
+        }
+
+    def _grade(self, prompt: str) -> Dict[str, Any]:
+        answer = prompt.split("User's Answer:", 1)[-1].split("Required Keywords", 1)[0].lower()
+        section = prompt.split("Required Keywords/Phrases:", 1)[-1].split("Task:", 1)[0]
+        keywords = re.findall(r"'([^']+)'|\"([^\"]+)\"", section)
+        keywords = [a or b for a, b in keywords]
+        present = [k for k in keywords if k.lower() in answer]
+        missing = [k for k in keywords if k not in present]
+        score = round(10 * len(present) / len(keywords)) if keywords else min(10, len(_words(answer)) // 3)
+        return {"score": score, "feedback": f"Covered {len(present)} of {len(keywords)} key ideas.",
+                "keywords_present": present, "keywords_missing": missing}
+
+    # --- HTTP handlers --------------------------------------------------------
+
+    @staticmethod
+    def _error(status: int, message: str, code: str, retry_after: float = None) -> web.Response:
+        headers = {"retry-after": f"{retry_after:.2f}"} if retry_after is not None else None
+        return web.json_response({"error": {"message": message, "type": code, "code": code}},
+                                 status=status, headers=headers)
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        retry_after = self._throttle()
+        if retry_after is not None:
+            return self._error(429, "Rate limit reached for requests", "rate_limit_exceeded", retry_after)
+        prompt = "\n".join(m["content"] if isinstance(m.get("content"), str)
+                           else " ".join(p.get("text", "") for p in m.get("content") or [])
+                           for m in body.get("messages", []))
+        content = self.answer(prompt)
+        if self.malformed_rate and self._draw() < self.malformed_rate:
+            content = content[:max(1, len(content) // 2)]
+            with self._lock:
+                self.counters["malformed"] += 1
+        tokens_in, tokens_out = _token_estimate(prompt), _token_estimate(content)
+        with self._lock:
+            self.counters["chat"] += 1
+        await asyncio.sleep(self._latency(self.latency_ms, tokens_out))
+
+        model = body.get("model", "gpt-4o")
+        usage = {"prompt_tokens": tokens_in, "completion_tokens": tokens_out, "total_tokens": tokens_in + tokens_out}
+        base = {"id": f"chatcmpl-fake-{_digest(prompt):x}", "created": int(time.time()), "model": model}
+        if not body.get("stream"):
+            return web.json_response(dict(base, object="chat.completion", usage=usage, choices=[
+                {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(choices, **extra):
+            chunk = dict(base, object="chat.completion.chunk", choices=choices, **extra)
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        pieces = re.findall(r"\S+\s*", content) or [content]
+        await send([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        for piece in pieces:
+            await send([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+        await send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send([], usage=usage)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def embeddings(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        retry_after = self._throttle()
+        if retry_after is not None:
+            return self._error(429, "Rate limit reached for requests", "rate_limit_exceeded", retry_after)
+        inputs = body.get("input", [])
+        # A single string, a list of strings, or pre-tokenized input (lists of token ids)
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        texts = [item if isinstance(item, str) else " ".join(f"t{token}" for token in item) for item in inputs]
+        dimensions = int(body.get("dimensions") or self.dimensions)
+        with self._lock:
+            self.counters["embeddings"] += 1
+            self.counters["embedded_inputs"] += len(texts)
+        await asyncio.sleep(self._latency(self.embed_latency_ms))
+
+        data = []
+        for index, text in enumerate(texts):
+            vector = hash_embedding(text, dimensions)
+            if body.get("encoding_format") == "base64":
+                vector = base64.b64encode(struct.pack(f"<{dimensions}f", *vector)).decode("ascii")
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        tokens = sum(_token_estimate(t) for t in texts)
+        return web.json_response({"object": "list", "data": data, "model": body.get("model", "text-embedding-ada-002"),
+                                  "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    async def models(self, request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": [
+            {"id": m, "object": "model", "owned_by": "fake"} for m in ("gpt-4o", "gpt-4o-mini", "text-embedding-ada-002")]})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        with self._lock:
+            return web.json_response(dict(self.counters))
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app[FAKE] = self
+        app.router.add_post("/v1/chat/completions", self.chat)
+        app.router.add_post("/v1/embeddings", self.embeddings)
+        app.router.add_get("/v1/models", self.models)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+
+class FakeOpenAIServer:
+    """
+    Runs a FakeOpenAI on a background thread, e.g. inside a test or benchmark:
+
+        with FakeOpenAIServer(FakeOpenAI(latency_ms=50)) as server:
+            os.environ.update(server.environment())
+    """
+
+    def __init__(self, fake: FakeOpenAI = None, host: str = "127.0.0.1", port: int = 0):
+        self.fake = fake or FakeOpenAI()
+        self.host = host
+        self.port = port
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def environment(self) -> Dict[str, str]:
+        """Settings that point Knowval's OpenAI clients at this server."""
+        return {"OPENAI_BASE_URL": self.base_url, "OPENAI_API_KEY": "fake", "KNOWVAL_FAKE_OPENAI": "1"}
+
+    def start(self) -> "FakeOpenAIServer":
+        started = threading.Event()
+
+        async def serve():
+            self._runner = web.AppRunner(self.fake.create_app())
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, self.host, self.port)
+            await site.start()
+            self.port = site._server.sockets[0].getsockname()[1]
+            started.set()
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(serve(), self._loop).result(10)
+        started.wait(10)
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+        self._loop.close()
+        self._loop = None
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the OpenAI chat and embeddings APIs. "
+                                                 "Point Knowval at it with OPENAI_BASE_URL=http://HOST:PORT/v1 "
+                                                 "and KNOWVAL_FAKE_OPENAI=1.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Median chat latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.4, help="Log-normal spread of latencies (0 = fixed)")
+    parser.add_argument("--ms-per-token", type=float, default=0.0, help="Extra latency per completion token")
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0, help="Median embeddings latency")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before 429s (0 = unlimited)")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests rejected with 429")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of chat answers truncated mid-JSON")
+    parser.add_argument("--dimensions", type=int, default=256, help="Embedding size")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, ms_per_token=args.ms_per_token,
+                      embed_latency_ms=args.embed_latency_ms, rpm=args.rpm, rate_limit_rate=args.rate_limit_rate,
+                      malformed_rate=args.malformed_rate, dimensions=args.dimensions, seed=args.seed)
+    print(f"Fake OpenAI API on http://{args.host}:{args.port}/v1")
+    web.run_app(fake.create_app(), host=args.host, port=args.port, print=None)
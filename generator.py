@@ -5,31 +5,96 @@ sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 import os
 import json
 import random
-from typing import List, Dict, Any
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
 from difflib import SequenceMatcher
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import PromptTemplate
-from langchain_core.documents import Document
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
+from lazy_imports import LazyImport
+from lexical_index import HybridRetriever, LexicalIndex
+from llm_client import DeadlineExceeded, deadline_scope, remaining_time
+from model_router import invoke_routed
+from scheduler import BULK, INTERACTIVE, get_scheduler
+from tracing import span, count
+from usage import BudgetExceeded, current_scope, get_usage_tracker, usage_scope
+from vector_partitions import VectorStoreRouter
+
+# LangChain and OpenAI take seconds to import, so they are loaded on first use
+ChatOpenAI = LazyImport("langchain_openai", "ChatOpenAI")
+OpenAIEmbeddings = LazyImport("langchain_openai", "OpenAIEmbeddings")
+PromptTemplate = LazyImport("langchain_core.prompts", "PromptTemplate")
+
+# Quiz size once a user's usage budget is nearly used up
+DEGRADED_QUIZ_SIZE = 5
+# Seconds after which generate_quiz stops and returns the questions it has so far
+QUIZ_DEADLINE = float(os.getenv("KNOWVAL_QUIZ_DEADLINE", 90))
 
 class QuizGenerator:
-    def __init__(self, persist_directory: str = "./chroma_db"):
+    def __init__(self, persist_directory: str = "./chroma_db", router: VectorStoreRouter = None,
+                 lexical_index: LexicalIndex = None, vector_index=None):
         self.persist_directory = persist_directory
-        self.embeddings = OpenAIEmbeddings()
-        self.vector_store = Chroma(persist_directory=self.persist_directory, embedding_function=self.embeddings)
+        # A shared router brings its own embedding client, so managers don't each open one
+        self.embeddings = router.embeddings if router else OpenAIEmbeddings()
+        # Routes each user/session to its collection (shared, per-user or per-session)
+        self.router = router or VectorStoreRouter(self.persist_directory, self.embeddings)
+        # Fuses BM25 hits from the lexical index (when given) with the vector search
+        self.retriever = HybridRetriever(self.router, lexical_index, vector_index=vector_index)
+        # Small LRU of (user, session, chunk_ref) -> chunk text for quiz items that no longer embed their source
+        self._chunk_cache = OrderedDict()
+        self._chunk_cache_size = 256
+        self._chunk_cache_lock = threading.Lock()
         # Initialize LLM lazily or here if preferred, but keeping it per method for safety as per previous fix
         # self.llm = ChatOpenAI(model="gpt-4o", temperature=0.7) 
 
-    def get_retriever(self):
-        return self.vector_store.as_retriever()
+    @property
+    def vector_store(self):
+        """The shared (unpartitioned) collection."""
+        return self.router.get_store()
 
-    def generate_batch_questions(self, chunks: List[str], topic: str, difficulty: str) -> List[Dict[str, Any]]:
+    def get_retriever(self, username: str = None, session_id: str = None):
+        store, filter_dict = self.router.scope(username, session_id)
+        return store.as_retriever(search_kwargs={"filter": filter_dict} if filter_dict else {})
+
+    def resolve_chunk_content(self, item: Dict[str, Any], username: str = None, session_id: str = None) -> str:
+        """
+        Returns the source text of a quiz item. New items only carry a `chunk_ref` into the
+        user/session's collection, which is fetched lazily and cached; legacy items embed `chunk_content`.
+        """
+        if item.get("chunk_content"):
+            return item["chunk_content"]
+        chunk_ref = item.get("chunk_ref")
+        if not chunk_ref:
+            return ""
+        key = (username, session_id, chunk_ref)
+        with self._chunk_cache_lock:
+            if key in self._chunk_cache:
+                self._chunk_cache.move_to_end(key)
+                count("chunk_cache_hits")
+                return self._chunk_cache[key]
+        count("chunk_cache_misses")
+        try:
+            # The scope filter keeps a chunk id from another user's session from resolving
+            store, where = self.router.scope(username, session_id)
+            documents = store.get(ids=[chunk_ref], where=where, include=["documents"])["documents"]
+        except Exception as e:
+            print(f"Error resolving chunk {chunk_ref}: {e}")
+            return ""
+        content = documents[0] if documents else ""
+        self._cache_chunk(key, content)
+        return content
+
+    def _cache_chunk(self, key: Tuple[Optional[str], Optional[str], str], content: str):
+        with self._chunk_cache_lock:
+            self._chunk_cache[key] = content
+            self._chunk_cache.move_to_end(key)
+            if len(self._chunk_cache) > self._chunk_cache_size:
+                self._chunk_cache.popitem(last=False)
+
+    def generate_batch_questions(self, chunks: List[str], topic: str, difficulty: str,
+                                 priority: str = BULK) -> List[Dict[str, Any]]:
         """
         Generates MCQs for a batch of chunks.
+        The LLM call waits its turn in the fair scheduler at the given priority.
         """
-        llm = ChatOpenAI(model="gpt-4o", temperature=0.7)
-        
         prompt_template = """
         You are Knowval AI, an expert Knowledge Evaluator.
         Your task is to generate 1 {difficulty} level multiple-choice question (MCQ) for EACH of the provided text chunks.
@@ -72,29 +137,35 @@ class QuizGenerator:
             template=prompt_template
         )
         
-        chain = prompt | llm
+        def parse(response):
+            with span("json_parse") as parse_span:
+                content = response.content.strip()
+                if content.startswith("```json"):
+                    content = content.replace("```json", "").replace("```", "")
+                
+                parsed = json.loads(content)
+                parse_span.set(items=len(parsed) if isinstance(parsed, list) else 0)
+            return parsed if isinstance(parsed, list) else None
+
         try:
-            response = chain.invoke({
-                "difficulty": difficulty,
-                "topic": topic,
-                "formatted_chunks": formatted_chunks
-            })
-            
-            content = response.content.strip()
-            if content.startswith("```json"):
-                content = content.replace("```json", "").replace("```", "")
-            
-            parsed = json.loads(content)
-            if isinstance(parsed, list):
-                return parsed
+            with get_scheduler().slot(current_scope()[0], priority):
+                return invoke_routed("quiz_batch",
+                                     lambda model: prompt | ChatOpenAI(model=model, temperature=0.7, max_retries=0), {
+                    "difficulty": difficulty,
+                    "topic": topic,
+                    "formatted_chunks": formatted_chunks
+                }, parse)
+        except BudgetExceeded:
+            raise
+        except DeadlineExceeded as e:
+            print(f"Quiz batch abandoned: {e}")
             return []
         except Exception as e:
             print(f"Error parsing batch LLM response: {e}")
             return []
 
-    def _expand_topic(self, topic: str) -> str:
+    def _expand_topic(self, topic: str, priority: str = INTERACTIVE) -> str:
         """Expands the topic into a conceptual search query."""
-        llm = ChatOpenAI(model="gpt-4o", temperature=0.5)
         prompt = PromptTemplate(
             input_variables=["topic"],
             template="""You are an expert educational assistant. The user wants a quiz on the topic: '{topic}'.
@@ -102,9 +173,16 @@ class QuizGenerator:
             The query should be a single string of keywords and phrases.
             Output only the query."""
         )
-        chain = prompt | llm
+        def validate(response):
+            # An empty or rambling answer means the model ignored the instructions
+            query = response.content.strip()
+            return query if query and len(query) <= 1000 else None
+
         try:
-            return chain.invoke({"topic": topic}).content.strip()
+            with get_scheduler().slot(current_scope()[0], priority):
+                return invoke_routed("expand_topic",
+                                     lambda model: prompt | ChatOpenAI(model=model, temperature=0.5, max_retries=0),
+                                     {"topic": topic}, validate)
         except Exception as e:
             print(f"Query expansion failed: {e}")
             return topic
@@ -113,7 +191,6 @@ class QuizGenerator:
         """Checks if the chunk contains substantive information about the topic."""
         # NOTE: This method is kept for backward compatibility or individual checks if needed,
         # but batch generation now handles relevance internally.
-        llm = ChatOpenAI(model="gpt-4o", temperature=0.0)
         prompt = PromptTemplate(
             input_variables=["topic", "chunk"],
             template="""You are an expert evaluator.
@@ -125,10 +202,16 @@ class QuizGenerator:
             Answer 'NO' if it is just a passing mention, a table of contents, a preface, or irrelevant noise.
             Output only YES or NO."""
         )
-        chain = prompt | llm
+        def validate(response):
+            answer = response.content.strip().upper()
+            if "YES" in answer:
+                return True
+            return False if "NO" in answer else None
+
         try:
-            response = chain.invoke({"topic": topic, "chunk": chunk}).content.strip().upper()
-            return "YES" in response
+            return invoke_routed("relevance_check",
+                                 lambda model: prompt | ChatOpenAI(model=model, temperature=0.0, max_retries=0),
+                                 {"topic": topic, "chunk": chunk}, validate)
         except Exception as e:
             print(f"Relevance check failed: {e}")
             return True
@@ -136,35 +219,58 @@ class QuizGenerator:
     def get_total_chunks(self, username: str = None, session_id: str = None) -> int:
         """Returns the total number of chunks in the vector store, filtered by user/session."""
         try:
-            # Prepare filter
-            filters = []
-            if username:
-                filters.append({"user_id": username})
-            if session_id:
-                filters.append({"session_id": session_id})
-            
-            if len(filters) > 1:
-                filter_dict = {"$and": filters}
-            elif len(filters) == 1:
-                filter_dict = filters[0]
-            else:
-                filter_dict = None
-
+            store, filter_dict = self.router.scope(username, session_id)
             # Chroma's count() doesn't support filter in all versions, but get() does.
             # Using get(where=...) to count.
             if filter_dict:
-                return len(self.vector_store.get(where=filter_dict)['ids'])
+                return len(store.get(where=filter_dict, include=[])['ids'])
             else:
-                return self.vector_store._collection.count()
+                return store._collection.count()
         except Exception as e:
             print(f"Error counting chunks: {e}")
             return 0
 
-    def generate_quiz(self, topic: str, num_chunks: int = None, difficulty: str = "Medium", username: str = None, session_id: str = None):
+    def generate_quiz(self, topic: str, num_chunks: int = None, difficulty: str = "Medium", username: str = None, session_id: str = None,
+                      exclude_questions: List[str] = None, priority: str = INTERACTIVE, deadline: float = None):
         """
         Generates a quiz by retrieving chunks related to the topic.
         Uses batch processing for speed.
+        Questions similar to any in `exclude_questions` (e.g. the previous quiz's) are skipped.
+        With the default interactive `priority`, the LLM calls up to the first batch jump the
+        scheduler queue and the rest of the quiz runs as bulk work; prefetching passes PREFETCH.
+        After `deadline` seconds (default KNOWVAL_QUIZ_DEADLINE) the questions gathered so far are returned.
         """
+        return [item for batch in self.iter_quiz_batches(topic, num_chunks, difficulty, username, session_id,
+                                                         exclude_questions, priority, deadline)
+                for item in batch]
+
+    def iter_quiz_batches(self, topic: str, num_chunks: int = None, difficulty: str = "Medium", username: str = None,
+                          session_id: str = None, exclude_questions: List[str] = None, priority: str = INTERACTIVE,
+                          deadline: float = None):
+        """
+        Same as `generate_quiz`, but yields the new quiz items after each LLM batch so callers
+        can stream the first questions while the rest are still being generated.
+        The generator must be consumed on a single thread.
+        """
+        with span("generate_quiz", topic=topic, difficulty=difficulty) as quiz_span, usage_scope(username, session_id), \
+                deadline_scope(deadline if deadline is not None else QUIZ_DEADLINE):
+            budget = get_usage_tracker().check(username)
+            if budget.exhausted:
+                raise BudgetExceeded(f"Usage budget exhausted for {username or 'anonymous user'}")
+            quiz_span.set(budget_state=budget.state, questions=0, priority=priority)
+            questions = 0
+            for batch in self._generate_quiz(topic, num_chunks, difficulty, username, session_id, exclude_questions,
+                                             degraded=budget.degraded, priority=priority):
+                questions += len(batch)
+                quiz_span.set(questions=questions)
+                yield batch
+
+    def _generate_quiz(self, topic, num_chunks, difficulty, username, session_id, exclude_questions, degraded=False,
+                       priority=INTERACTIVE):
+        if degraded:
+            # Close to the budget: a short quiz and no query-expansion call
+            num_chunks = min(num_chunks or DEGRADED_QUIZ_SIZE, DEGRADED_QUIZ_SIZE)
+            print(f"Usage budget nearly used up, generating {num_chunks} questions")
         if num_chunks is None:
             total_chunks = self.get_total_chunks(username, session_id)
             if total_chunks < 50:
@@ -176,65 +282,55 @@ class QuizGenerator:
             print(f"Dynamic Quiz Size: {num_chunks} questions (Total Chunks: {total_chunks})")
 
         # 1. Query Expansion
-        print(f"Expanding topic '{topic}'...")
-        search_query = self._expand_topic(topic)
-        print(f"Expanded Query: {search_query}")
-
-        # Prepare filter
-        filters = []
-        if username:
-            filters.append({"user_id": username})
-        if session_id:
-            filters.append({"session_id": session_id})
-        
-        if len(filters) > 1:
-            filter_dict = {"$and": filters}
-        elif len(filters) == 1:
-            filter_dict = filters[0]
+        if degraded:
+            search_query = topic
         else:
-            filter_dict = None
+            print(f"Expanding topic '{topic}'...")
+            search_query = self._expand_topic(topic, priority)
+            print(f"Expanded Query: {search_query}")
 
         # Fetch more chunks to allow for filtering
-        try:
-            docs = self.vector_store.max_marginal_relevance_search(
-                search_query, 
-                k=num_chunks * 2,
-                fetch_k=num_chunks * 5, 
-                lambda_mult=0.5,
-                filter=filter_dict
-            )
-        except Exception as e:
-            print(f"MMR Search failed ({e}), falling back to similarity search.")
-            docs = self.vector_store.similarity_search(search_query, k=num_chunks * 2, filter=filter_dict)
+        docs = self.retriever.search(search_query, k=num_chunks * 2, username=username, session_id=session_id,
+                                     mmr=True, fetch_k=num_chunks * 5)
         
         # Shuffle documents
         random.shuffle(docs)
         
         quiz_data = []
-        seen_questions = []
+        seen_questions = list(exclude_questions or [])
         seen_chunk_contents = set()
         
         # Process in batches of 5
         batch_size = 5
         
         # Filter duplicates first
-        unique_docs = []
-        for doc in docs:
-            content_hash = hash(doc.page_content)
-            if content_hash not in seen_chunk_contents:
-                seen_chunk_contents.add(content_hash)
-                unique_docs.append(doc)
+        with span("dedup_chunks", chunks=len(docs)) as dedup_span:
+            unique_docs = []
+            for doc in docs:
+                content_hash = hash(doc.page_content)
+                if content_hash not in seen_chunk_contents:
+                    seen_chunk_contents.add(content_hash)
+                    unique_docs.append(doc)
+            dedup_span.set(unique=len(unique_docs))
                 
         for i in range(0, len(unique_docs), batch_size):
             if len(quiz_data) >= num_chunks:
                 break
+            remaining = remaining_time()
+            if remaining is not None and remaining <= 0:
+                print(f"Quiz deadline reached, returning {len(quiz_data)} questions")
+                count("deadline_hit")
+                break
                 
             batch_docs = unique_docs[i:i+batch_size]
             batch_chunks = [doc.page_content for doc in batch_docs]
             
             print(f"Processing batch {i//batch_size + 1} ({len(batch_chunks)} chunks)...")
             
-            results = self.generate_batch_questions(batch_chunks, topic, difficulty)
+            # Only the first batch is on the time-to-first-question path
+            batch_priority = BULK if priority == INTERACTIVE and quiz_data else priority
+            results = self.generate_batch_questions(batch_chunks, topic, difficulty, priority=batch_priority)
+            batch_start = len(quiz_data)
             
             for res in results:
                 if len(quiz_data) >= num_chunks:
@@ -258,6 +354,7 @@ class QuizGenerator:
                         break
                 
                 if is_duplicate:
+                    count("duplicate_questions")
                     continue
                     
                 seen_questions.append(question_text)
@@ -288,14 +385,21 @@ class QuizGenerator:
                 if 0 <= chunk_idx < len(batch_docs):
                     original_doc = batch_docs[chunk_idx]
                     
-                    quiz_data.append({
+                    item = {
                         "chunk_id": len(quiz_data) + 1,
-                        "chunk_content": original_doc.page_content,
                         "question": question_text,
                         "options": new_options,
                         "correct_answer": new_correct_key,
                         "explanation": res.get("explanation"),
                         "keywords": res.get("keywords", [])
-                    })
-            
-        return quiz_data
+                    }
+                    # Reference the source chunk by ID (resolved lazily) instead of copying its text
+                    if getattr(original_doc, "id", None):
+                        item["chunk_ref"] = original_doc.id
+                        self._cache_chunk((username, session_id, original_doc.id), original_doc.page_content)
+                    else:
+                        item["chunk_content"] = original_doc.page_content
+                    quiz_data.append(item)
+
+            if len(quiz_data) > batch_start:
+                yield quiz_data[batch_start:]
@@ -0,0 +1,85 @@
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, Any, List
+
+# Modules imported on the app's startup path
+STARTUP_MODULES = ["auth", "session_manager", "resources", "evaluator", "generator",
+                   "ingestion", "topic_discovery", "vector_partitions", "vector_gc"]
+# Heavy dependencies that must stay out of startup and load on first use
+DEFERRED_MODULES = ["langchain_openai", "langchain_community", "langchain_chroma", "langchain_text_splitters",
+                    "chromadb", "openai", "pypdf", "docx2txt", "dns.resolver"]
+DEFAULT_BUDGET_MS = float(os.getenv("KNOWVAL_IMPORT_BUDGET_MS", "500"))
+
+_PROBE = """
+import sys, time, json
+preloaded = sorted(sys.modules)
+start = time.perf_counter()
+{imports}
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{"elapsed_ms": elapsed, "loaded": sorted(sys.modules), "preloaded": preloaded}}))
+"""
+
+
+def _parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """Parses `-X importtime` output into rows of {module, self_ms, cumulative_ms, depth}."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            rows.append({
+                "module": name.strip(),
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+                "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            })
+        except ValueError:
+            continue
+    return rows
+
+
+def profile_imports(modules: List[str] = None, top: int = 10) -> Dict[str, Any]:
+    """Imports `modules` in a fresh interpreter and reports the time taken and what got loaded."""
+    modules = modules or STARTUP_MODULES
+    probe = _PROBE.format(imports="\n".join(f"import {m}" for m in modules))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f"Import probe failed:\n{result.stderr[-2000:]}")
+
+    probe_output = json.loads(result.stdout.strip().splitlines()[-1])
+    loaded = set(probe_output["loaded"])
+    # Interpreter startup (site, encodings, ...) is not part of the app's import cost
+    preloaded = set(probe_output["preloaded"])
+    top_level = [row for row in _parse_importtime(result.stderr)
+                 if row["depth"] == 0 and row["module"] not in preloaded]
+    return {
+        "modules": modules,
+        "elapsed_ms": round(probe_output["elapsed_ms"], 2),
+        "deferred_loaded": [m for m in DEFERRED_MODULES if m in loaded],
+        "slowest": sorted(top_level, key=lambda r: r["cumulative_ms"], reverse=True)[:top],
+    }
+
+
+def check_budget(budget_ms: float = DEFAULT_BUDGET_MS, modules: List[str] = None) -> Dict[str, Any]:
+    """Profiles the startup imports and flags a regression if they exceed the budget or load a deferred module."""
+    report = profile_imports(modules)
+    report["budget_ms"] = budget_ms
+    report["ok"] = report["elapsed_ms"] <= budget_ms and not report["deferred_loaded"]
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check startup import time against a budget.")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("modules", nargs="*", help="Modules to import (default: the app's startup modules)")
+    args = parser.parse_args()
+
+    report = check_budget(args.budget_ms, args.modules or None)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["ok"] else 1)
@@ -1,21 +1,46 @@
+from __future__ import annotations
+
+import io
 import os
+import time
 import zipfile
 import tarfile
-import tempfile
-import shutil
-from typing import List
-from langchain_community.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
-from langchain_core.documents import Document
+from typing import List, Tuple, Union, BinaryIO
+from document_store import content_hash
+from lazy_imports import LazyImport
+from llm_client import DeadlineExceeded, remaining_time
+from tracing import span, count
+from usage import DEFAULT_EMBEDDING_MODEL, BudgetExceeded, count_tokens, get_usage_tracker, usage_scope
+from vector_partitions import VectorStoreRouter
+
+# Loaders, splitter and embeddings pull in pypdf, docx2txt and OpenAI; load them on first use
+PyPDFLoader = LazyImport("langchain_community.document_loaders", "PyPDFLoader")
+TextLoader = LazyImport("langchain_community.document_loaders", "TextLoader")
+Docx2txtLoader = LazyImport("langchain_community.document_loaders", "Docx2txtLoader")
+RecursiveCharacterTextSplitter = LazyImport("langchain_text_splitters", "RecursiveCharacterTextSplitter")
+OpenAIEmbeddings = LazyImport("langchain_openai", "OpenAIEmbeddings")
+Document = LazyImport("langchain_core.documents", "Document")
+pypdf = LazyImport("pypdf")
+docx2txt = LazyImport("docx2txt")
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+# Longest wait for another upload of the same file to finish embedding it, unless a request deadline is shorter
+DEDUP_WAIT = float(os.getenv("KNOWVAL_DEDUP_WAIT", 60))
+
+# An in-memory upload: raw bytes or a readable binary file object (e.g. Streamlit's UploadedFile)
+Buffer = Union[bytes, bytearray, memoryview, BinaryIO]
 
 class IngestionManager:
-    def __init__(self, persist_directory: str = "./chroma_db", chunk_size: int = 1000, chunk_overlap: int = 200):
+    def __init__(self, persist_directory: str = "./chroma_db", chunk_size: int = 1000, chunk_overlap: int = 200,
+                 router: VectorStoreRouter = None):
         self.persist_directory = persist_directory
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.embeddings = OpenAIEmbeddings()
+        # A shared router brings its own embedding client, so managers don't each open one
+        self.embeddings = router.embeddings if router else OpenAIEmbeddings()
+        self.router = router or VectorStoreRouter(self.persist_directory, self.embeddings)
 
     def load_documents(self, file_paths: List[str]) -> List[Document]:
         """Loads documents from the given paths (PDF, TXT, DOCX, ZIP, TAR)."""
@@ -37,9 +62,9 @@ class IngestionManager:
                     documents.extend(loader.load())
                 except Exception as e:
                     print(f"Error loading DOCX {path}: {e}")
-            elif path.endswith((".zip", ".tar", ".tar.gz", ".tgz")):
+            elif path.endswith(ARCHIVE_EXTENSIONS):
                 documents.extend(self._process_archive(path))
-            elif path.endswith((".png", ".jpg", ".jpeg")):
+            elif path.endswith(IMAGE_EXTENSIONS):
                 try:
                     import pytesseract
                     from PIL import Image
@@ -58,33 +83,76 @@ class IngestionManager:
         return documents
 
     def _process_archive(self, archive_path: str) -> List[Document]:
-        """Extracts archive and loads supported files recursively."""
+        """Loads supported files from an archive on disk without extracting it."""
+        with open(archive_path, "rb") as f:
+            return self._load_archive(os.path.basename(archive_path), f)
+
+    def load_buffer(self, name: str, data: Buffer) -> List[Document]:
+        """
+        Loads one in-memory file (PDF, TXT, DOCX, image, ZIP, TAR) without writing it to disk.
+        `name` picks the loader from its extension and becomes the documents' source.
+        File objects are read in place, so an upload is never copied into a second buffer.
+        """
+        stream = io.BytesIO(data) if isinstance(data, (bytes, bytearray, memoryview)) else data
+        if hasattr(stream, "seek"):
+            stream.seek(0)
+        lower = name.lower()
+        try:
+            if lower.endswith(".pdf"):
+                reader = pypdf.PdfReader(stream)
+                return [Document(page_content=page.extract_text() or "", metadata={"source": name, "page": i})
+                        for i, page in enumerate(reader.pages)]
+            elif lower.endswith(".txt"):
+                text = stream.read().decode("utf-8", errors="replace")
+                return [Document(page_content=text, metadata={"source": name})]
+            elif lower.endswith(".docx"):
+                return [Document(page_content=docx2txt.process(stream), metadata={"source": name})]
+            elif lower.endswith(ARCHIVE_EXTENSIONS):
+                return self._load_archive(name, stream)
+            elif lower.endswith(IMAGE_EXTENSIONS):
+                return self._load_image(name, stream)
+            else:
+                print(f"Unsupported file type: {name}")
+        except Exception as e:
+            print(f"Error loading {name}: {e}")
+        return []
+
+    def _load_image(self, name: str, stream: BinaryIO) -> List[Document]:
+        try:
+            import pytesseract
+            from PIL import Image
+        except ImportError:
+            print("Pytesseract or Pillow not installed. Skipping image.")
+            return []
+        try:
+            text = pytesseract.image_to_string(Image.open(stream))
+        except Exception as e:
+            print(f"Error processing image {name}: {e}")
+            print("Ensure Tesseract-OCR is installed on your system.")
+            return []
+        if not text.strip():
+            print(f"No text found in image: {name}")
+            return []
+        return [Document(page_content=text, metadata={"source": name})]
+
+    def _load_archive(self, name: str, stream: BinaryIO) -> List[Document]:
+        """Loads supported members of a ZIP/TAR archive straight from memory (nested archives included)."""
         documents = []
-        temp_dir = tempfile.mkdtemp()
-        print(f"Extracting {archive_path} to {temp_dir}...")
-        
         try:
-            if archive_path.endswith(".zip"):
-                with zipfile.ZipFile(archive_path, 'r') as zip_ref:
-                    zip_ref.extractall(temp_dir)
-            elif archive_path.endswith((".tar", ".tar.gz", ".tgz")):
-                with tarfile.open(archive_path, 'r') as tar_ref:
-                    tar_ref.extractall(temp_dir)
-            
-            # Recursively find and load files
-            extracted_files = []
-            for root, _, files in os.walk(temp_dir):
-                for file in files:
-                    full_path = os.path.join(root, file)
-                    extracted_files.append(full_path)
-            
-            documents.extend(self.load_documents(extracted_files))
-            
+            if name.lower().endswith(".zip"):
+                with zipfile.ZipFile(stream) as archive:
+                    for member in archive.infolist():
+                        if not member.is_dir():
+                            with archive.open(member) as f:
+                                documents.extend(self.load_buffer(f"{name}/{member.filename}", f.read()))
+            else:
+                with tarfile.open(fileobj=stream, mode="r:*") as archive:
+                    for member in archive:
+                        f = archive.extractfile(member) if member.isfile() else None
+                        if f is not None:
+                            documents.extend(self.load_buffer(f"{name}/{member.name}", f.read()))
         except Exception as e:
-            print(f"Error processing archive {archive_path}: {e}")
-        finally:
-            shutil.rmtree(temp_dir)
-            
+            print(f"Error processing archive {name}: {e}")
         return documents
 
     def split_documents(self, documents: List[Document]) -> List[Document]:
@@ -104,30 +172,125 @@ class IngestionManager:
             
         if not os.getenv("OPENAI_API_KEY"):
             raise ValueError("OPENAI_API_KEY environment variable is not set")
+        self._check_budget(chunks, username)
 
-        # Add metadata
+        # Add metadata (ingested_at lets garbage collection spare in-flight sessions)
+        ingested_at = time.time()
         for chunk in chunks:
+            chunk.metadata['ingested_at'] = ingested_at
             if username:
                 chunk.metadata['user_id'] = username
             if session_id:
                 chunk.metadata['session_id'] = session_id
 
-        vector_store = Chroma.from_documents(
-            documents=chunks,
-            embedding=self.embeddings,
-            persist_directory=self.persist_directory
-        )
-        return vector_store
+        # Stored in the user's/session's own collection when partitioning is enabled
+        return self.router.add_documents(chunks, username, session_id)
 
-    def ingest_files(self, file_paths: List[str], username: str = None, session_id: str = None):
-        """Orchestrates the ingestion process."""
-        print(f"Loading files: {file_paths}")
-        docs = self.load_documents(file_paths)
-        print(f"Loaded {len(docs)} documents")
-        
-        chunks = self.split_documents(docs)
+    def _check_budget(self, chunks: List[Document], username: str = None):
+        """Raises BudgetExceeded before embedding chunks the user's remaining budget can't cover."""
+        model = getattr(self.router.embeddings, "model", None)
+        model = model if isinstance(model, str) else DEFAULT_EMBEDDING_MODEL
+        pending = sum(count_tokens(chunk.page_content, model) for chunk in chunks)
+        if get_usage_tracker().check(username, pending_tokens=pending).exhausted:
+            raise BudgetExceeded(f"Usage budget exhausted for {username or 'anonymous user'}")
+
+    def ingest_buffers(self, files: List[Tuple[str, Buffer]], username: str = None, session_id: str = None):
+        """
+        Ingests in-memory files given as (name, bytes or file object) pairs.
+        With a document store on the router, files are deduplicated by content (see DocumentStore).
+        Embedding tokens are charged to the user, and BudgetExceeded is raised before embedding
+        chunks the budget can't cover.
+        """
+        with span("ingest", files=len(files)) as ingest_span, usage_scope(username, session_id):
+            if self.router.document_store and username:
+                ingest_span.set(deduplicated=True)
+                return self._ingest_deduplicated(files, username, session_id)
+
+            print(f"Loading uploads: {[name for name, _ in files]}")
+            with span("load") as load_span:
+                docs = []
+                for name, data in files:
+                    docs.extend(self.load_buffer(name, data))
+                load_span.set(documents=len(docs))
+            print(f"Loaded {len(docs)} documents")
+            return self._split_and_store(docs, username, session_id)
+
+    def _split_and_store(self, docs: List[Document], username: str = None, session_id: str = None):
+        with span("split", documents=len(docs)) as split_span:
+            chunks = self.split_documents(docs)
+            split_span.set(chunks=len(chunks))
         print(f"Split into {len(chunks)} chunks")
-        
-        vector_store = self.store_in_vector_db(chunks, username, session_id)
+
+        with span("store", chunks=len(chunks)):
+            vector_store = self.store_in_vector_db(chunks, username, session_id)
         print("Stored in Vector DB")
         return vector_store
+
+    def _ingest_deduplicated(self, files: List[Tuple[str, Buffer]], username: str, session_id: str = None):
+        """
+        Embeds only files nobody has uploaded before; known files gain a reference, and a copy of
+        their stored chunks and embeddings when the session's collection doesn't hold them yet.
+        """
+        documents = self.router.document_store
+        collection = self.router.collection_name(username, session_id)
+        for name, data in files:
+            digest = content_hash(data)
+            size = len(data) if isinstance(data, (bytes, bytearray, memoryview)) else None
+            must_embed = documents.acquire(digest, username, session_id, name, size, collection)
+            if not must_embed:
+                # Another upload of the same file may still be embedding it: wait for its chunks
+                # (within the request deadline), or take over if it fails
+                left = remaining_time()
+                timeout = DEDUP_WAIT if left is None else min(left, DEDUP_WAIT)
+                try:
+                    must_embed = documents.wait_until_ready(digest, name, size, collection=collection, timeout=timeout)
+                except TimeoutError as e:
+                    documents.abort(digest, username, session_id, claimed=False)
+                    raise DeadlineExceeded(str(e)) from e
+            try:
+                source = None if must_embed else (documents.get(digest) or {}).get("collection")
+                if source is not None and self.router.copy_content(digest, source, username, session_id):
+                    print(f"{name} was already ingested, reusing its chunks")
+                    count("dedup_hits")
+                    continue
+                # New, taken over, or its only copy was deleted meanwhile
+                stored = self._embed_content(name, data, digest, username, session_id)
+                documents.mark_ready(digest, stored, collection)
+                print(f"Stored {stored} chunks for {name}")
+            except Exception:
+                documents.abort(digest, username, session_id, claimed=must_embed)
+                raise
+        return self.router.get_store(username, session_id)
+
+    def _embed_content(self, name: str, data: Buffer, digest: str, username: str, session_id: str = None) -> int:
+        """Parses, splits and embeds a deduplicated file into the scope's collection. Returns its chunk count."""
+        # Shared chunks are named after their content, not the first uploader's file name
+        lower = name.lower()
+        extension = ".tar.gz" if lower.endswith(".tar.gz") else os.path.splitext(lower)[1]
+        with span("load") as load_span:
+            docs = self.load_buffer(f"{digest[:16]}{extension}", data)
+            load_span.set(documents=len(docs))
+        with span("split", documents=len(docs)) as split_span:
+            chunks = self.split_documents(docs)
+            split_span.set(chunks=len(chunks))
+        if chunks:
+            if not os.getenv("OPENAI_API_KEY"):
+                raise ValueError("OPENAI_API_KEY environment variable is not set")
+            self._check_budget(chunks, username)
+            ingested_at = time.time()
+            for chunk in chunks:
+                chunk.metadata['ingested_at'] = ingested_at
+            # Deterministic ids make a concurrent upload of the same file an idempotent upsert
+            with span("store", chunks=len(chunks)):
+                self.router.add_content(chunks, digest, username, session_id)
+        return len(chunks)
+
+    def ingest_files(self, file_paths: List[str], username: str = None, session_id: str = None):
+        """Orchestrates the ingestion process."""
+        with span("ingest", files=len(file_paths)), usage_scope(username, session_id):
+            print(f"Loading files: {file_paths}")
+            with span("load") as load_span:
+                docs = self.load_documents(file_paths)
+                load_span.set(documents=len(docs))
+            print(f"Loaded {len(docs)} documents")
+            return self._split_and_store(docs, username, session_id)
@@ -0,0 +1,83 @@
+import json
+import os
+import time
+import uuid
+from typing import Any, Dict, Optional
+from db import get_pool
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """
+    Status and results of long-running API requests (ingestion, full quiz generation).
+
+    Jobs live in SQLite so any API worker process can answer a status poll, whichever
+    worker is running the job. Each job records the pid of the worker that owns it; jobs
+    whose worker has died are marked failed by `reap`.
+    """
+
+    def __init__(self, db_path: str = "jobs.db", retention: float = 24 * 3600):
+        self.db_path = db_path
+        self.retention = retention
+        self.pool = get_pool(db_path)
+        self._init_db()
+
+    def _init_db(self):
+        with self.pool.transaction() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS jobs
+                         (id TEXT PRIMARY KEY, user_id TEXT, kind TEXT, status TEXT, result TEXT, error TEXT,
+                          worker_pid INTEGER, created_at REAL, updated_at REAL)''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, updated_at)")
+
+    def create(self, user_id: str, kind: str) -> str:
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self.pool.transaction() as conn:
+            conn.execute("INSERT INTO jobs VALUES (?, ?, ?, 'queued', NULL, NULL, ?, ?, ?)",
+                         (job_id, user_id, kind, os.getpid(), now, now))
+        return job_id
+
+    def _update(self, job_id: str, status: str, result: Any = None, error: str = None):
+        with self.pool.transaction() as conn:
+            conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                         (status, json.dumps(result) if result is not None else None, error, time.time(), job_id))
+
+    def start(self, job_id: str):
+        self._update(job_id, "running")
+
+    def finish(self, job_id: str, result: Any = None):
+        self._update(job_id, "done", result=result)
+
+    def fail(self, job_id: str, error: str):
+        self._update(job_id, "failed", error=error)
+
+    def get(self, job_id: str, user_id: str = None) -> Optional[Dict[str, Any]]:
+        """A job's status and result. With `user_id`, other users' jobs are reported as missing."""
+        with self.pool.read() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row or (user_id is not None and row["user_id"] != user_id):
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def reap(self) -> int:
+        """Fails unfinished jobs of dead workers and drops finished jobs past the retention period."""
+        with self.pool.read() as conn:
+            rows = conn.execute("SELECT id, worker_pid FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        orphaned = [row["id"] for row in rows if not _pid_alive(row["worker_pid"])]
+        for job_id in orphaned:
+            self.fail(job_id, "Worker process exited before the job finished")
+        with self.pool.transaction() as conn:
+            conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                         (time.time() - self.retention,))
+        return len(orphaned)
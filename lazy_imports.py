@@ -0,0 +1,54 @@
+import importlib
+import threading
+from typing import Any, Callable
+
+
+class LazyObject:
+    """
+    Stands in for an object that is expensive to build, building it on first use.
+
+    Attribute access and calls are forwarded to the real object, so a module-level name
+    bound to a LazyObject can be used exactly like the object itself (and still be
+    replaced with `unittest.mock.patch`).
+    """
+
+    def __init__(self, factory: Callable[[], Any], name: str):
+        self._factory = factory
+        self._name = name
+        self._target = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        target = self._target
+        if target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+                target = self._target
+        return target
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._target is not None
+
+    def __getattr__(self, name):
+        # Only reached for names not set in __init__, i.e. the real object's attributes
+        return getattr(self._load(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __repr__(self):
+        state = "loaded" if self.is_loaded else "not loaded"
+        return f"<lazy {self._name} ({state})>"
+
+
+class LazyImport(LazyObject):
+    """A module, or a name from a module, that is imported the first time it is used."""
+
+    def __init__(self, module: str, attr: str = None):
+        def load():
+            imported = importlib.import_module(module)
+            return getattr(imported, attr) if attr else imported
+
+        super().__init__(load, f"{module}.{attr}" if attr else module)
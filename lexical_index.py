@@ -0,0 +1,245 @@
+import json
+import math
+import os
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from db import get_pool
+from lazy_imports import LazyImport
+from lexical_scorer import tokenize
+from tracing import count, span
+
+Document = LazyImport("langchain_core.documents", "Document")
+
+RETRIEVAL_MODES = ("auto", "hybrid", "vector", "lexical")
+
+
+def scope_clause(username: str = None, session_id: str = None,
+                 hashes: Sequence[str] = None) -> Tuple[str, List[Any]]:
+    """
+    SQL over a sidecar table aliased `d` that matches the vector store's scope: the session's
+    own chunks, and the partition's copies of the deduplicated files it references.
+    """
+    own, params = ["d.content_hash IS NULL"], []
+    for column, value in (("user_id", username), ("session_id", session_id)):
+        if value:
+            own.append(f"d.{column}=?")
+            params.append(value)
+    if not hashes:
+        return " AND ".join(own), params
+    # Copies carry the fields of the partition they are stored in (none in the shared collection)
+    content = [f"d.content_hash IN ({','.join('?' * len(hashes))})"]
+    params.extend(hashes)
+    for column, value in (("user_id", username), ("session_id", session_id)):
+        if value:
+            content.append(f"(d.{column} IS NULL OR d.{column}=?)")
+            params.append(value)
+    return f"(({' AND '.join(own)}) OR ({' AND '.join(content)}))", params
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index of the ingested chunks, kept in SQLite next to the vector store.
+
+    Chunks are indexed as they are ingested, under the Chroma id they were stored with and
+    the same scope fields (user, session, content hash) the vector filters use, so a search
+    covers exactly what `VectorStoreRouter.scope` would. Collection statistics are computed
+    per search over the scope, so adding documents never rewrites existing postings.
+    """
+
+    def __init__(self, db_path: str = "lexical.db", k1: float = 1.5, b: float = 0.75):
+        self.db_path = db_path
+        self.k1 = k1
+        self.b = b
+        self.pool = get_pool(db_path)
+        self._init_db()
+
+    def _init_db(self):
+        with self.pool.transaction() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS lex_docs
+                         (doc_id TEXT PRIMARY KEY, user_id TEXT, session_id TEXT, content_hash TEXT,
+                          length INTEGER, content TEXT, metadata TEXT)''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS lex_postings
+                         (term TEXT, doc_id TEXT, tf INTEGER, PRIMARY KEY (term, doc_id)) WITHOUT ROWID''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_lex_postings_doc ON lex_postings (doc_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_lex_docs_scope ON lex_docs (user_id, session_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_lex_docs_hash ON lex_docs (content_hash)")
+
+    def add_documents(self, documents: Sequence[Any], ids: Sequence[str]):
+        """Indexes chunks (LangChain Documents) under their vector-store ids. Re-adding an id replaces it."""
+        docs, postings = [], []
+        for doc, doc_id in zip(documents, ids):
+            terms = Counter(tokenize(doc.page_content))
+            metadata = doc.metadata or {}
+            docs.append((doc_id, metadata.get("user_id"), metadata.get("session_id"), metadata.get("content_hash"),
+                         sum(terms.values()), doc.page_content, json.dumps(metadata)))
+            postings.extend((term, doc_id, tf) for term, tf in terms.items())
+        if not docs:
+            return
+        with span("lexical_index", chunks=len(docs)), self.pool.transaction() as conn:
+            conn.executemany("DELETE FROM lex_postings WHERE doc_id=?", [(d[0],) for d in docs])
+            conn.executemany("INSERT OR REPLACE INTO lex_docs VALUES (?, ?, ?, ?, ?, ?, ?)", docs)
+            conn.executemany("INSERT INTO lex_postings VALUES (?, ?, ?)", postings)
+
+    def _delete_where(self, where: str, params: Sequence[Any]) -> int:
+        with self.pool.transaction() as conn:
+            conn.execute(f"DELETE FROM lex_postings WHERE doc_id IN (SELECT doc_id FROM lex_docs WHERE {where})", params)
+            return conn.execute(f"DELETE FROM lex_docs WHERE {where}", params).rowcount
+
+    def delete_session(self, session_id: str) -> int:
+        return self._delete_where("session_id=?", (session_id,))
+
+    def delete_ids(self, ids: Sequence[str]) -> int:
+        deleted = 0
+        for start in range(0, len(ids), 500):
+            batch = list(ids[start:start + 500])
+            deleted += self._delete_where(f"doc_id IN ({','.join('?' * len(batch))})", batch)
+        return deleted
+
+    def count(self, username: str = None, session_id: str = None, hashes: Sequence[str] = None) -> int:
+        where, params = scope_clause(username, session_id, hashes)
+        with self.pool.read() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM lex_docs d WHERE {where}", params).fetchone()[0]
+
+    def search(self, query: str, k: int = 10, username: str = None, session_id: str = None,
+               hashes: Sequence[str] = None) -> List[Tuple[Any, float]]:
+        """The `k` best (Document, BM25 score) pairs for the query within the scope."""
+        terms = Counter(tokenize(query))
+        if not terms:
+            return []
+        where, params = scope_clause(username, session_id, hashes)
+        with span("lexical_search", terms=len(terms)) as search_span, self.pool.read() as conn:
+            total, avg_length = conn.execute(
+                f"SELECT COUNT(*), AVG(length) FROM lex_docs d WHERE {where}", params).fetchone()
+            if not total:
+                search_span.set(results=0)
+                return []
+            rows = conn.execute(
+                f"SELECT p.term, p.doc_id, p.tf, d.length FROM lex_postings p JOIN lex_docs d ON d.doc_id = p.doc_id "
+                f"WHERE p.term IN ({','.join('?' * len(terms))}) AND {where}", list(terms) + params).fetchall()
+
+            document_frequency = Counter(row["term"] for row in rows)
+            scores: Dict[str, float] = {}
+            for row in rows:
+                df = document_frequency[row["term"]]
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * row["length"] / (avg_length or 1))
+                scores[row["doc_id"]] = scores.get(row["doc_id"], 0.0) + (
+                    terms[row["term"]] * idf * row["tf"] * (self.k1 + 1) / (row["tf"] + norm))
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            if not best:
+                search_span.set(results=0)
+                return []
+            found = {row["doc_id"]: row for row in conn.execute(
+                f"SELECT doc_id, content, metadata FROM lex_docs WHERE doc_id IN ({','.join('?' * len(best))})",
+                [doc_id for doc_id, _ in best])}
+            search_span.set(results=len(best))
+        return [(Document(page_content=found[doc_id]["content"], metadata=json.loads(found[doc_id]["metadata"]),
+                          id=doc_id), score)
+                for doc_id, score in best if doc_id in found]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Any]], k: int = 60) -> List[Any]:
+    """Merges ranked document lists by summed 1 / (k + rank); documents are matched by id (or text)."""
+    scores: Dict[str, float] = {}
+    first_seen: Dict[str, Any] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = getattr(doc, "id", None) or doc.page_content
+            first_seen.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+    return [first_seen[key] for key in sorted(scores, key=lambda key: scores[key], reverse=True)]
+
+
+class HybridRetriever:
+    """
+    Retrieves a session's chunks by fusing BM25 and vector rankings (reciprocal rank fusion),
+    which keeps exact technical terms the embedding search misses.
+
+    Modes (KNOWVAL_RETRIEVAL_MODE): "vector", "lexical", "hybrid", or "auto" (default): when
+    the scope's vector collection isn't loaded in this process yet and the lexical index alone
+    has enough hits, those are returned with no query embedding and the collection is loaded
+    in the background for later searches. A failed vector search falls back to the lexical hits.
+    With a `vector_index` (compact storage), the vector side searches it instead of Chroma.
+    """
+
+    def __init__(self, router, lexical_index: Optional[LexicalIndex] = None, mode: str = None, rrf_k: int = 60,
+                 vector_index=None):
+        mode = mode or os.getenv("KNOWVAL_RETRIEVAL_MODE", "auto")
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+        self.router = router
+        self.lexical_index = lexical_index
+        self.vector_index = vector_index
+        self.mode = mode
+        self.rrf_k = rrf_k
+        self._warming = set()
+        self._lock = threading.Lock()
+
+    def _warm_up(self, username: str, session_id: str):
+        key = (username, session_id)
+        with self._lock:
+            if key in self._warming:
+                return
+            self._warming.add(key)
+
+        def load():
+            try:
+                self.router.scope(username, session_id)
+            except Exception as e:
+                print(f"Background vector store load failed: {e}")
+            finally:
+                with self._lock:
+                    self._warming.discard(key)
+
+        threading.Thread(target=load, name="vector-warmup", daemon=True).start()
+
+    def _vector_search(self, query: str, k: int, username: str, session_id: str, mmr: bool, fetch_k: int):
+        if self.vector_index is not None:
+            ids = self.vector_index.search(self.router.embed_query(query), k, username, session_id,
+                                           self.router.content_hashes(username, session_id), mmr=mmr, fetch_k=fetch_k)
+            return self.router.get_documents(ids, username, session_id)
+        store, filter_dict = self.router.scope(username, session_id)
+        if mmr:
+            try:
+                return store.max_marginal_relevance_search(query, k=k, fetch_k=fetch_k or k * 2, lambda_mult=0.5,
+                                                           filter=filter_dict)
+            except Exception as e:
+                print(f"MMR Search failed ({e}), falling back to similarity search.")
+                count("mmr_fallback")
+        return store.similarity_search(query, k=k, filter=filter_dict)
+
+    def search(self, query: str, k: int, username: str = None, session_id: str = None, mmr: bool = False,
+               fetch_k: int = None) -> List[Any]:
+        """The `k` best chunks for `query` in the user's session. `mmr` diversifies the vector side."""
+        mode = self.mode if self.lexical_index is not None else "vector"
+        with span("retrieve", k=k, mode=mode) as retrieve_span:
+            lexical: List[Any] = []
+            if mode != "vector":
+                hashes = self.router.content_hashes(username, session_id)
+                lexical = [doc for doc, _ in self.lexical_index.search(query, fetch_k or k, username, session_id,
+                                                                       hashes)]
+                # The compact index needs no collection load, so it is never cold
+                if mode == "lexical" or (mode == "auto" and len(lexical) >= k and self.vector_index is None
+                                         and not self.router.is_warm(username, session_id)):
+                    # Cold vector store: answer from the inverted index and load the collection meanwhile
+                    if mode == "auto":
+                        count("lexical_fast_path")
+                        self._warm_up(username, session_id)
+                    retrieve_span.set(path="lexical", results=min(k, len(lexical)))
+                    return lexical[:k]
+
+            try:
+                vector = self._vector_search(query, k, username, session_id, mmr, fetch_k)
+            except Exception as e:
+                if not lexical:
+                    raise
+                print(f"Vector search failed ({e}), using lexical results.")
+                retrieve_span.set(path="lexical_fallback", results=min(k, len(lexical)))
+                return lexical[:k]
+            if not lexical:
+                retrieve_span.set(path="vector", results=len(vector))
+                return vector
+            fused = reciprocal_rank_fusion([vector, lexical], self.rrf_k)[:k]
+            retrieve_span.set(path="hybrid", results=len(fused), lexical_hits=len(lexical))
+            return fused
@@ -0,0 +1,311 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+STOPWORDS = frozenset("""
+a an the and or but if then else of to in on at by for with from as is are was were be been being
+it its this that these those there here which who whom what when where why how do does did done
+has have had having not no nor so than too very can could should would will shall may might must
+i you he she we they me him her us them my your his our their into about over under also just
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+
+# Ordered (suffix, replacement, min_stem_length) rules for a light Porter-style stemmer.
+_SUFFIX_RULES = [
+    ("ational", "ate", 3),
+    ("ation", "ate", 3),
+    ("fulness", "ful", 3),
+    ("iveness", "ive", 3),
+    ("ousness", "ous", 3),
+    ("sses", "ss", 2),
+    ("ies", "y", 2),
+    ("ments", "ment", 3),
+    ("ness", "", 3),
+    ("ment", "", 4),
+    ("ing", "", 3),
+    ("edly", "", 3),
+    ("ed", "", 3),
+    ("ly", "", 3),
+    ("es", "", 4),
+    ("s", "", 3),
+]
+
+
+def stem(word: str) -> str:
+    """Reduces a lowercase word to a crude stem so that inflections compare equal."""
+    if len(word) <= 3 or word.isdigit():
+        return word
+    for suffix, replacement, min_len in _SUFFIX_RULES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= min_len:
+            if suffix == "s" and word.endswith(("ss", "us", "is")):
+                return word
+            word = word[: len(word) - len(suffix)] + replacement
+            break
+    # Drop a trailing "e" so that "merge"/"merging" and "store"/"stored" agree.
+    if len(word) > 4 and word.endswith("e"):
+        word = word[:-1]
+    # Collapse doubled final consonants left behind by "-ing"/"-ed" (e.g. "commit-t-ing").
+    if len(word) > 3 and word[-1] == word[-2] and word[-1] not in "aeiouls":
+        word = word[:-1]
+    return word
+
+
+def tokenize(text: str, remove_stopwords: bool = True) -> List[str]:
+    """Lowercases, splits and stems text into comparable tokens."""
+    tokens = _TOKEN_RE.findall((text or "").lower())
+    if remove_stopwords:
+        tokens = [t for t in tokens if t not in STOPWORDS]
+    return [stem(t) for t in tokens]
+
+
+def ngrams(tokens: List[str], n: int) -> set:
+    """Returns the set of contiguous n-grams in a token list."""
+    return {tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1)}
+
+
+# Answer-vs-chunk similarity below which an answer with no keyword and no shared wording is
+# off-topic. Unrelated texts score very differently per model, so unknown models never zero locally.
+OFF_TOPIC_SIMILARITY = {
+    "text-embedding-ada-002": 0.72,
+    "text-embedding-3-small": 0.15,
+    "text-embedding-3-large": 0.15,
+}
+
+
+def load_calibration(path: str = None) -> Dict[str, float]:
+    """
+    The scorer settings fitted by `bench_evaluator.py --calibrate`, from the JSON file at
+    KNOWVAL_SCORER_CALIBRATION (default scorer_calibration.json), or {} when there is none.
+    """
+    path = path or os.getenv("KNOWVAL_SCORER_CALIBRATION", "scorer_calibration.json")
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            settings = json.load(f)
+        return {k: float(settings[k]) for k in ("slope", "intercept", "off_topic_similarity") if k in settings}
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Ignoring invalid scorer calibration {path}: {e}")
+        return {}
+
+
+def save_calibration(settings: Dict[str, float], path: str = None) -> str:
+    """Writes the scorer settings where `load_calibration` finds them; returns the path."""
+    path = path or os.getenv("KNOWVAL_SCORER_CALIBRATION", "scorer_calibration.json")
+    with open(path, "w") as f:
+        json.dump(settings, f, indent=2)
+    return path
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class LexicalScorer:
+    """
+    Grades free-text answers locally when the outcome is clear-cut.
+
+    Empty answers, off-topic answers and answers that cover every required keyword are
+    scored here. An answer is off-topic when it matches no keyword, shares almost no wording
+    with the source chunk and its embedding is far from the chunk's, so without embeddings
+    it is never zeroed locally. Everything else, including short or paraphrased answers, is
+    marked for escalation to the LLM evaluator, with a keyword-based grade and feedback to
+    fall back on. The calibration and off-topic threshold default to the saved
+    `load_calibration()` settings.
+    """
+
+    def __init__(self, embeddings=None, high_coverage: float = 0.85, min_context_overlap: float = 0.3,
+                 off_topic_overlap: float = 0.1, off_topic_similarity: float = None,
+                 semantic_threshold: float = 0.82, calibration: Tuple[float, float] = None):
+        settings = load_calibration() if calibration is None or off_topic_similarity is None else {}
+        self.embeddings = embeddings
+        self.high_coverage = high_coverage
+        self.min_context_overlap = min_context_overlap
+        self.off_topic_overlap = off_topic_overlap
+        if off_topic_similarity is None:
+            model = getattr(embeddings, "model", None)
+            off_topic_similarity = settings.get("off_topic_similarity", OFF_TOPIC_SIMILARITY.get(model))
+        self.off_topic_similarity = off_topic_similarity
+        self.semantic_threshold = semantic_threshold
+        self.slope, self.intercept = calibration or (settings.get("slope", 10.0), settings.get("intercept", 0.0))
+        self._keyword_embeddings: Dict[str, List[float]] = {}
+        # Small LRU of chunk digest -> embedding, for the off-topic check
+        self._chunk_embeddings: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._chunk_lock = threading.Lock()
+        self._last_answer: Tuple[str, List[float]] = ("", [])
+
+    def _embed_keywords(self, keywords: List[str]) -> Dict[str, List[float]]:
+        """Returns embeddings for the keywords, embedding only the ones not cached yet."""
+        missing = [k for k in {k.strip().lower() for k in keywords} if k and k not in self._keyword_embeddings]
+        if missing:
+            vectors = self.embeddings.embed_documents(missing)
+            self._keyword_embeddings.update(zip(missing, vectors))
+        return {k: self._keyword_embeddings[k.strip().lower()] for k in keywords if k.strip()}
+
+    def _lexical_match(self, answer_tokens: List[str], keyword: str) -> float:
+        """Scores how well a single keyword (or phrase) appears in the answer, from 0 to 1."""
+        kw_tokens = tokenize(keyword) or tokenize(keyword, remove_stopwords=False)
+        if not kw_tokens:
+            return 0.0
+        if tuple(kw_tokens) in ngrams(answer_tokens, len(kw_tokens)):
+            return 1.0
+        present = sum(1 for t in kw_tokens if t in answer_tokens)
+        if present == len(kw_tokens):
+            return 0.8
+        fraction = present / len(kw_tokens)
+        return fraction * 0.5 if fraction >= 0.5 else 0.0
+
+    def _embed_answer(self, user_answer: str) -> List[float]:
+        """The answer's embedding; the keyword and off-topic checks of one answer share it."""
+        text, vector = self._last_answer
+        if text != user_answer:
+            vector = self.embeddings.embed_query(user_answer)
+            self._last_answer = (user_answer, vector)
+        return vector
+
+    def _embed_chunk(self, chunk_content: str) -> List[float]:
+        key = hashlib.sha1(chunk_content.encode("utf-8")).hexdigest()
+        with self._chunk_lock:
+            if key in self._chunk_embeddings:
+                self._chunk_embeddings.move_to_end(key)
+                return self._chunk_embeddings[key]
+        vector = self.embeddings.embed_documents([chunk_content])[0]
+        with self._chunk_lock:
+            self._chunk_embeddings[key] = vector
+            if len(self._chunk_embeddings) > 256:
+                self._chunk_embeddings.popitem(last=False)
+        return vector
+
+    def chunk_similarity(self, user_answer: str, chunk_content: str) -> Optional[float]:
+        """Cosine similarity of the answer and chunk embeddings, or None without embeddings."""
+        if self.embeddings is None or not chunk_content:
+            return None
+        try:
+            return _cosine(self._embed_answer(user_answer), self._embed_chunk(chunk_content))
+        except Exception as e:
+            print(f"Answer similarity check failed: {e}")
+            return None
+
+    def keyword_coverage(self, user_answer: str, keywords: List[str]) -> Tuple[float, List[str], List[str]]:
+        """Returns (coverage, keywords_present, keywords_missing) using lexical and semantic matches."""
+        keywords = [k for k in (keywords or []) if k and k.strip()]
+        if not keywords:
+            return 0.0, [], []
+
+        answer_tokens = tokenize(user_answer)
+        scores = {k: self._lexical_match(answer_tokens, k) for k in keywords}
+
+        unmatched = [k for k, s in scores.items() if s < 0.5]
+        if unmatched and self.embeddings is not None and answer_tokens:
+            try:
+                keyword_vectors = self._embed_keywords(unmatched)
+                answer_vector = self._embed_answer(user_answer)
+                for k in unmatched:
+                    if _cosine(answer_vector, keyword_vectors[k]) >= self.semantic_threshold:
+                        scores[k] = max(scores[k], 0.7)
+            except Exception as e:
+                print(f"Semantic keyword check failed: {e}")
+
+        present = [k for k, s in scores.items() if s >= 0.5]
+        missing = [k for k in keywords if k not in present]
+        return sum(scores.values()) / len(keywords), present, missing
+
+    def context_overlap(self, user_answer: str, chunk_content: str) -> float:
+        """Fraction of the answer's content words (unigrams and bigrams) found in the source chunk."""
+        answer_tokens = tokenize(user_answer)
+        if not answer_tokens:
+            return 0.0
+        chunk_tokens = tokenize(chunk_content)
+        unigram_hits = len(set(answer_tokens) & set(chunk_tokens)) / len(set(answer_tokens))
+        answer_bigrams = ngrams(answer_tokens, 2)
+        if not answer_bigrams:
+            return unigram_hits
+        bigram_hits = len(answer_bigrams & ngrams(chunk_tokens, 2)) / len(answer_bigrams)
+        return 0.7 * unigram_hits + 0.3 * bigram_hits
+
+    def raw_score(self, coverage: float, overlap: float) -> float:
+        """Combines keyword coverage and context overlap into a 0-1 raw score."""
+        return 0.7 * coverage + 0.3 * overlap
+
+    def calibrated_score(self, raw: float) -> int:
+        """Maps a raw score onto the 0-10 scale used by the LLM grader."""
+        return int(max(0, min(10, round(self.slope * raw + self.intercept))))
+
+    def calibrate(self, samples: List[Tuple[float, float]]) -> Tuple[float, float]:
+        """
+        Fits the raw->score mapping by least squares against (raw_score, llm_score) pairs.
+        Returns and applies the new (slope, intercept).
+        """
+        if len(samples) < 2:
+            return self.slope, self.intercept
+        n = len(samples)
+        mean_x = sum(x for x, _ in samples) / n
+        mean_y = sum(y for _, y in samples) / n
+        var_x = sum((x - mean_x) ** 2 for x, _ in samples)
+        if var_x == 0:
+            return self.slope, self.intercept
+        self.slope = sum((x - mean_x) * (y - mean_y) for x, y in samples) / var_x
+        self.intercept = mean_y - self.slope * mean_x
+        return self.slope, self.intercept
+
+    def prescore(self, question: str, user_answer: str, chunk_content: str, keywords: List[str]) -> Dict[str, Any]:
+        """
+        Scores an answer locally. The result has the same keys as AnswerEvaluator.evaluate_answer,
+        plus "decision" ("local" or "escalate"), "confidence" and "raw_score".
+        """
+        keywords = keywords or []
+        answer_tokens = tokenize(user_answer)
+
+        if not answer_tokens:
+            return self._result(0, 0.0, 1.0, "local", "No answer was given.", [], keywords)
+
+        coverage, present, missing = self.keyword_coverage(user_answer, keywords)
+        overlap = self.context_overlap(user_answer, chunk_content)
+        raw = self.raw_score(coverage, overlap)
+
+        if not present and overlap < self.off_topic_overlap and self.off_topic_similarity is not None:
+            # A short answer or a paraphrase can be right without sharing a word with the source,
+            # so it takes the embeddings to tell it apart from an answer about something else
+            similarity = self.chunk_similarity(user_answer, chunk_content)
+            if similarity is not None and similarity < self.off_topic_similarity:
+                feedback = "The answer does not address the question or the source material."
+                confidence = min(1.0, 0.5 + (self.off_topic_similarity - similarity))
+                return self._result(0, raw, confidence, "local", feedback, present, missing)
+
+        if keywords and coverage >= self.high_coverage and overlap >= self.min_context_overlap:
+            feedback = "The answer covers all of the key concepts."
+            confidence = min(1.0, (coverage + overlap) / 2 + 0.25)
+            return self._result(self.calibrated_score(raw), raw, confidence, "local", feedback, present, missing)
+
+        return self._result(self.calibrated_score(raw), raw, 0.0, "escalate",
+                            self.keyword_feedback(present, missing, overlap), present, missing)
+
+    def keyword_feedback(self, present: List[str], missing: List[str], overlap: float) -> str:
+        """Feedback for a locally graded answer, from the keywords it covers and misses."""
+        parts = []
+        if present:
+            parts.append(f"You covered {', '.join(present)}.")
+        if missing:
+            parts.append(f"Review {', '.join(missing)}, which the answer doesn't address.")
+        if overlap < self.min_context_overlap:
+            parts.append("Tie the answer more closely to the source material.")
+        return " ".join(parts) or "The answer covers all of the key concepts."
+
+    def _result(self, score, raw, confidence, decision, feedback, present, missing) -> Dict[str, Any]:
+        return {
+            "score": score,
+            "feedback": feedback,
+            "keywords_present": list(present),
+            "keywords_missing": list(missing),
+            "decision": decision,
+            "confidence": round(confidence, 3),
+            "raw_score": round(raw, 3),
+        }
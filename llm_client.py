@@ -0,0 +1,207 @@
+import asyncio
+import contextvars
+import inspect
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Deque, Dict, Any, List, Optional
+from rate_limiter import get_rate_limiter
+from tracing import span
+from usage import BudgetExceeded, count_tokens, current_scope, get_usage_tracker
+
+# Per-call timeout in seconds, tightened by any enclosing deadline_scope
+DEFAULT_TIMEOUT = float(os.getenv("KNOWVAL_LLM_TIMEOUT", 120))
+# A duplicate request is sent once a call runs past this percentile of its recent latencies (0 disables)
+HEDGE_PERCENTILE = float(os.getenv("KNOWVAL_HEDGE_PERCENTILE", 0.95))
+HEDGE_MIN_SAMPLES = 20
+
+_deadline: "contextvars.ContextVar[Optional[float]]" = contextvars.ContextVar("knowval_deadline", default=None)
+_latencies: Dict[str, Deque[float]] = {}
+_latencies_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("KNOWVAL_LLM_THREADS", 32)), thread_name_prefix="llm-call")
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def _text(value) -> str:
+    return value if isinstance(value, str) else str(value)
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]):
+    """LLM calls inside the block must finish within `seconds`. Nested scopes can only tighten it."""
+    if seconds is None:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(min(deadline, current) if current is not None else deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the current deadline, or None without one."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """A background event loop for async chain calls, which (unlike threads) can be cancelled mid-request."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-async", daemon=True).start()
+        return _loop
+
+
+def record_latency(call_type: str, latency: float):
+    with _latencies_lock:
+        _latencies.setdefault(call_type, deque(maxlen=200)).append(latency)
+
+
+def hedge_delay(call_type: str) -> Optional[float]:
+    """How long to wait before hedging a call, from its recent latencies. None until enough samples."""
+    if not HEDGE_PERCENTILE:
+        return None
+    with _latencies_lock:
+        samples = sorted(_latencies.get(call_type, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE))]
+
+
+class _Attempt:
+    """One request for a call, sent through the rate limiter on the shared call pool."""
+
+    def __init__(self, chain, inputs: Dict[str, Any], limiter, tokens: int, route: str):
+        self.chain = chain
+        self.inputs = inputs
+        self.cancelled = False
+        # Whether the request went out (and its prompt is paid for); final once `cancel` returns
+        self.sent = False
+        self.failed = False
+        self.task = None
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        # Each attempt runs in its own copy of the caller's context (tracing, usage scope)
+        self.future = _executor.submit(contextvars.copy_context().run, limiter.call, self._run, tokens=tokens,
+                                     route=route)
+
+    def _run(self):
+        with self._lock:
+            if self.cancelled:
+                raise CancelledError()
+            self.sent = True
+        self.started = time.monotonic()
+        ainvoke = getattr(self.chain, "ainvoke", None)
+        if inspect.iscoroutinefunction(ainvoke):
+            self.task = asyncio.run_coroutine_threadsafe(ainvoke(self.inputs), _event_loop())
+            if self.cancelled:
+                self.task.cancel()
+            return self.task.result()
+        return self.chain.invoke(self.inputs)
+
+    def cancel(self):
+        """Drops the request: a queued one never starts and an async one is aborted mid-flight."""
+        with self._lock:
+            self.cancelled = True
+        self.future.cancel()
+        if self.task is not None:
+            self.task.cancel()
+
+
+def _run_hedged(call_type: str, chain, inputs: Dict[str, Any], model: str, limiter, tokens: int, llm_span):
+    """Runs the call with a timeout, sending one duplicate past the hedge delay. The loser is cancelled."""
+    remaining = remaining_time()
+    timeout = DEFAULT_TIMEOUT if remaining is None else min(DEFAULT_TIMEOUT, remaining)
+    if timeout <= 0:
+        raise DeadlineExceeded(f"No time left for {call_type}")
+    start = time.monotonic()
+    end = start + timeout
+    # Latency history is per call type and model, since routed call types use several models
+    route = f"{call_type}:{model}"
+    delay = hedge_delay(route)
+    attempts: List[_Attempt] = [_Attempt(chain, inputs, limiter, tokens, route)]
+    winner, error = None, None
+    try:
+        while True:
+            for index, attempt in enumerate(attempts):
+                if not attempt.future.done() or attempt.failed:
+                    continue
+                try:
+                    result = attempt.future.result()
+                except Exception as e:
+                    attempt.failed, error = True, e
+                    continue
+                winner = attempt
+                record_latency(route, time.monotonic() - attempt.started)
+                llm_span.set(attempts=len(attempts), winner="hedge" if index else "primary")
+                return result
+            live = [a.future for a in attempts if not a.future.done()]
+            if not live:
+                raise error
+            now = time.monotonic()
+            if now >= end:
+                llm_span.set(timed_out=True)
+                raise DeadlineExceeded(f"{call_type} did not finish within {timeout:.1f}s")
+            can_hedge = delay is not None and len(attempts) == 1
+            if can_hedge and now >= start + delay:
+                attempts.append(_Attempt(chain, inputs, limiter, tokens, route))
+                llm_span.set(hedged_after_ms=round(delay * 1000, 1))
+                continue
+            next_event = min(end, start + delay) if can_hedge else end
+            wait(live, timeout=max(0.0, next_event - now), return_when=FIRST_COMPLETED)
+    finally:
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.cancel()
+        if sum(attempt.sent for attempt in attempts) > 1:
+            # The duplicate's prompt is paid for even if it loses; one cancelled while still queued never went out
+            user_id, session_id = current_scope()
+            get_usage_tracker().record(f"{call_type}_hedge", model, tokens, 0, user_id, session_id, True)
+
+
+def invoke_llm(call_type: str, chain, inputs: Dict[str, Any], model: str = "gpt-4o"):
+    """
+    Runs `chain.invoke(inputs)` with budget enforcement, usage accounting and tracing.
+
+    The prompt size is estimated with tiktoken before the call; if the current user's budget
+    is already used up the call is refused with BudgetExceeded. Reported token usage is
+    recorded afterwards (estimated from the response text when the model doesn't report it).
+    The call itself goes through the process-wide chat rate limiter, which queues it and
+    retries 429s with backoff. It gives up with DeadlineExceeded after KNOWVAL_LLM_TIMEOUT
+    seconds or at the enclosing `deadline_scope`, and is hedged with a duplicate request once
+    it runs slower than most recent calls of the same type.
+    """
+    tracker = get_usage_tracker()
+    user_id, session_id = current_scope()
+    estimated_in = sum(count_tokens(_text(v), model) for v in inputs.values())
+    status = tracker.check(user_id, pending_tokens=estimated_in)
+    if status.exhausted:
+        raise BudgetExceeded(f"Usage budget exhausted for {user_id or 'anonymous user'} "
+                             f"({status.tokens} tokens, ${status.cost:.4f} in the last 24h)")
+
+    with span(f"llm:{call_type}", model=model, estimated_tokens_in=estimated_in) as llm_span:
+        limiter = get_rate_limiter("chat")
+        response = _run_hedged(call_type, chain, inputs, model, limiter, estimated_in, llm_span)
+        usage = getattr(response, "usage_metadata", None)
+        if isinstance(usage, dict) and usage.get("input_tokens") is not None:
+            tokens_in, tokens_out, estimated = usage.get("input_tokens", 0), usage.get("output_tokens", 0), False
+        else:
+            tokens_in, estimated = estimated_in, True
+            tokens_out = count_tokens(_text(getattr(response, "content", "")), model)
+        limiter.settle(tokens_in + tokens_out - estimated_in)
+        cost = tracker.record(call_type, model, tokens_in, tokens_out, user_id, session_id, estimated)
+        llm_span.set(tokens_in=tokens_in, tokens_out=tokens_out, cost=cost, budget_state=status.state)
+    return response
@@ -0,0 +1,281 @@
+"""
+Multi-user load test of the app's flows against the real managers.
+
+Usage:
+    python load_test.py [--users 1,5,10,25] [--iterations 1] [--output load.json]
+
+Simulates N concurrent users in one process, as they would share one `app.py` process:
+login -> upload -> discover topics -> start quiz -> answer -> results, using the
+same manager calls as the Streamlit pages and one shared ManagerRegistry. Each concurrency
+level reports per-step latency percentiles, error rates, throughput and resource use (peak
+RSS, CPU time, LLM calls and 429s, scheduler queue wait), so the point where SQLite locks
+or Chroma queries start to degrade shows up as concurrency increases.
+
+The LLM and embeddings are served by fake_openai.py unless --live is given.
+"""
+__import__('pysqlite3')
+import sys
+sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from bench_pipeline import peak_rss_mb, percentile, synthetic_text
+
+STEPS = ["login", "upload", "discover_topics", "start_quiz", "answer", "results"]
+
+# Each simulated user uploads its own shuffle of this text
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample.txt"), encoding="utf-8") as f:
+    SAMPLE = f.read()
+
+
+class StepRecorder:
+    """Thread-safe latencies and errors per step for one concurrency level."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {step: [] for step in STEPS}
+        self.errors: Dict[str, int] = {step: 0 for step in STEPS}
+        self.messages: Counter = Counter()
+
+    @contextlib.contextmanager
+    def step(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            with self._lock:
+                self.errors[name] += 1
+                self.messages[f"{name}: {type(e).__name__}: {str(e)[:120]}"] += 1
+            raise
+        finally:
+            with self._lock:
+                self.latencies[name].append((time.perf_counter() - start) * 1000)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        steps = {}
+        for name in STEPS:
+            values = self.latencies[name]
+            if not values:
+                continue
+            steps[name] = {
+                "count": len(values), "errors": self.errors[name],
+                "error_rate": round(self.errors[name] / len(values), 3),
+                "p50_ms": round(percentile(values, 0.5), 1), "p95_ms": round(percentile(values, 0.95), 1),
+                "p99_ms": round(percentile(values, 0.99), 1), "max_ms": round(max(values), 1),
+            }
+        return steps
+
+
+def _expect(result, what: str):
+    # The managers report failures by printing and returning None/False, as the UI expects
+    if result is None or result is False:
+        raise RuntimeError(f"{what} failed")
+    return result
+
+
+def seed_account(auth, email: str, password: str):
+    """Creates the account up front; register_user's MX lookup would make the run depend on DNS."""
+    with auth.pool.transaction() as conn:
+        conn.execute("INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)",
+                     (email, auth._hash_password(password)))
+
+
+def user_flow(registry, recorder: StepRecorder, email: str, upload: bytes, questions: int, think: float,
+              rng: random.Random):
+    """One user's pass through the app, mirroring the calls made by app.py's pages."""
+    password = "load-test-password"
+    seed_account(registry.auth, email, password)
+    with recorder.step("login"):
+        _expect(registry.auth.login_user(email, password) or None, "login")
+        registry.sessions.list_user_sessions(email, limit=50)
+    time.sleep(think)
+
+    session_id = str(uuid.uuid4())
+    with recorder.step("upload"):
+        _expect(registry.sessions.create_session(email, name="Quiz: notes.txt", session_id=session_id), "create session")
+        registry.ingestion.ingest_buffers([("notes.txt", upload)], username=email, session_id=session_id)
+        registry.prefetcher.invalidate(session_id)
+    time.sleep(think)
+
+    with recorder.step("discover_topics"):
+        topics = registry.topics.discover_topics(username=email, session_id=session_id)
+        topic = topics[0] if topics else "General Knowledge"
+        registry.sessions.update_session_name(session_id, topic)
+    time.sleep(think)
+
+    with recorder.step("start_quiz"):
+        registry.usage.check(email)
+        quiz = _expect(registry.generator.generate_quiz(topic, num_chunks=questions, username=email,
+                                                        session_id=session_id) or None, "quiz generation")
+        _expect(registry.sessions.start_quiz(session_id, quiz), "saving the quiz")
+
+    score = 0
+    for index, question in enumerate(quiz):
+        time.sleep(think)
+        with recorder.step("answer"):
+            choice = rng.choice(list(question["options"]))
+            correct = choice == question["correct_answer"]
+            score += 10 if correct else 0
+            _expect(registry.sessions.record_answer(session_id, index, {
+                "question": question["question"], "user_choice": choice, "correct_choice": question["correct_answer"],
+                "is_correct": correct, "explanation": question.get("explanation", "")}, score), "recording an answer")
+            _expect(registry.sessions.update_progress(session_id, index + 1, score, False), "saving progress")
+
+    with recorder.step("results"):
+        state = _expect(registry.sessions.load_quiz_state(session_id), "loading results")
+        if len(state["user_answers"]) != len(quiz):
+            raise RuntimeError(f"{len(state['user_answers'])} of {len(quiz)} answers were saved")
+        registry.sessions.list_user_sessions(email, limit=50)
+
+
+def run_level(registry, users: int, iterations: int, questions: int, think: float, fake=None) -> Dict[str, Any]:
+    recorder = StepRecorder()
+    level_id = uuid.uuid4().hex[:6]
+    seed_base = int(level_id, 16) * 1000000
+    before_cpu = resource.getrusage(resource.RUSAGE_SELF)
+    before_fake = dict(fake.counters) if fake else {}
+    completed = [0]
+    lock = threading.Lock()
+
+    def run_user(index: int):
+        rng = random.Random(index)
+        for iteration in range(iterations):
+            email = f"load-{level_id}-{index}-{iteration}@example.com"
+            # Distinct documents per user, so nothing is deduplicated away
+            upload = "\n\n".join(synthetic_text(SAMPLE, pages=3, seed=seed_base + index * 1000 + iteration)).encode("utf-8")
+            try:
+                user_flow(registry, recorder, email, upload, questions, think, rng)
+            except Exception:
+                continue
+            with lock:
+                completed[0] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=run_user, args=(i,), name=f"load-user-{i}") for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    after_cpu = resource.getrusage(resource.RUSAGE_SELF)
+    from scheduler import get_scheduler
+    waits = get_scheduler().stats()["wait_ms"]
+    result = {
+        "users": users,
+        "flows": users * iterations,
+        "completed": completed[0],
+        "duration_s": round(duration, 2),
+        "flows_per_s": round(completed[0] / duration, 3) if duration else 0.0,
+        "steps": recorder.summary(),
+        "top_errors": dict(recorder.messages.most_common(5)),
+        "resources": {
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "cpu_s": round((after_cpu.ru_utime - before_cpu.ru_utime) + (after_cpu.ru_stime - before_cpu.ru_stime), 2),
+            # The scheduler keeps one window of recent waits for the whole run
+            "queue_wait_p95_ms_so_far": {priority: w["p95"] for priority, w in waits.items()},
+        },
+    }
+    if fake:
+        result["resources"].update({
+            "llm_calls": fake.counters["chat"] - before_fake["chat"],
+            "embedding_calls": fake.counters["embeddings"] - before_fake["embeddings"],
+            "rate_limited": fake.counters["rate_limited"] - before_fake["rate_limited"],
+        })
+    return result
+
+
+def print_table(levels: List[Dict[str, Any]]):
+    print(f"{'users':>5} {'step':<16} {'count':>6} {'err%':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}", file=sys.stderr)
+    for level in levels:
+        for name, step in level["steps"].items():
+            print(f"{level['users']:>5} {name:<16} {step['count']:>6} {step['error_rate'] * 100:>5.1f}% "
+                  f"{step['p50_ms']:>9.1f} {step['p95_ms']:>9.1f} {step['p99_ms']:>9.1f}", file=sys.stderr)
+        resources = level["resources"]
+        print(f"{level['users']:>5} {'(level)':<16} {level['completed']}/{level['flows']} flows in "
+              f"{level['duration_s']}s, {resources['cpu_s']} CPU s, peak RSS {resources['peak_rss_mb']} MB",
+              file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", default="1,5,10,25", help="Comma-separated concurrency levels")
+    parser.add_argument("--iterations", type=int, default=1, help="Flows per user at each level")
+    parser.add_argument("--questions", type=int, default=5, help="Questions per quiz")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Pause between a user's steps")
+    parser.add_argument("--live", action="store_true", help="Use the configured OpenAI API instead of the fake")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Fake chat latency (median)")
+    parser.add_argument("--rpm", type=int, default=0, help="Fake requests-per-minute limit (0 = unlimited)")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the managers' own output")
+    args = parser.parse_args()
+    levels = [int(n) for n in args.users.split(",") if n.strip()]
+
+    workdir = tempfile.mkdtemp(prefix="knowval-load-")
+    # Usage and rate-limit state stay out of the real databases
+    os.environ["KNOWVAL_USAGE_DB"] = os.path.join(workdir, "usage.db")
+    os.environ.pop("KNOWVAL_RATE_LIMIT_DB", None)
+    server = None
+    if not args.live:
+        from fake_openai import FakeOpenAI, FakeOpenAIServer
+        server = FakeOpenAIServer(FakeOpenAI(latency_ms=args.latency_ms, rpm=args.rpm)).start()
+        os.environ.update(server.environment())
+
+    from resources import ManagerRegistry
+    registry = ManagerRegistry(persist_directory=os.path.join(workdir, "chroma"),
+                               users_db=os.path.join(workdir, "users.db"),
+                               sessions_db=os.path.join(workdir, "sessions.db"),
+                               documents_db=os.path.join(workdir, "documents.db"),
+                               lexical_db=os.path.join(workdir, "lexical.db"),
+                               vectors_db=os.path.join(workdir, "vectors.db"))
+    results = []
+    try:
+        # One unrecorded flow first, so imports and the first Chroma collection don't land on level 1
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_level(registry, 1, 1, args.questions, 0.0)
+        for users in levels:
+            output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with output:
+                results.append(run_level(registry, users, args.iterations, args.questions, args.think_ms / 1000,
+                                         server.fake if server else None))
+            print(f"{users} users: {results[-1]['completed']}/{results[-1]['flows']} flows "
+                  f"in {results[-1]['duration_s']}s", file=sys.stderr)
+    finally:
+        registry.close()
+        if server:
+            server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "benchmark": "load",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"iterations": args.iterations, "questions": args.questions, "think_ms": args.think_ms,
+                   "backend": "live" if args.live else "fake", "latency_ms": args.latency_ms, "rpm": args.rpm},
+        "levels": results,
+    }
+    print_table(results)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,17 +8,15 @@ from dotenv import load_dotenv
 # Load environment variables immediately
 load_dotenv()
 
-from ingestion import IngestionManager
-from generator import QuizGenerator
-from evaluator import AnswerEvaluator
-from topic_discovery import TopicManager
+from resources import ManagerRegistry
 
 class KnowvalApp:
     def __init__(self):
-        self.ingestion_manager = IngestionManager()
-        self.quiz_generator = QuizGenerator()
-        self.evaluator = AnswerEvaluator()
-        self.topic_manager = TopicManager()
+        self.registry = ManagerRegistry()
+        self.ingestion_manager = self.registry.lazy("ingestion")
+        self.quiz_generator = self.registry.lazy("generator")
+        self.evaluator = self.registry.lazy("evaluator")
+        self.topic_manager = self.registry.lazy("topics")
 
     def handle_ingestion(self):
         print("\n--- Step 1: Document Ingestion ---")
@@ -0,0 +1,136 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from llm_client import DeadlineExceeded, invoke_llm
+from tracing import span
+from usage import BudgetExceeded
+
+# Models tried in order for each call type; a call escalates to the next tier when the
+# cheaper model's output fails validation. Question generation stays on the strong model.
+DEFAULT_ROUTES: Dict[str, List[str]] = {
+    "expand_topic": ["gpt-4o-mini", "gpt-4o"],
+    "relevance_check": ["gpt-4o-mini", "gpt-4o"],
+    "discover_topics": ["gpt-4o-mini", "gpt-4o"],
+    "evaluate_answer": ["gpt-4o-mini", "gpt-4o"],
+    "quiz_batch": ["gpt-4o"],
+}
+DEFAULT_TIERS = ["gpt-4o"]
+
+
+class RoutingError(ValueError):
+    """Every tier of a route failed to produce a valid result."""
+
+
+def load_routes() -> Dict[str, List[str]]:
+    """The default routes, overridden per call type by KNOWVAL_MODEL_ROUTES (a JSON object of model lists)."""
+    routes = dict(DEFAULT_ROUTES)
+    override = os.getenv("KNOWVAL_MODEL_ROUTES")
+    if override:
+        try:
+            routes.update({k: [v] if isinstance(v, str) else list(v) for k, v in json.loads(override).items()})
+        except (ValueError, AttributeError) as e:
+            print(f"Ignoring invalid KNOWVAL_MODEL_ROUTES: {e}")
+    return routes
+
+
+class ModelRouter:
+    """
+    Sends each call type to its model tiers, escalating on validation failure, and keeps
+    per-route (call type, model) latency and acceptance stats.
+    """
+
+    def __init__(self, routes: Dict[str, List[str]] = None, latency_samples: int = 500):
+        self.routes = routes if routes is not None else load_routes()
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._latency_samples = latency_samples
+
+    def tiers(self, call_type: str) -> List[str]:
+        return self.routes.get(call_type) or DEFAULT_TIERS
+
+    def _record(self, call_type: str, model: str, outcome: str, latency: float):
+        with self._lock:
+            stats = self._stats.setdefault((call_type, model), {
+                "calls": 0, "accepted": 0, "escalated": 0, "rejected": 0, "errors": 0,
+                "latencies": deque(maxlen=self._latency_samples)})
+            stats["calls"] += 1
+            stats[outcome] += 1
+            stats["latencies"].append(latency)
+
+    def invoke(self, call_type: str, make_chain: Callable[[str], Any], inputs: Dict[str, Any],
+               validate: Callable[[Any], Any] = None, confident: Callable[[Any], bool] = None) -> Any:
+        """
+        Runs the call on each tier in turn. `make_chain(model)` builds the chain for a model;
+        `validate(response)` returns the parsed result, or None / raises to escalate. A valid
+        result that `confident(result)` rejects also escalates, unless it came from the last
+        tier. Returns the first accepted result (the response itself without `validate`).
+        Budget and deadline errors are never escalated.
+        """
+        tiers = self.tiers(call_type)
+        last_error: Optional[Exception] = None
+        with span(f"route:{call_type}") as route_span:
+            for tier, model in enumerate(tiers):
+                final = tier == len(tiers) - 1
+                start = time.monotonic()
+                try:
+                    response = invoke_llm(call_type, make_chain(model), inputs, model=model)
+                    result = validate(response) if validate else response
+                except (BudgetExceeded, DeadlineExceeded):
+                    raise
+                except Exception as e:
+                    self._record(call_type, model, "errors" if final else "escalated", time.monotonic() - start)
+                    last_error = e
+                    continue
+                if result is None:
+                    self._record(call_type, model, "rejected" if final else "escalated", time.monotonic() - start)
+                    last_error = None
+                    continue
+                if confident and not final and not confident(result):
+                    self._record(call_type, model, "escalated", time.monotonic() - start)
+                    route_span.add("low_confidence")
+                    continue
+                self._record(call_type, model, "accepted", time.monotonic() - start)
+                route_span.set(model=model, escalations=tier)
+                return result
+            route_span.set(escalations=len(tiers))
+        raise RoutingError(f"No model produced a valid {call_type} result"
+                           + (f" (last error: {last_error})" if last_error else ""))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Per-route call counts, acceptance rate and latency, for dashboards and tuning the routes."""
+        rows = []
+        with self._lock:
+            items = [(key, dict(stats), sorted(stats["latencies"])) for key, stats in self._stats.items()]
+        for (call_type, model), stats, latencies in items:
+            rows.append({
+                "call_type": call_type, "model": model, "calls": stats["calls"],
+                "accepted": stats["accepted"], "escalated": stats["escalated"],
+                "rejected": stats["rejected"], "errors": stats["errors"],
+                "acceptance_rate": round(stats["accepted"] / stats["calls"], 3),
+                "avg_ms": round(sum(latencies) / len(latencies) * 1000, 1),
+                "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+            })
+        rows.sort(key=lambda r: (r["call_type"], self.tiers(r["call_type"]).index(r["model"])
+                                 if r["model"] in self.tiers(r["call_type"]) else 99))
+        return rows
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_model_router() -> ModelRouter:
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
+
+
+def invoke_routed(call_type: str, make_chain: Callable[[str], Any], inputs: Dict[str, Any],
+                  validate: Callable[[Any], Any] = None, confident: Callable[[Any], bool] = None) -> Any:
+    """`ModelRouter.invoke` on the process-wide router."""
+    return get_model_router().invoke(call_type, make_chain, inputs, validate, confident)
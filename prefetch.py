@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import List, Dict, Any, Optional, Tuple
+from scheduler import PREFETCH
+
+# How long "Start Quiz" waits for a prefetch still in flight; finishing it beats starting over
+TAKE_WAIT = float(os.getenv("KNOWVAL_PREFETCH_WAIT", 20))
+
+PrefetchKey = Tuple[Optional[str], Optional[str], str, str]
+
+
+class QuizPrefetcher:
+    """
+    Generates a session's next quiz in the background while the current one is being answered.
+
+    Results are keyed by (user, session, topic, difficulty) and kept in a bounded LRU with a
+    time-to-live, so a follow-up "Start Quiz" with the same settings can start instantly.
+    Each prefetched quiz is handed out once. Prefetch LLM calls run at the lowest scheduler
+    priority, behind anyone waiting for a quiz now.
+    """
+
+    def __init__(self, generator, max_entries: int = 32, ttl: float = 15 * 60, max_workers: int = 2):
+        self.generator = generator
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="quiz-prefetch")
+        self._lock = threading.Lock()
+        # key -> (created_at, future)
+        self._entries: "OrderedDict[PrefetchKey, Tuple[float, Future]]" = OrderedDict()
+        self._stats = {"scheduled": 0, "hits": 0, "misses": 0, "expired": 0, "evicted": 0, "failed": 0,
+                       "abandoned": 0}
+
+    @staticmethod
+    def key(topic: str, difficulty: str, username: str = None, session_id: str = None) -> PrefetchKey:
+        return (username, session_id, topic.strip().lower(), difficulty)
+
+    def prefetch(self, topic: str, difficulty: str = "Medium", username: str = None, session_id: str = None,
+                 exclude_questions: List[str] = None, num_chunks: int = None) -> bool:
+        """Schedules generation of the next quiz. Returns False if one is already cached or in flight."""
+        key = self.key(topic, difficulty, username, session_id)
+        with self._lock:
+            self._expire_locked()
+            if key in self._entries:
+                return False
+            future = self._executor.submit(
+                self.generator.generate_quiz, topic, num_chunks=num_chunks, difficulty=difficulty,
+                username=username, session_id=session_id, exclude_questions=exclude_questions or [],
+                priority=PREFETCH)
+            self._entries[key] = (time.monotonic(), future)
+            self._stats["scheduled"] += 1
+            while len(self._entries) > self.max_entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                evicted.cancel()
+                self._stats["evicted"] += 1
+        return True
+
+    def take(self, topic: str, difficulty: str = "Medium", username: str = None, session_id: str = None,
+             wait: float = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Returns and removes the prefetched quiz for these settings, or None if there is none.
+        An in-flight prefetch is waited on for up to `wait` seconds (default TAKE_WAIT); one still
+        running then is dropped, so the caller's own generation replaces it and the settings can
+        be prefetched again.
+        """
+        key = self.key(topic, difficulty, username, session_id)
+        with self._lock:
+            self._expire_locked()
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+        future = entry[1]
+
+        try:
+            quiz = future.result(timeout=TAKE_WAIT if wait is None else wait)
+        except FutureTimeout:
+            future.cancel()
+            with self._lock:
+                self._stats["abandoned"] += 1
+                self._stats["misses"] += 1
+            return None
+        except Exception as e:
+            print(f"Quiz prefetch failed: {e}")
+            with self._lock:
+                self._stats["failed"] += 1
+            return None
+
+        with self._lock:
+            self._stats["hits" if quiz else "misses"] += 1
+        return quiz or None
+
+    def invalidate(self, session_id: str):
+        """Drops prefetched quizzes for a session, e.g. after new documents are ingested or it is deleted."""
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == session_id]:
+                _, future = self._entries.pop(key)
+                future.cancel()
+
+    def _expire_locked(self):
+        cutoff = time.monotonic() - self.ttl
+        for key in [k for k, (created_at, _) in self._entries.items() if created_at < cutoff]:
+            _, future = self._entries.pop(key)
+            future.cancel()
+            self._stats["expired"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries)}
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
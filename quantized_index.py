@@ -0,0 +1,320 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from db import get_pool
+from lazy_imports import LazyImport
+from lexical_index import scope_clause
+from tracing import count, span
+
+Document = LazyImport("langchain_core.documents", "Document")
+
+QUANTIZATION_TYPES = ("float32", "float16", "int8")
+
+
+def load_quantization() -> Optional[str]:
+    """The compact storage type from KNOWVAL_VECTOR_QUANTIZATION, or None when it is off (the default)."""
+    dtype = os.getenv("KNOWVAL_VECTOR_QUANTIZATION", "none").lower()
+    if dtype in ("", "none", "off"):
+        return None
+    if dtype not in QUANTIZATION_TYPES:
+        raise ValueError(f"Unknown vector quantization '{dtype}', expected one of {QUANTIZATION_TYPES}")
+    return dtype
+
+
+def normalize(vectors) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    """(codes, per-vector scales). int8 is symmetric per vector; the float types keep a scale of 1."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    return vectors.astype(dtype), np.ones(len(vectors), dtype=np.float32)
+
+
+def bytes_per_vector(dimensions: int, dtype: str) -> int:
+    """Memory a search scans per chunk: the codes, plus the scale for int8."""
+    return dimensions * np.dtype(dtype).itemsize + (4 if dtype == "int8" else 0)
+
+
+class QuantizedIndex:
+    """
+    Compact vector storage for search, kept in SQLite next to the vector store.
+
+    With it on, Chroma keeps each chunk's text and metadata under a one-number placeholder
+    embedding, so it holds no float32 vectors and no full-size HNSW graph. Here each chunk
+    has float16 or int8 codes (2x or ~4x smaller than float32) with its scope fields, and its
+    full-precision vector in a separate flat table keyed by id. A search scores the scope's
+    codes, decoded once and kept in memory (up to `max_cached_scopes` scopes) until the index
+    changes, then re-ranks the best `rerank_factor` x k candidates with their full-precision
+    vectors, which are the only ones read; `rerank_factor=0` skips the re-rank.
+    """
+
+    def __init__(self, db_path: str = "vectors.db", dtype: str = "int8", rerank_factor: int = 4,
+                 max_cached_scopes: int = 64):
+        if dtype not in QUANTIZATION_TYPES:
+            raise ValueError(f"Unknown vector quantization '{dtype}', expected one of {QUANTIZATION_TYPES}")
+        self.db_path = db_path
+        self.dtype = dtype
+        self.rerank_factor = rerank_factor
+        self.max_cached_scopes = max_cached_scopes
+        # (where, params) -> (ids, codes, scales) as of `_cache_version` of the table
+        self._cache: "OrderedDict[Tuple[str, tuple], Tuple[List[str], np.ndarray, np.ndarray]]" = OrderedDict()
+        self._cache_version = None
+        self._cache_lock = threading.Lock()
+        if not os.path.exists(db_path):
+            # Large pages fit several full-size vectors each, instead of spilling each onto an overflow page
+            conn = sqlite3.connect(db_path)
+            conn.execute("PRAGMA page_size=32768")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.close()
+        self.pool = get_pool(db_path)
+        self._init_db()
+
+    def _init_db(self):
+        with self.pool.transaction() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS qv_vectors
+                         (doc_id TEXT PRIMARY KEY, user_id TEXT, session_id TEXT, content_hash TEXT,
+                          dtype TEXT, scale REAL, code BLOB)''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_qv_scope ON qv_vectors (user_id, session_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_qv_hash ON qv_vectors (content_hash)")
+            # Full-precision vectors, only read for the re-rank candidates
+            conn.execute("CREATE TABLE IF NOT EXISTS qv_full (doc_id TEXT PRIMARY KEY, vector BLOB)")
+            # Bumped by every write, so each process knows when its cached codes are stale
+            conn.execute("CREATE TABLE IF NOT EXISTS qv_state (key TEXT PRIMARY KEY, value INTEGER)")
+            conn.execute("INSERT OR IGNORE INTO qv_state VALUES ('version', 0)")
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(qv_vectors)")}
+            for column in ("vector", "content", "metadata"):
+                if column in columns:
+                    # Indexes built by earlier versions; the text and metadata are read from Chroma
+                    conn.execute(f"ALTER TABLE qv_vectors DROP COLUMN {column}")
+
+    @staticmethod
+    def _changed(conn):
+        conn.execute("UPDATE qv_state SET value=value+1 WHERE key='version'")
+
+    def add(self, documents: Sequence[Any], ids: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """Indexes the embeddings of chunks (LangChain Documents, for their scope) under their vector-store ids."""
+        if not ids:
+            return
+        raw = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        codes, scales = quantize(normalize(raw), self.dtype)
+        rows = []
+        for i, (doc, doc_id) in enumerate(zip(documents, ids)):
+            metadata = doc.metadata or {}
+            rows.append((doc_id, metadata.get("user_id"), metadata.get("session_id"), metadata.get("content_hash"),
+                         self.dtype, float(scales[i]), codes[i].tobytes()))
+        with span("quantized_index", chunks=len(rows), dtype=self.dtype), self.pool.transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO qv_vectors VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.executemany("INSERT OR REPLACE INTO qv_full VALUES (?, ?)",
+                             [(doc_id, raw[i].tobytes()) for i, doc_id in enumerate(ids)])
+            self._changed(conn)
+
+    def _delete(self, where: str, params: Sequence[Any]) -> int:
+        with self.pool.transaction() as conn:
+            self._changed(conn)
+            conn.execute(f"DELETE FROM qv_full WHERE doc_id IN (SELECT doc_id FROM qv_vectors WHERE {where})", params)
+            return conn.execute(f"DELETE FROM qv_vectors WHERE {where}", params).rowcount
+
+    def delete_session(self, session_id: str) -> int:
+        return self._delete("session_id=?", (session_id,))
+
+    def delete_ids(self, ids: Sequence[str]) -> int:
+        deleted = 0
+        for start in range(0, len(ids), 500):
+            batch = list(ids[start:start + 500])
+            deleted += self._delete(f"doc_id IN ({','.join('?' * len(batch))})", batch)
+        return deleted
+
+    def count(self, username: str = None, session_id: str = None, hashes: Sequence[str] = None) -> int:
+        where, params = scope_clause(username, session_id, hashes)
+        with self.pool.read() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM qv_vectors d WHERE {where}", params).fetchone()[0]
+
+    def full_vectors(self, ids: Sequence[str]) -> Dict[str, np.ndarray]:
+        """The full-precision vectors of the given chunks, as they were embedded."""
+        vectors: Dict[str, np.ndarray] = {}
+        with self.pool.read() as conn:
+            for start in range(0, len(ids), 500):
+                batch = list(ids[start:start + 500])
+                for row in conn.execute(f"SELECT doc_id, vector FROM qv_full WHERE doc_id IN "
+                                        f"({','.join('?' * len(batch))})", batch):
+                    vectors[row["doc_id"]] = np.frombuffer(row["vector"], dtype=np.float32)
+        return vectors
+
+    def disk_bytes(self) -> int:
+        """Size of the index database on disk, including its write-ahead log."""
+        return sum(os.path.getsize(path) for path in (self.db_path, self.db_path + "-wal") if os.path.exists(path))
+
+    def resident_bytes(self) -> int:
+        """Memory held by the cached codes and scales."""
+        with self._cache_lock:
+            return sum(codes.nbytes + scales.nbytes for _, codes, scales in self._cache.values())
+
+    def _load_codes(self, conn, where: str, params: List[Any]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        rows = conn.execute(f"SELECT doc_id, dtype, scale, code FROM qv_vectors d WHERE {where}", params).fetchall()
+        if not rows:
+            return [], np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.float32)
+        ids = [row["doc_id"] for row in rows]
+        scales = np.asarray([row["scale"] for row in rows], dtype=np.float32)
+        dtypes = {row["dtype"] for row in rows}
+        if len(dtypes) == 1:
+            # Kept in their compact type; scoring widens one block at a time
+            codes = np.frombuffer(b"".join(row["code"] for row in rows), dtype=dtypes.pop()).reshape(len(rows), -1)
+        else:
+            # Rows written under an earlier setting keep their own type until re-indexed
+            codes = np.vstack([np.frombuffer(row["code"], dtype=row["dtype"]).astype(np.float32) for row in rows])
+        return ids, codes, scales
+
+    def _scope_codes(self, conn, where: str, params: List[Any]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        version = conn.execute("SELECT value FROM qv_state WHERE key='version'").fetchone()[0]
+        key = (where, tuple(params))
+        with self._cache_lock:
+            if version != self._cache_version:
+                self._cache.clear()
+                self._cache_version = version
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                count("quantized_cache_hits")
+                return self._cache[key]
+        count("quantized_cache_misses")
+        loaded = self._load_codes(conn, where, params)
+        with self._cache_lock:
+            if version == self._cache_version:
+                self._cache[key] = loaded
+                if len(self._cache) > self.max_cached_scopes:
+                    self._cache.popitem(last=False)
+        return loaded
+
+    @staticmethod
+    def _score(codes: np.ndarray, query: np.ndarray, block: int = 8192) -> np.ndarray:
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), block):
+            scores[start:start + block] = np.asarray(codes[start:start + block], dtype=np.float32) @ query
+        return scores
+
+    def search(self, query_vector: Sequence[float], k: int = 10, username: str = None, session_id: str = None,
+               hashes: Sequence[str] = None, mmr: bool = False, fetch_k: int = None,
+               lambda_mult: float = 0.5) -> List[str]:
+        """
+        Ids of the `k` nearest chunks (cosine) in the scope, best first; `mmr` diversifies the
+        best `fetch_k`. The router turns them into Documents.
+        """
+        query = normalize(query_vector)[0]
+        wanted = max(k, fetch_k or k) if mmr else k
+        where, params = scope_clause(username, session_id, hashes)
+        with span("quantized_search", k=k, dtype=self.dtype) as search_span:
+            with self.pool.read() as conn:
+                ids, codes, scales = self._scope_codes(conn, where, params)
+            if not ids:
+                search_span.set(results=0)
+                return []
+            scores = self._score(codes, query) * scales
+            candidates = min(len(ids), wanted * self.rerank_factor if self.rerank_factor else wanted)
+            top = np.argpartition(-scores, candidates - 1)[:candidates]
+            chosen = [ids[i] for i in top]
+            search_span.set(scope=len(ids), candidates=len(chosen))
+            if self.rerank_factor or mmr:
+                stored = self.full_vectors(chosen)
+                # A chunk deleted since the codes were cached falls back to its decoded codes
+                full = normalize(np.vstack([stored[doc_id] if doc_id in stored
+                                            else codes[i].astype(np.float32) * scales[i]
+                                            for doc_id, i in zip(chosen, top)]))
+        if self.rerank_factor:
+            order = np.argsort(-(full @ query))[:wanted]
+        else:
+            order = np.argsort(-scores[top])[:wanted]
+        if mmr:
+            from langchain_core.vectorstores.utils import maximal_marginal_relevance
+            order = [order[i] for i in maximal_marginal_relevance(query, full[order].tolist(), lambda_mult, k)]
+        return [chosen[i] for i in order]
+
+
+def _rewrite_collections(router, embeddings_for: Callable[[Dict[str, Any]], List[Any]],
+                         batch_size: int) -> Dict[str, int]:
+    """
+    Re-creates every collection of the router with the embeddings `embeddings_for(page)` gives
+    each page of its chunks (Chroma can't change a collection's dimensions in place).
+    Returns {collection name: chunks rewritten}.
+    """
+    rewritten: Dict[str, int] = {}
+    for name in router.list_collections():
+        source = router.client.get_collection(name)
+        target = router.client.get_or_create_collection(f"rewrite.{name}", metadata=source.metadata)
+        offset = 0
+        while True:
+            page = source.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+            if not len(page["ids"]):
+                break
+            target.upsert(ids=page["ids"], embeddings=embeddings_for(page), documents=page["documents"],
+                          metadatas=page["metadatas"])
+            rewritten[name] = rewritten.get(name, 0) + len(page["ids"])
+            offset += len(page["ids"])
+        router.drop_collection(name)
+        target.modify(name=name)
+    return rewritten
+
+
+def build_from_chroma(router, index: QuantizedIndex, batch_size: int = 1000) -> Dict[str, int]:
+    """
+    Turns compact storage on for chunks ingested before: their stored embeddings (no
+    re-embedding) move into the index, and the collections keep the placeholder instead.
+    Returns {collection name: chunks indexed}.
+    """
+    from vector_partitions import COMPACT_PLACEHOLDER
+
+    def move(page):
+        embeddings = page["embeddings"]
+        if len(embeddings) and len(embeddings[0]) != len(COMPACT_PLACEHOLDER):
+            documents = [Document(page_content=text or "", metadata=metadata or {})
+                         for text, metadata in zip(page["documents"], page["metadatas"])]
+            index.add(documents, page["ids"], embeddings)
+        return [COMPACT_PLACEHOLDER] * len(page["ids"])
+
+    return _rewrite_collections(router, move, batch_size)
+
+
+def restore_to_chroma(router, index: QuantizedIndex, batch_size: int = 1000) -> Dict[str, int]:
+    """
+    Turns compact storage off: the index's full-precision vectors go back into the
+    collections, so Chroma can search them again. Returns {collection name: chunks restored}.
+    """
+    def restore(page):
+        stored = index.full_vectors(page["ids"])
+        missing = [doc_id for doc_id in page["ids"] if doc_id not in stored]
+        if missing:
+            raise ValueError(f"{len(missing)} chunks (e.g. {missing[0]}) have no full-precision vector in the index")
+        return [stored[doc_id].tolist() for doc_id in page["ids"]]
+
+    return _rewrite_collections(router, restore, batch_size)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from vector_partitions import VectorStoreRouter
+
+    parser = argparse.ArgumentParser(description="Move the existing Chroma store's vectors into the compact index "
+                                                 "(or back with --restore).")
+    parser.add_argument("dtype", choices=QUANTIZATION_TYPES)
+    parser.add_argument("--persist-directory", default="./chroma_db")
+    parser.add_argument("--vectors-db", default="vectors.db")
+    parser.add_argument("--restore", action="store_true", help="Put the full-precision vectors back into Chroma")
+    args = parser.parse_args()
+
+    router, index = VectorStoreRouter(args.persist_directory), QuantizedIndex(args.vectors_db, args.dtype)
+    result = (restore_to_chroma if args.restore else build_from_chroma)(router, index)
+    print(json.dumps({"collections": len(result), "chunks": sum(result.values()), "per_collection": result}, indent=2))
@@ -0,0 +1,33 @@
+import json
+import zlib
+from typing import List, Dict, Any, Union
+
+# Prefix identifying the compressed binary format; legacy rows are plain JSON text.
+MAGIC = b"KQZ1"
+
+
+def compact_quiz(quiz_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drops chunk_content from items that can resolve it lazily through chunk_ref."""
+    compacted = []
+    for item in quiz_data:
+        if item.get("chunk_ref") and "chunk_content" in item:
+            item = {k: v for k, v in item.items() if k != "chunk_content"}
+        compacted.append(item)
+    return compacted
+
+
+def encode_quiz(quiz_data: List[Dict[str, Any]]) -> bytes:
+    """Serializes quiz items into the compact compressed binary format."""
+    payload = json.dumps(compact_quiz(quiz_data), separators=(",", ":"), ensure_ascii=False)
+    return MAGIC + zlib.compress(payload.encode("utf-8"), 6)
+
+
+def decode_quiz(data: Union[bytes, memoryview, str]) -> List[Dict[str, Any]]:
+    """Deserializes quiz items from either the binary format or legacy JSON text."""
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    if isinstance(data, bytes):
+        if data.startswith(MAGIC):
+            return json.loads(zlib.decompress(data[len(MAGIC):]).decode("utf-8"))
+        data = data.decode("utf-8")
+    return json.loads(data)
@@ -0,0 +1,300 @@
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+from db import get_pool
+from tracing import count
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True for OpenAI 429s, whether raised by the openai SDK or wrapped by LangChain."""
+    if getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError":
+        return True
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) == 429
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Server errors, timeouts and dropped connections, which are worth retrying."""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int) and status >= 500:
+        return True
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError", "InternalServerError")
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Refills `per_minute` units a minute, up to `capacity` (default: one minute's worth)."""
+
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, amount: float) -> float:
+        """Takes `amount` if available and returns 0, otherwise returns the seconds until it will be."""
+        # A request larger than the bucket is let through once the bucket is full
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._level >= amount:
+                self._level -= amount
+                return 0.0
+            return (amount - self._level) / self.rate
+
+    def acquire(self, amount: float = 1, timeout: float = None) -> float:
+        """Blocks until `amount` is available. Returns the seconds spent waiting."""
+        start = time.monotonic()
+        while True:
+            wait = self._reserve(amount)
+            if wait == 0:
+                return time.monotonic() - start
+            if timeout is not None and time.monotonic() - start + wait > timeout:
+                raise TimeoutError(f"Rate limit wait would exceed {timeout}s")
+            time.sleep(min(wait, 1.0))
+
+    def debit(self, amount: float):
+        """Corrects a reservation once the real usage is known (negative amounts refund)."""
+        with self._lock:
+            self._level = min(self.capacity, self._level - amount)
+
+
+class SharedTokenBucket(TokenBucket):
+    """A TokenBucket kept in SQLite, so every process on the host draws from the same budget."""
+
+    def __init__(self, db_path: str, name: str, per_minute: float, capacity: float = None):
+        super().__init__(per_minute, capacity)
+        self.name = name
+        self.pool = get_pool(db_path)
+        with self.pool.transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS rate_buckets (name TEXT PRIMARY KEY, level REAL, updated_at REAL)")
+            conn.execute("INSERT OR IGNORE INTO rate_buckets VALUES (?, ?, ?)", (name, self.capacity, time.time()))
+
+    def _reserve(self, amount: float) -> float:
+        amount = min(amount, self.capacity)
+        with self.pool.transaction() as conn:
+            row = conn.execute("SELECT level, updated_at FROM rate_buckets WHERE name = ?", (self.name,)).fetchone()
+            now = time.time()
+            level = min(self.capacity, row["level"] + max(0.0, now - row["updated_at"]) * self.rate)
+            wait = 0.0
+            if level >= amount:
+                level -= amount
+            else:
+                wait = (amount - level) / self.rate
+            conn.execute("UPDATE rate_buckets SET level = ?, updated_at = ? WHERE name = ?", (level, now, self.name))
+        return wait
+
+    def debit(self, amount: float):
+        with self.pool.transaction() as conn:
+            conn.execute("UPDATE rate_buckets SET level = MIN(?, level - ?) WHERE name = ?",
+                         (self.capacity, amount, self.name))
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on in-flight calls. The limit grows by one after a window of healthy calls and
+    is halved on a 429 (at most once per `cooldown`), or cut by 10% when the smoothed latency
+    climbs past `latency_factor` times its baseline. Latency and baseline are kept per route
+    (call type and model), so slow call types aren't judged against the fastest one.
+    """
+
+    def __init__(self, initial: int = 8, minimum: int = 1, maximum: int = 32, latency_factor: float = 2.0,
+                 cooldown: float = 5.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self._successes = 0
+        self._latency: Dict[Optional[str], float] = {}
+        self._baseline: Dict[Optional[str], float] = {}
+        self._last_decrease = float("-inf")
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def _decrease(self, factor: float):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * factor)
+        self._successes = 0
+
+    def on_success(self, latency: float, route: str = None):
+        with self._cond:
+            previous = self._latency.get(route)
+            smoothed = latency if previous is None else 0.8 * previous + 0.2 * latency
+            self._latency[route] = smoothed
+            # The baseline follows the best latency seen, drifting up slowly so it can't stick forever
+            baseline = self._baseline.get(route)
+            baseline = smoothed if baseline is None else min(smoothed, baseline * 1.005)
+            self._baseline[route] = baseline
+            if smoothed > baseline * self.latency_factor:
+                self._decrease(0.9)
+                return
+            self._successes += 1
+            if self._successes >= int(self.limit) and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    def on_throttle(self):
+        with self._cond:
+            self._decrease(0.5)
+
+
+class RateLimiter:
+    """
+    Limits calls to one upstream API: requests and tokens per minute (token buckets, optionally
+    shared between processes through SQLite) plus an adaptive in-flight limit. Rate-limited
+    and transient failures are retried here with jittered exponential backoff (honouring
+    Retry-After), so clients should be created with their own retries disabled.
+    """
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None, concurrency: int = 8,
+                 max_concurrency: int = 32, shared_db: str = None, name: str = "openai", max_retries: int = 4,
+                 backoff: float = 1.0):
+        def bucket(kind, per_minute):
+            if not per_minute:
+                return None
+            if shared_db:
+                return SharedTokenBucket(shared_db, f"{name}:{kind}", per_minute)
+            return TokenBucket(per_minute)
+
+        self.name = name
+        self.requests = bucket("requests", requests_per_minute)
+        self.tokens = bucket("tokens", tokens_per_minute)
+        self.concurrency = AdaptiveConcurrency(concurrency, maximum=max(concurrency, max_concurrency))
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._stats = {"calls": 0, "throttled": 0, "retries": 0, "wait_s": 0.0}
+        self._stats_lock = threading.Lock()
+
+    def _bump(self, **amounts):
+        with self._stats_lock:
+            for key, amount in amounts.items():
+                self._stats[key] += amount
+
+    def call(self, func: Callable, *args, tokens: int = 0, route: str = None, **kwargs) -> Any:
+        """
+        Runs `func(*args, **kwargs)` within the limits, reserving `tokens` from the token budget.
+        `route` names the kind of call (e.g. call type and model) whose latency it is compared with.
+        """
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            if self.requests:
+                self.requests.acquire(1)
+            if self.tokens and tokens:
+                self.tokens.acquire(tokens)
+            with self.concurrency.slot():
+                waited = time.monotonic() - start
+                self._bump(calls=1, wait_s=waited)
+                count("rate_limit_wait_ms", round(waited * 1000, 1))
+                call_start = time.monotonic()
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    if is_rate_limit_error(e):
+                        self.concurrency.on_throttle()
+                        self._bump(throttled=1)
+                        count("rate_limited")
+                    elif not is_transient_error(e):
+                        raise
+                    if attempt == self.max_retries:
+                        raise
+                    delay = _retry_after(e) or self.backoff * (2 ** attempt) * random.uniform(0.5, 1.0)
+                else:
+                    self.concurrency.on_success(time.monotonic() - call_start, route)
+                    return result
+            # Back off outside the slot so other callers can proceed
+            self._bump(retries=1)
+            time.sleep(min(delay, 60.0))
+
+    def settle(self, tokens: int):
+        """Charges (or refunds) the difference between reserved and actual tokens."""
+        if self.tokens and tokens:
+            self.tokens.debit(tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update(limit=int(self.concurrency.limit), in_flight=self.concurrency.in_flight)
+        return stats
+
+
+class RateLimitedEmbeddings:
+    """Wraps an embedding client so its calls go through the embeddings rate limiter."""
+
+    def __init__(self, embeddings, limiter: RateLimiter = None):
+        self.wrapped = embeddings
+        self.limiter = limiter
+
+    def _limiter(self) -> RateLimiter:
+        return self.limiter or get_rate_limiter("embeddings")
+
+    def embed_documents(self, texts):
+        # A rough size is enough for reserving tokens; tiktoken would cost more than the call saves
+        return self._limiter().call(self.wrapped.embed_documents, texts, tokens=sum(len(t) for t in texts) // 4)
+
+    def embed_query(self, text):
+        return self._limiter().call(self.wrapped.embed_query, text, tokens=len(text) // 4)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _env_number(key: str, default=None):
+    value = os.getenv(key)
+    return float(value) if value else default
+
+
+def get_rate_limiter(name: str = "chat") -> RateLimiter:
+    """
+    Returns the process-wide limiter for `name` ("chat" or "embeddings"), configured from
+    KNOWVAL_<NAME>_RPM / _TPM / _CONCURRENCY / _MAX_CONCURRENCY. Unset RPM/TPM means no
+    per-minute cap. Set KNOWVAL_RATE_LIMIT_DB to share the per-minute budgets across processes.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            prefix = f"KNOWVAL_{name.upper()}"
+            limiter = RateLimiter(
+                requests_per_minute=_env_number(f"{prefix}_RPM"),
+                tokens_per_minute=_env_number(f"{prefix}_TPM"),
+                concurrency=int(_env_number(f"{prefix}_CONCURRENCY", 8)),
+                max_concurrency=int(_env_number(f"{prefix}_MAX_CONCURRENCY", 32)),
+                shared_db=os.getenv("KNOWVAL_RATE_LIMIT_DB"),
+                name=name,
+            )
+            _limiters[name] = limiter
+        return limiter
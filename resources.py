@@ -0,0 +1,258 @@
+import os
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from auth import AuthManager
+from document_store import DocumentStore
+from lazy_imports import LazyObject
+from session_manager import SessionManager
+from usage import get_usage_tracker
+
+
+class ManagerRegistry:
+    """
+    Process-wide home for the app's managers.
+
+    Each manager is built once, on first use, under a lock, and then shared by every
+    Streamlit session and rerun. The vector-backed managers share one VectorStoreRouter,
+    so the process holds a single Chroma client and a single embedding client.
+    """
+
+    def __init__(self, persist_directory: str = "./chroma_db", users_db: str = "users.db",
+                 sessions_db: str = "sessions.db", documents_db: str = "documents.db", lexical_db: str = "lexical.db",
+                 vectors_db: str = "vectors.db", gc_interval: float = 3600):
+        self.persist_directory = persist_directory
+        self.users_db = users_db
+        self.sessions_db = sessions_db
+        self.documents_db = documents_db
+        self.lexical_db = lexical_db
+        self.vectors_db = vectors_db
+        self.gc_interval = gc_interval
+        self._lock = threading.RLock()
+        self._instances: Dict[str, Any] = {}
+        self._closed = False
+        self._factories: Dict[str, Callable[[], Any]] = {
+            "documents": lambda: DocumentStore(self.documents_db),
+            "lexical": self._create_lexical,
+            "vectors": self._create_vectors,
+            "router": self._create_router,
+            "auth": lambda: AuthManager(self.users_db),
+            "sessions": self._create_sessions,
+            "ingestion": self._create_ingestion,
+            "generator": self._create_generator,
+            "topics": self._create_topics,
+            "evaluator": self._create_evaluator,
+            "vector_gc": self._create_vector_gc,
+            "prefetcher": self._create_prefetcher,
+            "usage": get_usage_tracker,
+        }
+
+    def get(self, name: str):
+        """Returns the named manager, creating it on first use."""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Manager registry is closed")
+            if name not in self._instances:
+                self._instances[name] = self._factories[name]()
+            return self._instances[name]
+
+    def lazy(self, name: str) -> LazyObject:
+        """A stand-in for the named manager that builds it (and imports its dependencies) on first use."""
+        return LazyObject(lambda: self.get(name), name)
+
+    def start_background_tasks(self):
+        """Starts vector garbage collection on a worker thread, keeping its imports off the startup path."""
+        threading.Thread(target=self.get, args=("vector_gc",), name="registry-warmup", daemon=True).start()
+
+    # Heavy dependencies are imported inside the factories so unused managers cost nothing.
+    def _create_router(self):
+        from langchain_openai import OpenAIEmbeddings
+        from vector_partitions import VectorStoreRouter
+        # Identical uploads are embedded once; each partition stores (at most) one copy, shared by reference
+        # Retries happen in the embeddings rate limiter, which needs to see the 429s.
+        # fake_openai.py (KNOWVAL_FAKE_OPENAI) gets raw text rather than tiktoken ids, since offline
+        # the tokenizer download is unavailable too; real endpoints and proxies keep the chunking.
+        embeddings = OpenAIEmbeddings(max_retries=0, check_embedding_ctx_length=not os.getenv("KNOWVAL_FAKE_OPENAI"))
+        return VectorStoreRouter(self.persist_directory, embeddings, document_store=self.documents,
+                                 lexical_index=self.lexical, vector_index=self.vectors)
+
+    def _create_lexical(self):
+        from lexical_index import LexicalIndex
+        return LexicalIndex(self.lexical_db)
+
+    def _create_vectors(self):
+        # Compact (quantized) vector storage is opt-in; None keeps searches on Chroma
+        from quantized_index import QuantizedIndex, load_quantization
+        dtype = load_quantization()
+        return QuantizedIndex(self.vectors_db, dtype) if dtype else None
+
+    def _create_sessions(self):
+        sessions = SessionManager(self.sessions_db, write_behind=True)
+        # Deleting a session also deletes its chunks
+        sessions.delete_hooks.append(lambda session_id, user_id: self.vector_gc.delete_session_vectors(session_id, user_id))
+        sessions.delete_hooks.append(self._invalidate_prefetched)
+        return sessions
+
+    def _invalidate_prefetched(self, session_id, user_id=None):
+        if "prefetcher" in self._instances:
+            self._instances["prefetcher"].invalidate(session_id)
+
+    def _create_ingestion(self):
+        from ingestion import IngestionManager
+        return IngestionManager(self.persist_directory, router=self.router)
+
+    def _create_generator(self):
+        from generator import QuizGenerator
+        return QuizGenerator(self.persist_directory, router=self.router, lexical_index=self.lexical,
+                             vector_index=self.vectors)
+
+    def _create_topics(self):
+        from topic_discovery import TopicManager
+        return TopicManager(self.persist_directory, router=self.router, lexical_index=self.lexical,
+                            vector_index=self.vectors)
+
+    def _create_evaluator(self):
+        from evaluator import AnswerEvaluator
+        # The pre-scorer matches keyword paraphrases with the router's (shared) embedding client
+        return AnswerEvaluator(embeddings=self.router.embedding_function)
+
+    def _create_prefetcher(self):
+        from prefetch import QuizPrefetcher
+        return QuizPrefetcher(self.generator)
+
+    def _create_vector_gc(self):
+        from vector_gc import VectorGarbageCollector
+        collector = VectorGarbageCollector(self.sessions, self.persist_directory, router=self.router)
+        collector.start_background(self.gc_interval)
+        return collector
+
+    @property
+    def documents(self):
+        return self.get("documents")
+
+    @property
+    def lexical(self):
+        return self.get("lexical")
+
+    @property
+    def vectors(self):
+        return self.get("vectors")
+
+    @property
+    def router(self):
+        return self.get("router")
+
+    @property
+    def auth(self):
+        return self.get("auth")
+
+    @property
+    def sessions(self):
+        return self.get("sessions")
+
+    @property
+    def ingestion(self):
+        return self.get("ingestion")
+
+    @property
+    def generator(self):
+        return self.get("generator")
+
+    @property
+    def topics(self):
+        return self.get("topics")
+
+    @property
+    def evaluator(self):
+        return self.get("evaluator")
+
+    @property
+    def prefetcher(self):
+        return self.get("prefetcher")
+
+    @property
+    def usage(self):
+        return self.get("usage")
+
+    @property
+    def vector_gc(self):
+        return self.get("vector_gc")
+
+    def _check(self, check: Callable[[], str]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            detail, ok = check(), True
+        except Exception as e:
+            detail, ok = str(e), False
+        return {"ok": ok, "detail": detail, "latency_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+    def health(self) -> Dict[str, Dict[str, Any]]:
+        """Runs a cheap liveness check against each backing resource."""
+        def sqlite_check(pool):
+            with pool.read() as conn:
+                conn.execute("SELECT 1").fetchone()
+            return f"{pool.open_connections} open connections"
+
+        def sessions_check():
+            detail = sqlite_check(self.sessions.pool)
+            if self.sessions.write_queue:
+                stats = self.sessions.write_queue.stats()
+                detail += f", write queue depth {stats['queue_depth']}, last flush {stats['last_flush_ms']:.1f} ms"
+            return detail
+
+        def vector_check():
+            self.router.client.heartbeat()
+            return f"{len(self.router.list_collections())} collections ({self.router.mode} partitioning)"
+
+        def embeddings_check():
+            if not os.getenv("OPENAI_API_KEY"):
+                raise RuntimeError("OPENAI_API_KEY is not set")
+            return "API key configured"
+
+        def rate_limit_check():
+            from rate_limiter import get_rate_limiter
+            parts = []
+            for name in ("chat", "embeddings"):
+                stats = get_rate_limiter(name).stats()
+                parts.append(f"{name} {stats['in_flight']}/{stats['limit']} in flight, {stats['throttled']} throttled")
+            return ", ".join(parts)
+
+        def scheduler_check():
+            from scheduler import get_scheduler
+            stats = get_scheduler().stats()
+            waits = ", ".join(f"{p} p95 {w['p95']} ms" for p, w in stats["wait_ms"].items())
+            return (f"{stats['in_flight']}/{stats['capacity']} in flight, {sum(stats['queued'].values())} queued"
+                    + (f", {waits}" if waits else ""))
+
+        def routes_check():
+            from model_router import get_model_router
+            rows = get_model_router().stats()
+            return ", ".join(f"{r['call_type']}/{r['model']} {r['acceptance_rate']:.0%} accepted, p95 {r['p95_ms']} ms"
+                             for r in rows) or "no routed calls yet"
+
+        return {
+            "auth_db": self._check(lambda: sqlite_check(self.auth.pool)),
+            "sessions_db": self._check(sessions_check),
+            "vector_store": self._check(vector_check),
+            "openai": self._check(embeddings_check),
+            "rate_limits": self._check(rate_limit_check),
+            "scheduler": self._check(scheduler_check),
+            "model_routes": self._check(routes_check),
+        }
+
+    def close(self):
+        """Flushes pending writes and stops background work. Safe to call more than once."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if "vector_gc" in self._instances:
+                self._instances["vector_gc"].stop()
+            if "prefetcher" in self._instances:
+                self._instances["prefetcher"].close()
+            if "sessions" in self._instances:
+                self._instances["sessions"].close()
@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Optional
+from llm_client import DeadlineExceeded, remaining_time
+from tracing import count
+
+# Work classes, most urgent first. The first LLM round-trip of a quiz decides how long the
+# user stares at a spinner, so it goes ahead of the rest of the quiz and of prefetching.
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PREFETCH = "prefetch"
+PRIORITIES = (INTERACTIVE, BULK, PREFETCH)
+
+
+class _Ticket:
+    __slots__ = ("user_id", "priority", "enqueued_at", "granted")
+
+    def __init__(self, user_id: str, priority: str):
+        self.user_id = user_id
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+
+class FairScheduler:
+    """
+    Admits quiz-generation LLM calls fairly across users.
+
+    Waiting calls are grouped by priority; within a priority, users take turns (round-robin
+    fair queuing, each call costing one turn) so a user with a 30-question quiz can't starve
+    someone waiting for their first question. A user never holds more than `per_user_limit`
+    slots, and total admissions follow `capacity` (by default the chat rate limiter's current
+    adaptive limit, so calls queue here, in fair order, rather than inside the limiter).
+    """
+
+    def __init__(self, capacity: Callable[[], int] = None, per_user_limit: int = 2, wait_samples: int = 1000):
+        self.capacity = capacity or _limiter_capacity
+        self.per_user_limit = per_user_limit
+        self._cond = threading.Condition()
+        # priority -> user -> queued tickets; the OrderedDict order is the round-robin order
+        self._queues: Dict[str, "OrderedDict[str, Deque[_Ticket]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self._in_flight: Dict[str, int] = {}
+        self._waits: Dict[str, Deque[float]] = {p: deque(maxlen=wait_samples) for p in PRIORITIES}
+        self._admitted = {p: 0 for p in PRIORITIES}
+
+    @property
+    def in_flight(self) -> int:
+        return sum(self._in_flight.values())
+
+    def _dispatch_locked(self):
+        capacity = max(1, int(self.capacity()))
+        while self.in_flight < capacity:
+            ticket = self._next_locked()
+            if ticket is None:
+                return
+            ticket.granted = True
+            self._in_flight[ticket.user_id] = self._in_flight.get(ticket.user_id, 0) + 1
+            self._cond.notify_all()
+
+    def _next_locked(self) -> Optional[_Ticket]:
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            for user_id in list(queue):
+                if self._in_flight.get(user_id, 0) >= self.per_user_limit:
+                    continue
+                tickets = queue.pop(user_id)
+                ticket = tickets.popleft()
+                if tickets:
+                    # Back of the line for this user's next call
+                    queue[user_id] = tickets
+                return ticket
+        return None
+
+    def _withdraw_locked(self, ticket: _Ticket):
+        queue = self._queues[ticket.priority]
+        tickets = queue.get(ticket.user_id)
+        if tickets is not None:
+            tickets.remove(ticket)
+            if not tickets:
+                del queue[ticket.user_id]
+
+    @contextmanager
+    def slot(self, user_id: str = None, priority: str = BULK):
+        """
+        Blocks until the call may run, then holds a slot for the duration of the block. Within a
+        `deadline_scope` it waits at most the remaining time, then gives up with DeadlineExceeded.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}', expected one of {PRIORITIES}")
+        ticket = _Ticket(user_id or "", priority)
+        remaining = remaining_time()
+        deadline = None if remaining is None else ticket.enqueued_at + remaining
+        with self._cond:
+            self._queues[priority].setdefault(ticket.user_id, deque()).append(ticket)
+            self._dispatch_locked()
+            while not ticket.granted:
+                timeout = 0.5
+                if deadline is not None:
+                    timeout = min(timeout, deadline - time.monotonic())
+                    if timeout <= 0:
+                        self._withdraw_locked(ticket)
+                        count("queue_deadline_exceeded")
+                        raise DeadlineExceeded(f"No slot for {priority} work within {remaining:.1f}s")
+                # Re-check periodically: the capacity can grow without a slot being released
+                self._cond.wait(timeout)
+                self._dispatch_locked()
+            waited = time.monotonic() - ticket.enqueued_at
+            self._waits[priority].append(waited)
+            self._admitted[priority] += 1
+        count("queue_wait_ms", round(waited * 1000, 1))
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight[ticket.user_id] -= 1
+                if not self._in_flight[ticket.user_id]:
+                    del self._in_flight[ticket.user_id]
+                self._dispatch_locked()
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, in-flight calls per user and queue-wait percentiles per priority."""
+        with self._cond:
+            stats = {
+                "capacity": int(self.capacity()),
+                "in_flight": self.in_flight,
+                "in_flight_by_user": dict(self._in_flight),
+                "queued": {p: sum(len(t) for t in self._queues[p].values()) for p in PRIORITIES},
+                "wait_ms": {},
+            }
+            for priority in PRIORITIES:
+                waits = sorted(self._waits[priority])
+                if not waits:
+                    continue
+                stats["wait_ms"][priority] = {
+                    "admitted": self._admitted[priority],
+                    "avg": round(sum(waits) / len(waits) * 1000, 1),
+                    "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1),
+                    "max": round(waits[-1] * 1000, 1),
+                }
+        return stats
+
+
+def _limiter_capacity() -> int:
+    from rate_limiter import get_rate_limiter
+    return int(get_rate_limiter("chat").concurrency.limit)
+
+
+_scheduler: Optional[FairScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> FairScheduler:
+    """
+    The process-wide scheduler. KNOWVAL_SCHED_PER_USER caps a user's concurrent calls (default 2);
+    KNOWVAL_SCHED_CAPACITY fixes the total instead of following the rate limiter.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            fixed = os.getenv("KNOWVAL_SCHED_CAPACITY")
+            _scheduler = FairScheduler(capacity=(lambda: int(fixed)) if fixed else None,
+                                       per_user_limit=int(os.getenv("KNOWVAL_SCHED_PER_USER", 2)))
+        return _scheduler
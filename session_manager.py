@@ -1,22 +1,124 @@
-import sqlite3
+import threading
 import uuid
+from collections import OrderedDict
 from datetime import datetime
+from db import get_pool
+from quiz_codec import encode_quiz, decode_quiz
+from tracing import span
+from write_behind import get_write_queue, release_write_queue
+
+# Columns the sidebar needs; listings never read quiz payloads or other columns.
+SESSION_LIST_COLUMNS = "id, name, created_at"
+
+
+class SessionListCache:
+    """
+    Per-user cache of session listings, tagged with the user's listing version.
+
+    Every write that changes a user's listing bumps a version row in the database in the same
+    transaction. A reader reads the version first and only uses entries tagged with it, so a
+    write from another worker or replica invalidates this process's entries too, and a read
+    that raced a write is cached under the old version and never served.
+    """
+
+    def __init__(self, max_users=1024):
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (version, {query key: result})
+
+    def get(self, user_id, key, version):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != version or key not in entry[1]:
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1][key]
+
+    def put(self, user_id, key, value, version):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != version:
+                # Entries of other versions are stale, or (for an older version) about to be
+                entry = self._entries[user_id] = (version, {})
+            entry[1][key] = value
+            self._entries.move_to_end(user_id)
+            if len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+_listing_caches = {}
+_listing_caches_lock = threading.Lock()
+
+
+def _get_listing_cache(pool):
+    """Returns the process-wide listing cache for a database, so it survives SessionManager re-creation."""
+    with _listing_caches_lock:
+        return _listing_caches.setdefault(pool, SessionListCache())
+
 
 class SessionManager:
-    def __init__(self, db_path="sessions.db"):
+    def __init__(self, db_path="sessions.db", write_behind=False):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self.listing_cache = _get_listing_cache(self.pool)
         self._init_db()
+        # With write_behind, answer and cursor updates are queued and flushed on a background thread
+        self.write_queue = get_write_queue(self.pool) if write_behind else None
+        # Callables run with (session_id, user_id) after a session is deleted (e.g. vector store cleanup)
+        self.delete_hooks = []
 
     def _init_db(self):
-        """Initialize the sessions table."""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS sessions
-                     (id TEXT PRIMARY KEY, user_id TEXT, name TEXT, created_at TEXT)''')
-        c.execute('''CREATE TABLE IF NOT EXISTS quiz_state
-                     (session_id TEXT PRIMARY KEY, quiz_data TEXT, current_index INTEGER, user_answers TEXT, score INTEGER, answer_submitted INTEGER)''')
-        conn.commit()
-        conn.close()
+        """Initialize the sessions and quiz tables, migrating the legacy quiz_state table if present."""
+        with self.pool.transaction() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS sessions
+                         (id TEXT PRIMARY KEY, user_id TEXT, name TEXT, created_at TEXT)''')
+            # Covers the per-user listing (filter on user_id, newest first) without a table scan or sort
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user_created ON sessions (user_id, created_at DESC)")
+            # Bumped by every write to a user's sessions, so listing caches in every process can tell they're stale
+            conn.execute('''CREATE TABLE IF NOT EXISTS session_listing_versions
+                         (user_id TEXT PRIMARY KEY, version INTEGER)''')
+            # Quiz questions are written once per quiz; answers and the cursor are written incrementally.
+            conn.execute('''CREATE TABLE IF NOT EXISTS quizzes
+                         (session_id TEXT PRIMARY KEY, quiz_data TEXT, created_at TEXT)''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS quiz_answers
+                         (session_id TEXT, question_index INTEGER, answer TEXT,
+                          PRIMARY KEY (session_id, question_index))''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS quiz_progress
+                         (session_id TEXT PRIMARY KEY, current_index INTEGER, score INTEGER,
+                          answer_submitted INTEGER, updated_at TEXT)''')
+            self._migrate_legacy_quiz_state(conn)
+
+    def _migrate_legacy_quiz_state(self, conn):
+        """Moves rows from the old single-blob quiz_state table into the normalized tables."""
+        import json
+        legacy = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='quiz_state'").fetchone()
+        if not legacy:
+            return
+        rows = conn.execute("SELECT * FROM quiz_state").fetchall()
+        for row in rows:
+            user_answers = json.loads(row['user_answers'] or "{}")
+            self._write_quiz(conn, row['session_id'], encode_quiz(json.loads(row['quiz_data'])))
+            conn.executemany(
+                "INSERT OR REPLACE INTO quiz_answers (session_id, question_index, answer) VALUES (?, ?, ?)",
+                [(row['session_id'], int(k), json.dumps(v)) for k, v in user_answers.items()]
+            )
+            self._write_progress(conn, row['session_id'], row['current_index'], row['score'], row['answer_submitted'])
+        conn.execute("DROP TABLE quiz_state")
+        print(f"Migrated {len(rows)} quiz states to the normalized schema.")
+
+    @staticmethod
+    def _bump_listing_version(conn, user_id):
+        conn.execute("INSERT INTO session_listing_versions (user_id, version) VALUES (?, 1) "
+                     "ON CONFLICT(user_id) DO UPDATE SET version = version + 1", (user_id,))
+
+    @staticmethod
+    def _listing_version(conn, user_id):
+        row = conn.execute("SELECT version FROM session_listing_versions WHERE user_id=?", (user_id,)).fetchone()
+        return row[0] if row else 0
 
     def create_session(self, user_id, name=None, session_id=None):
         """Create a new session for a user."""
@@ -24,73 +126,149 @@ class SessionManager:
             session_id = str(uuid.uuid4())
         if not name:
             name = f"Session {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-            
+
         try:
-            conn = sqlite3.connect(self.db_path)
-            c = conn.cursor()
-            c.execute("INSERT INTO sessions (id, user_id, name, created_at) VALUES (?, ?, ?, ?)",
-                      (session_id, user_id, name, datetime.now().isoformat()))
-            conn.commit()
-            conn.close()
+            with self.pool.transaction() as conn:
+                conn.execute("INSERT INTO sessions (id, user_id, name, created_at) VALUES (?, ?, ?, ?)",
+                             (session_id, user_id, name, datetime.now().isoformat()))
+                self._bump_listing_version(conn, user_id)
+            self.listing_cache.invalidate(user_id)
             return session_id
         except Exception as e:
             print(f"Error creating session: {e}")
             return None
 
     def update_session_name(self, session_id, new_name):
-        """Update the name of a session."""
+        """Update the name of a session. Unchanged names are not rewritten."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            c = conn.cursor()
-            c.execute("UPDATE sessions SET name=? WHERE id=?", (new_name, session_id))
-            conn.commit()
-            conn.close()
+            with self.pool.transaction() as conn:
+                row = conn.execute("SELECT user_id FROM sessions WHERE id=?", (session_id,)).fetchone()
+                changed = conn.execute("UPDATE sessions SET name=? WHERE id=? AND name IS NOT ?",
+                                       (new_name, session_id, new_name)).rowcount
+                if row and changed:
+                    self._bump_listing_version(conn, row['user_id'])
+            if row and changed:
+                self.listing_cache.invalidate(row['user_id'])
             return True
         except Exception as e:
             print(f"Error updating session name: {e}")
             return False
 
-    def save_quiz_state(self, session_id, quiz_data, current_index, user_answers, score, answer_submitted):
-        """Save the current quiz state."""
+    def _write_quiz(self, conn, session_id, quiz_blob):
+        conn.execute("INSERT OR REPLACE INTO quizzes (session_id, quiz_data, created_at) VALUES (?, ?, ?)",
+                     (session_id, quiz_blob, datetime.now().isoformat()))
+
+    def _write_progress(self, conn, session_id, current_index, score, answer_submitted):
+        conn.execute('''INSERT OR REPLACE INTO quiz_progress
+                     (session_id, current_index, score, answer_submitted, updated_at)
+                     VALUES (?, ?, ?, ?, ?)''',
+                     (session_id, current_index, score, int(answer_submitted), datetime.now().isoformat()))
+
+    def start_quiz(self, session_id, quiz_data, current_index=0, user_answers=None, score=0, answer_submitted=False):
+        """Store a newly generated quiz. The question payload is written only here, compressed."""
         import json
+        # Queued writes for a previous quiz must land before the new quiz replaces them
+        self.flush()
         try:
-            conn = sqlite3.connect(self.db_path)
-            c = conn.cursor()
-            c.execute('''INSERT OR REPLACE INTO quiz_state 
-                         (session_id, quiz_data, current_index, user_answers, score, answer_submitted) 
-                         VALUES (?, ?, ?, ?, ?, ?)''',
-                      (session_id, json.dumps(quiz_data), current_index, json.dumps(user_answers), score, int(answer_submitted)))
-            conn.commit()
-            conn.close()
+            with span("sqlite_save_quiz", questions=len(quiz_data)), self.pool.transaction() as conn:
+                self._write_quiz(conn, session_id, encode_quiz(quiz_data))
+                conn.execute("DELETE FROM quiz_answers WHERE session_id=?", (session_id,))
+                conn.executemany(
+                    "INSERT INTO quiz_answers (session_id, question_index, answer) VALUES (?, ?, ?)",
+                    [(session_id, int(k), json.dumps(v)) for k, v in (user_answers or {}).items()]
+                )
+                self._write_progress(conn, session_id, current_index, score, answer_submitted)
             return True
         except Exception as e:
-            print(f"Error saving quiz state: {e}")
+            print(f"Error starting quiz: {e}")
             return False
 
+    def _write_answer(self, conn, payload):
+        conn.execute("INSERT OR REPLACE INTO quiz_answers (session_id, question_index, answer) VALUES (?, ?, ?)",
+                     (payload['session_id'], payload['question_index'], payload['answer']))
+
+    def _write_progress_fields(self, conn, payload):
+        fields = {k: v for k, v in payload.items() if k in ("current_index", "score", "answer_submitted")}
+        assignments = ", ".join(f"{k}=?" for k in fields)
+        conn.execute(f"UPDATE quiz_progress SET {assignments}, updated_at=? WHERE session_id=?",
+                     (*fields.values(), datetime.now().isoformat(), payload['session_id']))
+
+    def _apply_writes(self, writes):
+        """Runs (key, writer, payload) writes now in one transaction, or queues them when write-behind is on."""
+        if self.write_queue:
+            for key, writer, payload in writes:
+                self.write_queue.submit(key, writer, payload)
+            return
+        with span("sqlite_save", writes=len(writes)), self.pool.transaction() as conn:
+            for _, writer, payload in writes:
+                writer(conn, payload)
+
+    def record_answer(self, session_id, question_index, answer, score, answer_submitted=True):
+        """Store a single answer row and the updated score."""
+        import json
+        try:
+            self._apply_writes([
+                (("answer", session_id, question_index), self._write_answer,
+                 {"session_id": session_id, "question_index": question_index, "answer": json.dumps(answer)}),
+                (("progress", session_id), self._write_progress_fields,
+                 {"session_id": session_id, "score": score, "answer_submitted": int(answer_submitted)}),
+            ])
+            return True
+        except Exception as e:
+            print(f"Error recording answer: {e}")
+            return False
+
+    def update_progress(self, session_id, current_index, score, answer_submitted):
+        """Update only the quiz cursor and score."""
+        try:
+            self._apply_writes([
+                (("progress", session_id), self._write_progress_fields,
+                 {"session_id": session_id, "current_index": current_index, "score": score,
+                  "answer_submitted": int(answer_submitted)}),
+            ])
+            return True
+        except Exception as e:
+            print(f"Error updating quiz progress: {e}")
+            return False
+
+    def flush(self):
+        """Durably writes any queued quiz progress (e.g. on logout or shutdown)."""
+        if self.write_queue:
+            self.write_queue.flush()
+
+    def close(self):
+        """
+        Flushes queued writes and gives back this manager's reference to the shared write-behind
+        queue, which stops once no manager on the database uses it. Later writes are synchronous.
+        """
+        queue, self.write_queue = self.write_queue, None
+        if queue:
+            release_write_queue(queue)
+
+    def save_quiz_state(self, session_id, quiz_data, current_index, user_answers, score, answer_submitted):
+        """Save the full quiz state. Prefer start_quiz/record_answer/update_progress for incremental writes."""
+        return self.start_quiz(session_id, quiz_data, current_index, user_answers, score, answer_submitted)
+
     def load_quiz_state(self, session_id):
         """Load the quiz state for a session."""
         import json
+        self.flush()
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            c = conn.cursor()
-            c.execute("SELECT * FROM quiz_state WHERE session_id=?", (session_id,))
-            row = c.fetchone()
-            conn.close()
-            
-            if row:
-                user_answers = json.loads(row['user_answers'])
-                # Convert keys back to integers (JSON converts them to strings)
-                user_answers = {int(k): v for k, v in user_answers.items()}
-                
-                return {
-                    "quiz_data": json.loads(row['quiz_data']),
-                    "current_index": row['current_index'],
-                    "user_answers": user_answers,
-                    "score": row['score'],
-                    "answer_submitted": bool(row['answer_submitted'])
-                }
-            return None
+            with span("sqlite_load_quiz"), self.pool.read() as conn:
+                quiz = conn.execute("SELECT quiz_data FROM quizzes WHERE session_id=?", (session_id,)).fetchone()
+                if not quiz:
+                    return None
+                progress = conn.execute("SELECT * FROM quiz_progress WHERE session_id=?", (session_id,)).fetchone()
+                answers = conn.execute("SELECT question_index, answer FROM quiz_answers WHERE session_id=?",
+                                       (session_id,)).fetchall()
+
+            return {
+                "quiz_data": decode_quiz(quiz['quiz_data']),
+                "current_index": progress['current_index'] if progress else 0,
+                "user_answers": {row['question_index']: json.loads(row['answer']) for row in answers},
+                "score": progress['score'] if progress else 0,
+                "answer_submitted": bool(progress['answer_submitted']) if progress else False
+            }
         except Exception as e:
             print(f"Error loading quiz state: {e}")
             return None
@@ -98,27 +276,102 @@ class SessionManager:
     def get_user_sessions(self, user_id):
         """Get all sessions for a user."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            c = conn.cursor()
-            c.execute("SELECT * FROM sessions WHERE user_id=? ORDER BY created_at DESC", (user_id,))
-            sessions = [dict(row) for row in c.fetchall()]
-            conn.close()
-            return sessions
+            with self.pool.read() as conn:
+                rows = conn.execute("SELECT * FROM sessions WHERE user_id=? ORDER BY created_at DESC", (user_id,)).fetchall()
+            return [dict(row) for row in rows]
         except Exception as e:
             print(f"Error fetching sessions: {e}")
             return []
 
+    def get_session(self, session_id):
+        """Get the listing columns of a single session."""
+        try:
+            with self.pool.read() as conn:
+                row = conn.execute(f"SELECT {SESSION_LIST_COLUMNS} FROM sessions WHERE id=?", (session_id,)).fetchone()
+            return dict(row) if row else None
+        except Exception as e:
+            print(f"Error fetching session: {e}")
+            return None
+
+    def get_session_owner(self, session_id):
+        """Get the user_id a session belongs to, or None if it doesn't exist."""
+        try:
+            with self.pool.read() as conn:
+                row = conn.execute("SELECT user_id FROM sessions WHERE id=?", (session_id,)).fetchone()
+            return row['user_id'] if row else None
+        except Exception as e:
+            print(f"Error fetching session owner: {e}")
+            return None
+
+    def _search_clause(self, search):
+        if not search:
+            return "", ()
+        escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return " AND name LIKE ? ESCAPE '\\'", (f"%{escaped}%",)
+
+    def list_user_sessions(self, user_id, limit=50, offset=0, search=None):
+        """
+        Get one page of a user's sessions (id, name, created_at), newest first,
+        optionally filtered by a name substring. Results are cached per user.
+        """
+        key = ("page", limit, offset, search or "")
+        try:
+            clause, params = self._search_clause(search)
+            with self.pool.read() as conn:
+                version = self._listing_version(conn, user_id)
+                cached = self.listing_cache.get(user_id, key, version)
+                if cached is not None:
+                    return [dict(row) for row in cached]
+                rows = conn.execute(
+                    f"SELECT {SESSION_LIST_COLUMNS} FROM sessions WHERE user_id=?{clause} "
+                    "ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                    (user_id, *params, limit, offset)
+                ).fetchall()
+            sessions = [dict(row) for row in rows]
+            self.listing_cache.put(user_id, key, sessions, version)
+            return [dict(row) for row in sessions]
+        except Exception as e:
+            print(f"Error listing sessions: {e}")
+            return []
+
+    def count_user_sessions(self, user_id, search=None):
+        """Count a user's sessions, optionally filtered by a name substring. Cached per user."""
+        key = ("count", search or "")
+        try:
+            clause, params = self._search_clause(search)
+            with self.pool.read() as conn:
+                version = self._listing_version(conn, user_id)
+                cached = self.listing_cache.get(user_id, key, version)
+                if cached is not None:
+                    return cached
+                count = conn.execute(f"SELECT COUNT(*) FROM sessions WHERE user_id=?{clause}",
+                                     (user_id, *params)).fetchone()[0]
+            self.listing_cache.put(user_id, key, count, version)
+            return count
+        except Exception as e:
+            print(f"Error counting sessions: {e}")
+            return 0
+
     def delete_session(self, session_id):
         """Delete a session."""
+        self.flush()
         try:
-            conn = sqlite3.connect(self.db_path)
-            c = conn.cursor()
-            c.execute("DELETE FROM sessions WHERE id=?", (session_id,))
-            c.execute("DELETE FROM quiz_state WHERE session_id=?", (session_id,))
-            conn.commit()
-            conn.close()
-            return True
+            with self.pool.transaction() as conn:
+                row = conn.execute("SELECT user_id FROM sessions WHERE id=?", (session_id,)).fetchone()
+                conn.execute("DELETE FROM sessions WHERE id=?", (session_id,))
+                if row:
+                    self._bump_listing_version(conn, row['user_id'])
+                for table in ("quizzes", "quiz_answers", "quiz_progress"):
+                    conn.execute(f"DELETE FROM {table} WHERE session_id=?", (session_id,))
+            if row:
+                self.listing_cache.invalidate(row['user_id'])
         except Exception as e:
             print(f"Error deleting session: {e}")
             return False
+
+        for hook in self.delete_hooks:
+            try:
+                hook(session_id, row['user_id'] if row else None)
+            except Exception as e:
+                print(f"Error in session delete hook: {e}")
+        return True
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from api_client import RemoteRegistry
+from api_server import USER_HEADER, create_app
+from jobs import JobStore
+from session_manager import SessionManager
+from usage import BudgetExceeded
+
+ALICE = {USER_HEADER: "alice"}
+BOB = {USER_HEADER: "bob"}
+
+
+class TestAPIServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.sessions = SessionManager(os.path.join(self.temp_dir, "sessions.db"))
+        self.jobs = JobStore(os.path.join(self.temp_dir, "jobs.db"))
+        self.registry = SimpleNamespace(sessions=self.sessions, generator=MagicMock(), ingestion=MagicMock(),
+                                        topics=MagicMock(), evaluator=MagicMock(), prefetcher=MagicMock())
+        self.client = TestClient(TestServer(create_app(self.registry, self.jobs, token="")))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        self.sessions.pool.close_all()
+        self.jobs.pool.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    async def test_requests_need_a_user(self):
+        response = await self.client.get("/sessions")
+        self.assertEqual(response.status, 401)
+
+    async def test_sessions_are_private_to_their_owner(self):
+        response = await self.client.post("/sessions", json={"name": "Biology", "session_id": "s1"}, headers=ALICE)
+        self.assertEqual(response.status, 201)
+
+        listing = await (await self.client.get("/sessions", headers=ALICE)).json()
+        self.assertEqual(([s["id"] for s in listing["sessions"]], listing["total"]), (["s1"], 1))
+        self.assertEqual((await self.client.get("/sessions/s1", headers=BOB)).status, 404)
+        self.assertEqual((await self.client.delete("/sessions/s1", headers=BOB)).status, 404)
+
+        response = await self.client.patch("/sessions/s1", json={"name": "Cells"}, headers=ALICE)
+        self.assertEqual(response.status, 200)
+        self.assertEqual((await (await self.client.get("/sessions/s1", headers=ALICE)).json())["name"], "Cells")
+
+    async def test_quiz_progress_round_trip(self):
+        await self.client.post("/sessions", json={"session_id": "s1"}, headers=ALICE)
+        quiz = [{"question": "Q1?", "options": {"A": "a"}, "correct_answer": "A"}]
+        await self.client.post("/sessions/s1/quiz", json={"quiz_data": quiz}, headers=ALICE)
+        await self.client.post("/sessions/s1/answers", json={"question_index": 0, "answer": {"user_choice": "A"},
+                                                              "score": 10}, headers=ALICE)
+        await self.client.put("/sessions/s1/progress", json={"current_index": 1, "score": 10,
+                                                              "answer_submitted": False}, headers=ALICE)
+
+        state = await (await self.client.get("/sessions/s1/quiz", headers=ALICE)).json()
+        self.assertEqual(state["quiz_data"], quiz)
+        self.assertEqual((state["current_index"], state["score"]), (1, 10))
+        self.assertEqual(state["user_answers"], {"0": {"user_choice": "A"}})
+
+    async def test_session_routes_check_the_body_session_owner(self):
+        await self.client.post("/sessions", json={"session_id": "s1"}, headers=ALICE)
+        requests = [("/topics", {}), ("/quiz", {}), ("/quiz/stream", {}), ("/quiz/prefetch", {}), ("/quiz/take", {}),
+                    ("/evaluate", {"question": "Q?", "user_answer": "A", "chunk_ref": "doc-1"})]
+        for path, body in requests:
+            response = await self.client.post(path, json={"session_id": "s1", **body}, headers=BOB)
+            self.assertEqual(response.status, 404, path)
+        self.registry.generator.resolve_chunk_content.assert_not_called()
+        self.registry.evaluator.evaluate_answer.assert_not_called()
+
+        self.registry.topics.discover_topics.return_value = ["Cells"]
+        response = await self.client.post("/topics", json={"session_id": "s1"}, headers=ALICE)
+        self.assertEqual((await response.json())["topics"], ["Cells"])
+
+    async def test_quiz_streams_one_line_per_batch(self):
+        await self.client.post("/sessions", json={"session_id": "s1"}, headers=ALICE)
+        self.registry.generator.iter_quiz_batches.return_value = iter([[{"question": "Q1"}, {"question": "Q2"}],
+                                                                       [{"question": "Q3"}]])
+        response = await self.client.post("/quiz/stream", json={"topic": "Cells", "session_id": "s1"}, headers=ALICE)
+        self.assertEqual(response.status, 200)
+        lines = [json.loads(line) for line in (await response.text()).splitlines()]
+        self.assertEqual([line["type"] for line in lines], ["batch", "batch", "done"])
+        self.assertEqual(lines[-1]["questions"], 3)
+        kwargs = self.registry.generator.iter_quiz_batches.call_args.kwargs
+        self.assertEqual((kwargs["username"], kwargs["session_id"], kwargs["topic"]), ("alice", "s1", "Cells"))
+
+    async def test_exhausted_budget_is_429(self):
+        self.registry.generator.iter_quiz_batches.side_effect = BudgetExceeded("over budget")
+        response = await self.client.post("/quiz/stream", json={"topic": "Cells"}, headers=ALICE)
+        self.assertEqual(response.status, 429)
+
+    async def test_ingest_returns_a_job_handle(self):
+        form = {"session_id": "s1", "files": open(os.path.join(os.path.dirname(__file__), "sample.txt"), "rb")}
+        response = await self.client.post("/ingest", data=form, headers=ALICE)
+        form["files"].close()
+        self.assertEqual(response.status, 202)
+        job_id = (await response.json())["job_id"]
+
+        for _ in range(50):
+            job = await (await self.client.get(f"/jobs/{job_id}", headers=ALICE)).json()
+            if job["status"] in ("done", "failed"):
+                break
+            await asyncio.sleep(0.05)
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["result"]["files"], ["sample.txt"])
+        files = self.registry.ingestion.ingest_buffers.call_args.args[0]
+        self.assertEqual(files[0][0], "sample.txt")
+        self.registry.prefetcher.invalidate.assert_called_once_with("s1")
+        # Jobs are private as well
+        self.assertEqual((await self.client.get(f"/jobs/{job_id}", headers=BOB)).status, 404)
+        # The new session was created for the uploader, so nobody else can ingest into it
+        self.assertEqual(self.sessions.get_session_owner("s1"), "alice")
+        self.assertEqual(self.sessions.get_session("s1")["name"], "Quiz: sample.txt")
+        with open(os.path.join(os.path.dirname(__file__), "sample.txt"), "rb") as f:
+            response = await self.client.post("/ingest", data={"session_id": "s1", "files": f}, headers=BOB)
+        self.assertEqual(response.status, 404)
+
+    async def test_remote_registry_talks_to_the_api(self):
+        self.registry.generator.iter_quiz_batches.return_value = iter([[{"question": "Q1"}], [{"question": "Q2"}]])
+        remote = RemoteRegistry(str(self.client.make_url("")), current_user=lambda: "alice", token="")
+        try:
+            session_id = await asyncio.to_thread(remote.sessions.create_session, "alice", "Biology")
+            listing = await asyncio.to_thread(remote.sessions.list_user_sessions, "alice")
+            self.assertEqual([s["id"] for s in listing], [session_id])
+            quiz = await asyncio.to_thread(remote.generator.generate_quiz, "Cells", session_id=session_id)
+            self.assertEqual([q["question"] for q in quiz], ["Q1", "Q2"])
+            self.assertIsNone(await asyncio.to_thread(remote.sessions.load_quiz_state, session_id))
+        finally:
+            remote.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -68,6 +68,7 @@ def test_auth():
         print("OBSERVATION: Email is Case Sensitive. This is likely the issue.")
 
     # Clean up
+    auth.pool.close_all()
     if os.path.exists(db_path):
         os.remove(db_path)
 
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from db import get_pool
+from session_manager import SessionManager
+from auth import AuthManager
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "sessions.db")
+        self.manager = SessionManager(db_path=self.db_path)
+
+    def tearDown(self):
+        self.manager.pool.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def test_wal_mode_and_busy_timeout(self):
+        with self.manager.pool.read() as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(conn.execute("PRAGMA busy_timeout").fetchone()[0], 5000)
+
+    def test_connection_is_reused_per_thread_and_shared_across_managers(self):
+        first = self.manager.pool.get_connection()
+        self.manager.create_session("user@example.com", name="S1")
+        self.assertIs(self.manager.pool.get_connection(), first)
+        self.assertIs(SessionManager(db_path=self.db_path).pool, self.manager.pool)
+        self.assertIs(get_pool(self.db_path), self.manager.pool)
+
+    def test_transaction_rolls_back_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with self.manager.pool.transaction() as conn:
+                conn.execute("INSERT INTO sessions (id, user_id, name, created_at) VALUES ('x', 'u', 'n', 't')")
+                raise RuntimeError("boom")
+        self.assertEqual(self.manager.get_user_sessions("u"), [])
+
+    def test_concurrent_readers_and_writers(self):
+        errors = []
+
+        def writer(n):
+            try:
+                for i in range(20):
+                    sid = self.manager.create_session(f"user{n}", name=f"S{i}")
+                    self.assertIsNotNone(sid)
+                    self.manager.save_quiz_state(sid, [{"q": i}], 0, {}, 0, False)
+            except Exception as e:
+                errors.append(e)
+
+        def reader(n):
+            try:
+                for _ in range(50):
+                    self.manager.get_user_sessions(f"user{n % 4}")
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+        threads += [threading.Thread(target=reader, args=(n,)) for n in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        for n in range(4):
+            self.assertEqual(len(self.manager.get_user_sessions(f"user{n}")), 20)
+
+    def test_auth_manager_uses_pool(self):
+        auth = AuthManager(db_path=os.path.join(self.temp_dir, "users.db"))
+        try:
+            with auth.pool.read() as conn:
+                self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        finally:
+            auth.pool.close_all()
+
+
+if __name__ == '__main__':
+    unittest.main()
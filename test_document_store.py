@@ -0,0 +1,191 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from document_store import DocumentStore, content_hash
+from ingestion import IngestionManager
+from session_manager import SessionManager
+from vector_gc import VectorGarbageCollector
+from llm_client import DeadlineExceeded, deadline_scope
+from vector_partitions import VectorStoreRouter, SHARED_COLLECTION
+
+TEXTBOOK = ("Chapter one covers cell biology. " * 80).encode("utf-8")
+
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    embedded: int = 0
+
+    def embed_documents(self, texts):
+        self.embedded += len(texts)
+        return super().embed_documents(texts)
+
+
+class TestDocumentDeduplication(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.documents = DocumentStore(os.path.join(self.temp_dir, "documents.db"))
+        self.embeddings = CountingEmbedding(size=8)
+        self.router = VectorStoreRouter(os.path.join(self.temp_dir, "chroma_db"), self.embeddings, mode="shared",
+                                        document_store=self.documents)
+        self.ingestion = IngestionManager(router=self.router, chunk_size=200, chunk_overlap=0)
+        self.env = patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.documents.pool.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def _scoped_ids(self, username, session_id):
+        store, where = self.router.scope(username, session_id)
+        return store.get(where=where, include=[])["ids"] if where else []
+
+    def test_identical_uploads_are_embedded_once(self):
+        self.ingestion.ingest_buffers([("bio.txt", TEXTBOOK)], username="alice", session_id="a1")
+        first = self.embeddings.embedded
+        self.ingestion.ingest_buffers([("my copy.txt", TEXTBOOK)], username="bob", session_id="b1")
+
+        self.assertGreater(first, 0)
+        self.assertEqual(self.embeddings.embedded, first)
+        self.assertEqual(self._scoped_ids("alice", "a1"), self._scoped_ids("bob", "b1"))
+        self.assertEqual(self.documents.get(content_hash(TEXTBOOK))["refcount"], 2)
+        self.assertEqual(self.documents.stats()["deduplicated"], 1)
+
+    def test_failed_first_upload_is_taken_over_by_a_waiting_uploader(self):
+        digest = content_hash(TEXTBOOK)
+        self.assertTrue(self.documents.acquire(digest, "alice", "a1", "bio.txt"))
+        self.assertFalse(self.documents.acquire(digest, "bob", "b1", "bio.txt"))
+        self.documents.abort(digest, "alice", "a1")
+
+        self.assertEqual(self.documents.hashes_for("bob", "b1"), [digest])
+        self.assertEqual(self.documents.hashes_for("alice", "a1"), [])
+        self.assertTrue(self.documents.wait_until_ready(digest, "bio.txt", poll=0.01))
+        self.assertFalse(self.documents.acquire(digest, "carol", "c1", "bio.txt"))
+        self.documents.mark_ready(digest, 3)
+        self.assertFalse(self.documents.wait_until_ready(digest, "bio.txt", poll=0.01))
+
+    def test_stale_claim_is_taken_over(self):
+        digest = content_hash(TEXTBOOK)
+        self.documents.acquire(digest, "alice", "a1", "bio.txt")
+        self.documents.acquire(digest, "bob", "b1", "bio.txt")
+        self.assertTrue(self.documents.wait_until_ready(digest, "bio.txt", poll=0.01, stale_after=0))
+
+    def test_references_preserve_isolation(self):
+        self.ingestion.ingest_buffers([("bio.txt", TEXTBOOK)], username="alice", session_id="a1")
+        self.ingestion.ingest_buffers([("notes.txt", b"Private notes on chemistry.")], username="bob", session_id="b1")
+
+        store, where = self.router.scope("bob", "b1")
+        self.assertEqual(store.get(where=where)["documents"], ["Private notes on chemistry."])
+        self.assertEqual(self.router.scope("carol", "c1")[0].get(where={"user_id": "carol"})["ids"], [])
+        # Shared chunks don't carry the uploader's file name
+        alice_sources = {m["source"] for m in store.get(where=self.router.scope("alice", "a1")[1])["metadatas"]}
+        self.assertNotIn("bio.txt", alice_sources)
+
+    def test_last_release_deletes_shared_chunks(self):
+        self.ingestion.ingest_buffers([("bio.txt", TEXTBOOK)], username="alice", session_id="a1")
+        self.ingestion.ingest_buffers([("bio.txt", TEXTBOOK)], username="bob", session_id="b1")
+        content = self.router.get_store(collection_name=SHARED_COLLECTION)
+        total = len(content.get(include=[])["ids"])
+
+        self.assertEqual(self.router.delete_session("a1", "alice"), 0)
+        self.assertEqual(len(content.get(include=[])["ids"]), total)
+        self.assertEqual(self._scoped_ids("alice", "a1"), [])
+
+        self.assertEqual(self.router.delete_session("b1", "bob"), total)
+        self.assertEqual(content.get(include=[])["ids"], [])
+        self.assertIsNone(self.documents.get(content_hash(TEXTBOOK)))
+
+    def test_own_chunks_stay_in_scope_next_to_deduplicated_files(self):
+        # e.g. files ingested from disk (CLI), which don't go through the document store
+        self.router.document_store = None
+        self.ingestion.ingest_buffers([("old.txt", b"Own chunk.")], username="alice", session_id="a1")
+        self.router.document_store = self.documents
+        self.ingestion.ingest_buffers([("bio.txt", TEXTBOOK)], username="alice", session_id="a1")
+
+        store, where = self.router.scope("alice", "a1")
+        documents = store.get(where=where)["documents"]
+        self.assertIn("Own chunk.", documents)
+        self.assertGreater(len(documents), 1)
+        self.assertEqual(self.documents.stats()["documents"], 1)
+
+    def test_waiting_for_another_upload_stops_at_the_deadline(self):
+        digest = content_hash(TEXTBOOK)
+        self.documents.acquire(digest, "alice", "a1", "bio.txt")
+        with deadline_scope(0.05), self.assertRaises(DeadlineExceeded):
+            self.ingestion.ingest_buffers([("bio.txt", TEXTBOOK)], username="bob", session_id="b1")
+        self.assertEqual(self.documents.hashes_for("bob", "b1"), [])
+        self.assertIsNotNone(self.documents.get(digest))
+
+    def test_gc_releases_references_of_deleted_sessions(self):
+        sessions = SessionManager(db_path=os.path.join(self.temp_dir, "sessions.db"))
+        live = sessions.create_session("alice", name="Live")
+        self.ingestion.ingest_buffers([("bio.txt", TEXTBOOK)], username="alice", session_id=live)
+        self.ingestion.ingest_buffers([("notes.txt", b"Orphaned notes.")], username="bob", session_id="gone")
+
+        collector = VectorGarbageCollector(sessions, self.router.persist_directory, router=self.router, grace_period=-1)
+        report = collector.collect()
+        self.assertEqual(report["released_documents"], 1)
+        self.assertTrue(self._scoped_ids("alice", live))
+        self.assertEqual(self.documents.stats()["documents"], 1)
+        sessions.pool.close_all()
+
+
+class TestPartitionedDeduplication(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.documents = DocumentStore(os.path.join(self.temp_dir, "documents.db"))
+        self.embeddings = CountingEmbedding(size=8)
+        self.env = patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.documents.pool.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def _ingestion(self, mode):
+        router = VectorStoreRouter(os.path.join(self.temp_dir, mode), self.embeddings, mode=mode,
+                                   document_store=self.documents)
+        return router, IngestionManager(router=router, chunk_size=200, chunk_overlap=0)
+
+    def test_session_partitions_get_a_copy_without_re_embedding(self):
+        router, ingestion = self._ingestion("session")
+        ingestion.ingest_buffers([("bio.txt", TEXTBOOK)], username="alice", session_id="a1")
+        embedded = self.embeddings.embedded
+        ingestion.ingest_buffers([("bio.txt", TEXTBOOK)], username="bob", session_id="b1")
+        self.assertEqual(self.embeddings.embedded, embedded)
+
+        alice, bob = router.scope("alice", "a1"), router.scope("bob", "b1")
+        self.assertNotEqual(alice[0]._collection.name, bob[0]._collection.name)
+        self.assertEqual(len(bob[0].get()["ids"]), len(alice[0].get()["ids"]))
+        self.assertEqual(self.documents.stats()["copies"], 2)
+
+        # Deleting the copy the others were taken from leaves theirs, and a later copy still works
+        router.delete_session("a1", "alice")
+        self.assertTrue(bob[0].get()["ids"])
+        ingestion.ingest_buffers([("bio.txt", TEXTBOOK)], username="carol", session_id="c1")
+        self.assertEqual(self.embeddings.embedded, embedded)
+        self.assertTrue(router.scope("carol", "c1")[0].get()["ids"])
+
+    def test_user_partition_holds_one_copy_for_its_sessions(self):
+        router, ingestion = self._ingestion("user")
+        ingestion.ingest_buffers([("bio.txt", TEXTBOOK)], username="alice", session_id="a1")
+        ingestion.ingest_buffers([("bio.txt", TEXTBOOK)], username="alice", session_id="a2")
+        ingestion.ingest_buffers([("notes.txt", b"Session two notes.")], username="alice", session_id="a2")
+
+        store, where = router.scope("alice", "a1")
+        total = len(store.get(include=[])["ids"])
+        self.assertEqual(len(store.get(where=where, include=[])["ids"]), total - 1)
+        self.assertEqual(self.documents.stats()["deduplicated"], 1)
+
+        self.assertEqual(router.delete_session("a1", "alice"), 0)
+        self.assertEqual(len(store.get(include=[])["ids"]), total)
+        self.assertEqual(router.delete_session("a2", "alice"), total)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+from fake_openai import FakeOpenAI, FakeOpenAIServer, hash_embedding
+from rate_limiter import is_rate_limit_error
+
+
+class TestFakeOpenAI(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeOpenAI(latency_ms=5, embed_latency_ms=1)
+        self.server = FakeOpenAIServer(self.fake).start()
+        self.env = patch.dict(os.environ, self.server.environment())
+        self.env.start()
+        self.tracker = patch("llm_client.get_usage_tracker")
+        tracker = self.tracker.start()
+        tracker.return_value.check.return_value = MagicMock(exhausted=False, state="ok")
+        tracker.return_value.record.return_value = 0.0
+
+    def tearDown(self):
+        self.tracker.stop()
+        self.env.stop()
+        self.server.stop()
+
+    def _generator(self):
+        with patch("generator.VectorStoreRouter"), patch("generator.OpenAIEmbeddings"):
+            from generator import QuizGenerator
+            return QuizGenerator()
+
+    def test_quiz_batch_runs_through_the_real_client(self):
+        chunks = ["Mitochondria produce energy for the cell through respiration and ATP synthesis.",
+                  "Ribosomes translate messenger RNA into proteins using transfer RNA."]
+        questions = self._generator().generate_batch_questions(chunks, "Cells", "Medium")
+        self.assertEqual([q["chunk_index"] for q in questions], [0, 1])
+        for question in questions:
+            self.assertIn(question["correct_answer"], question["options"])
+        self.assertEqual(self.fake.counters["chat"], 1)
+
+    def test_malformed_answers_are_survived(self):
+        self.fake.malformed_rate = 1.0
+        self.assertEqual(self._generator().generate_batch_questions(["Some text about cells."], "Cells", "Easy"), [])
+        # quiz_batch has a single model tier, so there is nothing to escalate to
+        self.assertEqual(self.fake.counters["malformed"], 1)
+
+    def test_rate_limits_look_like_openai_429s(self):
+        from langchain_openai import ChatOpenAI
+        self.fake.rpm = 1
+        llm = ChatOpenAI(model="gpt-4o-mini", max_retries=0)
+        llm.invoke("hello")
+        with self.assertRaises(Exception) as raised:
+            llm.invoke("hello again")
+        self.assertTrue(is_rate_limit_error(raised.exception))
+
+    def test_embeddings_are_deterministic_and_word_based(self):
+        from langchain_openai import OpenAIEmbeddings
+        embeddings = OpenAIEmbeddings(max_retries=0, check_embedding_ctx_length=False)
+        cells, cells_again, taxes = embeddings.embed_documents(
+            ["cells divide by mitosis", "cells divide by mitosis", "income taxes are due in april"])
+        self.assertEqual(len(cells), 256)
+        self.assertEqual(cells, cells_again)
+        self.assertAlmostEqual(cells[0], hash_embedding("cells divide by mitosis")[0], places=6)
+        similar = sum(a * b for a, b in zip(cells, embeddings.embed_query("how do cells divide")))
+        unrelated = sum(a * b for a, b in zip(cells, taxes))
+        self.assertGreater(similar, unrelated)
+
+
+if __name__ == "__main__":
+    unittest.main()
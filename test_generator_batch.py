@@ -11,7 +11,7 @@ from generator import QuizGenerator
 class TestQuizGeneratorBatch(unittest.TestCase):
     def setUp(self):
         # Mock Chroma and OpenAIEmbeddings to avoid actual DB/API calls during init
-        with patch('generator.Chroma'), patch('generator.OpenAIEmbeddings'):
+        with patch('generator.VectorStoreRouter'), patch('generator.OpenAIEmbeddings'):
             self.generator = QuizGenerator()
 
     def test_methods_exist(self):
@@ -93,6 +93,24 @@ class TestQuizGeneratorBatch(unittest.TestCase):
             
             self.assertEqual(len(results), 1)
             self.assertEqual(results[0]['question'], "Test Question 1")
+    def test_resolve_chunk_content_is_lazy_and_cached(self):
+        """Quiz items with a chunk_ref resolve their source text from the vector store once."""
+        store = MagicMock()
+        self.generator.router.scope.return_value = (store, {"session_id": "session"})
+        store.get.return_value = {"documents": ["Chunk text"]}
+        item = {"question": "Q?", "chunk_ref": "doc-1"}
+
+        self.assertEqual(self.generator.resolve_chunk_content(item, "user", "session"), "Chunk text")
+        self.assertEqual(self.generator.resolve_chunk_content(item, "user", "session"), "Chunk text")
+        self.generator.router.scope.assert_called_once_with("user", "session")
+        store.get.assert_called_once_with(ids=["doc-1"], where={"session_id": "session"}, include=["documents"])
+
+        # Another user's scope looks the chunk up again under its own filter instead of hitting the cache
+        store.get.return_value = {"documents": []}
+        self.assertEqual(self.generator.resolve_chunk_content(item, "mallory", "other"), "")
+
+        legacy_item = {"question": "Q?", "chunk_content": "Inline text"}
+        self.assertEqual(self.generator.resolve_chunk_content(legacy_item), "Inline text")
 
 if __name__ == '__main__':
     unittest.main()
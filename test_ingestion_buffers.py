@@ -0,0 +1,106 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from unittest.mock import patch
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from pypdf import PdfWriter
+
+from ingestion import IngestionManager
+from usage import BudgetExceeded, get_usage_tracker
+from vector_partitions import VectorStoreRouter
+
+DOCX_XML = ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            '<w:body><w:p><w:r><w:t>Mitochondria produce ATP.</w:t></w:r></w:p></w:body></w:document>')
+
+
+def make_docx() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as docx:
+        docx.writestr("word/document.xml", DOCX_XML)
+    return buffer.getvalue()
+
+
+def make_pdf(pages: int) -> bytes:
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=72, height=72)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+class TestInMemoryIngestion(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.router = VectorStoreRouter(os.path.join(self.temp_dir, "chroma_db"), DeterministicFakeEmbedding(size=8),
+                                        mode="shared")
+        self.manager = IngestionManager(router=self.router)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_loads_text_and_docx_from_bytes_and_file_objects(self):
+        docs = self.manager.load_buffer("notes.txt", b"Photosynthesis uses light.")
+        self.assertEqual(docs[0].page_content, "Photosynthesis uses light.")
+        self.assertEqual(docs[0].metadata["source"], "notes.txt")
+
+        docs = self.manager.load_buffer("cells.docx", io.BytesIO(make_docx()))
+        self.assertIn("Mitochondria produce ATP.", docs[0].page_content)
+
+    def test_loads_pdf_pages(self):
+        docs = self.manager.load_buffer("book.PDF", make_pdf(3))
+        self.assertEqual([d.metadata["page"] for d in docs], [0, 1, 2])
+
+    def test_loads_nested_archives_without_extracting(self):
+        tar_buffer = io.BytesIO()
+        with tarfile.open(fileobj=tar_buffer, mode="w:gz") as tar:
+            data = b"Inner chapter."
+            info = tarfile.TarInfo("inner/chapter.txt")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, "w") as archive:
+            archive.writestr("a.txt", "Outer text.")
+            archive.writestr("cells.docx", make_docx())
+            archive.writestr("nested.tar.gz", tar_buffer.getvalue())
+            archive.writestr("ignored.bin", b"\x00")
+
+        before = set(os.listdir(tempfile.gettempdir()))
+        docs = self.manager.load_buffer("bundle.zip", zip_buffer)
+        self.assertEqual(set(os.listdir(tempfile.gettempdir())), before)
+        sources = {d.metadata["source"] for d in docs}
+        self.assertEqual(sources, {"bundle.zip/a.txt", "bundle.zip/cells.docx",
+                                   "bundle.zip/nested.tar.gz/inner/chapter.txt"})
+
+    def test_ingest_buffers_stores_scoped_chunks(self):
+        with patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}):
+            self.manager.ingest_buffers([("notes.txt", b"Osmosis moves water.")], username="u@example.com",
+                                        session_id="s1")
+        stored = self.router.get_store().get(where={"session_id": "s1"})
+        self.assertEqual(stored["documents"], ["Osmosis moves water."])
+        self.assertEqual(stored["metadatas"][0]["user_id"], "u@example.com")
+
+    def test_ingestion_is_charged_to_the_user_and_budgeted(self):
+        env = {"OPENAI_API_KEY": "test-key", "KNOWVAL_USAGE_DB": os.path.join(self.temp_dir, "usage.db")}
+        with patch.dict(os.environ, env):
+            tracker = get_usage_tracker()
+            self.manager.ingest_buffers([("notes.txt", b"Osmosis moves water.")], username="u@example.com",
+                                        session_id="s1")
+            self.assertGreater(tracker.usage_for("u@example.com", session_id="s1")["tokens_in"], 0)
+
+            tracker.set_budget("u@example.com", daily_tokens=1)
+            with self.assertRaises(BudgetExceeded):
+                self.manager.ingest_buffers([("more.txt", b"Diffusion moves solutes.")], username="u@example.com",
+                                            session_id="s1")
+        self.assertEqual(len(self.router.get_store().get(where={"session_id": "s1"})["ids"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from unittest.mock import patch
+
+import import_budget
+from lazy_imports import LazyImport, LazyObject
+
+
+class TestLazyObject(unittest.TestCase):
+    def test_factory_runs_once_on_first_use(self):
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return {"answer": 42}
+
+        lazy = LazyObject(factory, "answer")
+        self.assertFalse(lazy.is_loaded)
+        self.assertEqual(calls, [])
+        self.assertEqual(lazy.get("answer"), 42)
+        self.assertEqual(lazy.get("answer"), 42)
+        self.assertEqual(calls, [1])
+        self.assertTrue(lazy.is_loaded)
+
+    def test_lazy_import_forwards_calls_and_attributes(self):
+        ordered_dict = LazyImport("collections", "OrderedDict")
+        self.assertEqual(list(ordered_dict(a=1)), ["a"])
+        self.assertEqual(LazyImport("json").dumps([1]), "[1]")
+
+    def test_lazy_module_name_can_still_be_patched(self):
+        import generator
+        with patch("generator.ChatOpenAI") as MockLLM:
+            self.assertIs(generator.ChatOpenAI, MockLLM)
+        self.assertIsInstance(generator.ChatOpenAI, LazyImport)
+
+
+class TestImportBudget(unittest.TestCase):
+    def test_startup_modules_defer_heavy_dependencies(self):
+        report = import_budget.check_budget()
+        self.assertEqual(report["deferred_loaded"], [])
+        self.assertLessEqual(report["elapsed_ms"], report["budget_ms"])
+        self.assertTrue(report["ok"])
+
+    def test_eager_import_is_reported(self):
+        report = import_budget.check_budget(modules=["json", "dns.resolver"])
+        self.assertIn("dns.resolver", report["deferred_loaded"])
+        self.assertFalse(report["ok"])
+        self.assertTrue(any(row["module"] == "dns.resolver" or row["module"] == "dns" for row in report["slowest"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
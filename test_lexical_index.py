@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from lexical_index import HybridRetriever, LexicalIndex, reciprocal_rank_fusion
+from vector_partitions import VectorStoreRouter
+
+
+def _doc(text, user="alice", session="s1", **metadata):
+    return Document(page_content=text, metadata={"user_id": user, "session_id": session, **metadata})
+
+
+class TestLexicalIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.index = LexicalIndex(os.path.join(self.temp_dir, "lexical.db"))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_exact_terms_rank_first(self):
+        self.index.add_documents([
+            _doc("The mitochondria is the powerhouse of the cell."),
+            _doc("Configure the ERR_SSL_PROTOCOL_ERROR handler before retrying the request."),
+            _doc("Cells divide through mitosis and meiosis."),
+        ], ids=["a", "b", "c"])
+        results = self.index.search("What causes ERR_SSL_PROTOCOL_ERROR?", k=2, username="alice", session_id="s1")
+        self.assertEqual(results[0][0].id, "b")
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0][0].metadata["session_id"], "s1")
+
+    def test_scope_and_delete(self):
+        self.index.add_documents([_doc("photosynthesis in plants"), _doc("photosynthesis notes", "bob", "s2"),
+                                  _doc("photosynthesis shared", "carol", "s3", content_hash="h1")],
+                                 ids=["a", "b", "h1:0"])
+        self.assertEqual([d.id for d, _ in self.index.search("photosynthesis", username="alice", session_id="s1")], ["a"])
+        self.assertEqual({d.id for d, _ in self.index.search("photosynthesis", username="carol", session_id="s3",
+                                                             hashes=["h1"])}, {"h1:0"})
+        # Another partition's copy of the same file stays out of the scope
+        self.assertEqual([d.id for d, _ in self.index.search("photosynthesis", username="alice", session_id="s1",
+                                                            hashes=["h1"])], ["a"])
+        self.assertEqual(self.index.delete_session("s2"), 1)
+        self.assertEqual(self.index.delete_ids(["h1:0"]), 1)
+        self.assertEqual(self.index.count(username="bob", session_id="s2"), 0)
+        self.assertEqual(self.index.search("photosynthesis", username="carol", session_id="s3", hashes=["h1"]), [])
+
+    def test_reciprocal_rank_fusion(self):
+        a, b, c = (Document(page_content=t, id=t) for t in "abc")
+        fused = reciprocal_rank_fusion([[a, b], [b, c]])
+        self.assertEqual([d.id for d in fused], ["b", "a", "c"])
+
+
+class TestHybridRetriever(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.index = LexicalIndex(os.path.join(self.temp_dir, "lexical.db"))
+        self.embeddings = MagicMock(wraps=DeterministicFakeEmbedding(size=8))
+        self.router = VectorStoreRouter(os.path.join(self.temp_dir, "chroma"), self.embeddings, mode="session",
+                                        lexical_index=self.index)
+        self.router.add_documents([_doc(f"glycolysis step {i} splits glucose") for i in range(4)], "alice", "s1")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_router_mirrors_chunks(self):
+        self.assertEqual(self.index.count(username="alice", session_id="s1"), 4)
+        self.router.delete_session("s1", "alice")
+        self.assertEqual(self.index.count(username="alice", session_id="s1"), 0)
+
+    def test_cold_scope_uses_lexical_fast_path(self):
+        router = VectorStoreRouter(os.path.join(self.temp_dir, "chroma"), self.embeddings, mode="session",
+                                   lexical_index=self.index)
+        self.assertFalse(router.is_warm("alice", "s1"))
+        self.embeddings.reset_mock()
+        docs = HybridRetriever(router, self.index, mode="auto").search("glycolysis", k=3,
+                                                                       username="alice", session_id="s1")
+        self.assertEqual(len(docs), 3)
+        self.embeddings.embed_query.assert_not_called()
+
+    def test_hybrid_fuses_and_falls_back(self):
+        retriever = HybridRetriever(self.router, self.index, mode="hybrid")
+        docs = retriever.search("glucose", k=2, username="alice", session_id="s1")
+        self.assertEqual(len(docs), 2)
+        self.assertTrue(all("glucose" in d.page_content for d in docs))
+
+        broken = MagicMock(wraps=self.router)
+        broken.document_store = None
+        broken.scope.side_effect = RuntimeError("chroma unavailable")
+        docs = HybridRetriever(broken, self.index, mode="hybrid").search("glucose", k=2, username="alice",
+                                                                         session_id="s1")
+        self.assertEqual(len(docs), 2)
+
+    def test_without_index_uses_vector_search(self):
+        docs = HybridRetriever(self.router).search("glucose", k=2, username="alice", session_id="s1")
+        self.assertEqual(len(docs), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from lexical_scorer import LexicalScorer, load_calibration, tokenize, stem
+from evaluator import AnswerEvaluator
+
+CHUNK = (
+    "Git branches are lightweight pointers to commits. Merging combines the histories "
+    "of two branches, while rebasing replays commits on top of another branch."
+)
+KEYWORDS = ["branch", "merge", "commit history"]
+
+
+class TestLexicalScorer(unittest.TestCase):
+    def setUp(self):
+        self.scorer = LexicalScorer()
+
+    def test_stemming_normalizes_inflections(self):
+        self.assertEqual(stem("branches"), stem("branching"))
+        self.assertEqual(stem("merge"), stem("merging"))
+        self.assertEqual(tokenize("The commits were committed"), [stem("commits"), stem("committed")])
+
+    def test_empty_answer_is_graded_locally(self):
+        result = self.scorer.prescore("What is a merge?", "  ", CHUNK, KEYWORDS)
+        self.assertEqual(result["decision"], "local")
+        self.assertEqual(result["score"], 0)
+        self.assertEqual(result["keywords_missing"], KEYWORDS)
+
+    def test_short_and_unmatched_answers_are_not_zeroed(self):
+        result = self.scorer.prescore("What replays commits on another branch?", "Rebasing", CHUNK, ["rebase"])
+        self.assertGreater(result["score"], 0)
+        result = self.scorer.prescore("What is a merge?", "Photosynthesis converts sunlight into sugar.", CHUNK, KEYWORDS)
+        self.assertEqual(result["decision"], "escalate")
+
+    def test_complete_answer_is_graded_locally(self):
+        answer = "Merging two branches combines their commit history into one branch."
+        result = self.scorer.prescore("What is a merge?", answer, CHUNK, KEYWORDS)
+        self.assertEqual(result["decision"], "local")
+        self.assertGreaterEqual(result["score"], 7)
+        self.assertEqual(result["keywords_missing"], [])
+
+    def test_partial_answer_escalates(self):
+        result = self.scorer.prescore("What is a merge?", "It combines branches together somehow.", CHUNK, KEYWORDS)
+        self.assertEqual(result["decision"], "escalate")
+
+    def test_semantic_match_uses_cached_keyword_embeddings(self):
+        embeddings = MagicMock()
+        embeddings.embed_documents.side_effect = lambda texts: [[1.0, 0.0] for _ in texts]
+        embeddings.embed_query.return_value = [1.0, 0.0]
+        scorer = LexicalScorer(embeddings=embeddings)
+
+        for _ in range(2):
+            coverage, present, missing = scorer.keyword_coverage("It integrates divergent work.", ["merge"])
+            self.assertEqual(present, ["merge"])
+        embeddings.embed_documents.assert_called_once_with(["merge"])
+
+    def test_off_topic_answer_is_zeroed_with_embeddings(self):
+        embeddings = MagicMock()
+        embeddings.model = "text-embedding-3-small"
+        embeddings.embed_documents.side_effect = lambda texts: [[1.0, 0.0] for _ in texts]
+        embeddings.embed_query.return_value = [0.0, 1.0]
+        scorer = LexicalScorer(embeddings=embeddings)
+        answer = "Photosynthesis converts sunlight into sugar."
+
+        result = scorer.prescore("What is a merge?", answer, CHUNK, KEYWORDS)
+        self.assertEqual((result["decision"], result["score"]), ("local", 0))
+        # A paraphrase close to the source is left to the LLM
+        embeddings.embed_query.return_value = [0.9, 0.1]
+        scorer._last_answer = ("", [])
+        self.assertEqual(scorer.prescore("What is a merge?", answer, CHUNK, KEYWORDS)["decision"], "escalate")
+
+    def test_escalated_answer_has_keyword_feedback(self):
+        result = self.scorer.prescore("What is a merge?", "It combines branches together somehow.", CHUNK, KEYWORDS)
+        self.assertIn("branch", result["feedback"])
+        self.assertIn("commit history", result["feedback"])
+
+    def test_calibration_is_loaded_from_the_configured_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "calibration.json")
+            with open(path, "w") as f:
+                json.dump({"slope": 8.0, "intercept": 1.0, "off_topic_similarity": 0.5}, f)
+            with patch.dict(os.environ, {"KNOWVAL_SCORER_CALIBRATION": path}):
+                scorer = LexicalScorer()
+                self.assertEqual((scorer.slope, scorer.intercept, scorer.off_topic_similarity), (8.0, 1.0, 0.5))
+                with open(path, "w") as f:
+                    f.write("not json")
+                self.assertEqual(load_calibration(), {})
+
+    def test_calibrate_fits_linear_mapping(self):
+        slope, intercept = self.scorer.calibrate([(0.0, 1.0), (0.5, 5.0), (1.0, 9.0)])
+        self.assertAlmostEqual(slope, 8.0)
+        self.assertAlmostEqual(intercept, 1.0)
+
+
+class TestEvaluatorShortCircuit(unittest.TestCase):
+    @patch('evaluator.ChatOpenAI')
+    def test_clear_cut_answer_skips_llm(self, MockChatOpenAI):
+        result = AnswerEvaluator().evaluate_answer("What is a merge?", "", CHUNK, KEYWORDS)
+        self.assertEqual(result["graded_by"], "local")
+        MockChatOpenAI.assert_not_called()
+
+    @patch('evaluator.ChatOpenAI')
+    def test_ambiguous_answer_escalates_to_llm(self, MockChatOpenAI):
+        mock_response = MagicMock()
+        mock_response.content = '{"score": 6, "feedback": "ok", "keywords_present": [], "keywords_missing": []}'
+        with patch('evaluator.PromptTemplate') as MockPrompt:
+            mock_chain = MagicMock()
+            mock_chain.invoke.return_value = mock_response
+            MockPrompt.return_value.__or__.return_value = mock_chain
+
+            result = AnswerEvaluator().evaluate_answer("What is a merge?", "It combines branches together somehow.", CHUNK, KEYWORDS)
+        self.assertEqual(result["graded_by"], "llm")
+        self.assertEqual(result["score"], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+import unittest
+import uuid
+from unittest.mock import MagicMock, patch
+
+import llm_client
+from llm_client import DeadlineExceeded, deadline_scope, invoke_llm, record_latency
+
+
+class TestDeadlinesAndHedging(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch("llm_client.get_usage_tracker")
+        tracker = self.patcher.start()
+        tracker.return_value.check.return_value = MagicMock(exhausted=False, state="ok")
+        tracker.return_value.record.return_value = 0.0
+        self.tracker = tracker.return_value
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def _seed(self, call_type, latency=0.01):
+        for _ in range(llm_client.HEDGE_MIN_SAMPLES):
+            record_latency(f"{call_type}:gpt-4o", latency)
+
+    def test_slow_call_is_hedged_and_the_fast_answer_wins(self):
+        self._seed("hedge_sync")
+        calls = []
+
+        def invoke(inputs):
+            calls.append(inputs)
+            if len(calls) == 1:
+                time.sleep(1.0)
+                return MagicMock(content="slow")
+            return MagicMock(content="fast")
+
+        chain = MagicMock()
+        chain.invoke.side_effect = invoke
+        start = time.monotonic()
+        self.assertEqual(invoke_llm("hedge_sync", chain, {"topic": "cells"}).content, "fast")
+        self.assertLess(time.monotonic() - start, 0.8)
+        self.assertEqual(len(calls), 2)
+        # The losing request's prompt is still accounted for
+        self.assertIn("hedge_sync_hedge", [c.args[0] for c in self.tracker.record.call_args_list])
+
+    def test_hedge_cancelled_before_it_was_sent_is_not_charged(self):
+        self._seed("hedge_queued")
+        gate = threading.Event()
+
+        class QueueingLimiter:
+            calls = 0
+
+            def call(self, func, *args, tokens=0, route=None, **kwargs):
+                self.calls += 1
+                if self.calls > 1:
+                    gate.wait(2)  # the hedge waits for a rate-limit slot
+                return func(*args, **kwargs)
+
+            def settle(self, tokens):
+                pass
+
+        chain = MagicMock()
+        chain.invoke.side_effect = lambda inputs: time.sleep(0.2) or MagicMock(content="primary")
+        with patch("llm_client.get_rate_limiter", return_value=QueueingLimiter()):
+            self.assertEqual(invoke_llm("hedge_queued", chain, {"topic": "cells"}).content, "primary")
+        gate.set()
+        self.assertNotIn("hedge_queued_hedge", [c.args[0] for c in self.tracker.record.call_args_list])
+        time.sleep(0.05)
+        self.assertEqual(chain.invoke.call_count, 1)
+
+    def test_losing_async_request_is_cancelled(self):
+        self._seed("hedge_async")
+        cancelled = threading.Event()
+
+        class AsyncChain:
+            def __init__(self):
+                self.calls = 0
+
+            async def ainvoke(self, inputs):
+                self.calls += 1
+                if self.calls == 1:
+                    try:
+                        await asyncio.sleep(5)
+                    except asyncio.CancelledError:
+                        cancelled.set()
+                        raise
+                return MagicMock(content="fast")
+
+        self.assertEqual(invoke_llm("hedge_async", AsyncChain(), {"topic": "cells"}).content, "fast")
+        self.assertTrue(cancelled.wait(2))
+
+    def test_deadline_abandons_a_slow_call(self):
+        chain = MagicMock()
+        chain.invoke.side_effect = lambda inputs: time.sleep(1.0)
+        start = time.monotonic()
+        with deadline_scope(0.1), self.assertRaises(DeadlineExceeded):
+            invoke_llm("deadline", chain, {"topic": "cells"})
+        self.assertLess(time.monotonic() - start, 0.5)
+        with deadline_scope(0), self.assertRaises(DeadlineExceeded):
+            invoke_llm("deadline", chain, {"topic": "cells"})
+
+    def test_generate_quiz_returns_partial_results_at_its_deadline(self):
+        with patch("generator.VectorStoreRouter"), patch("generator.OpenAIEmbeddings"):
+            from generator import QuizGenerator
+            generator = QuizGenerator()
+        store = MagicMock()
+        store.max_marginal_relevance_search.return_value = [MagicMock(page_content=f"chunk {i}", id=f"c{i}")
+                                                            for i in range(20)]
+        generator.router.scope.return_value = (store, None)
+        generator._expand_topic = MagicMock(return_value="cells")
+
+        def batch(chunks, topic, difficulty, priority):
+            time.sleep(0.2)
+            return [{"chunk_index": i, "question": f"{uuid.uuid4().hex}?", "options": {"A": "x", "B": "y"},
+                     "correct_answer": "A"} for i, c in enumerate(chunks)]
+
+        generator.generate_batch_questions = batch
+        with patch("generator.get_usage_tracker") as tracker:
+            tracker.return_value.check.return_value = MagicMock(exhausted=False, degraded=False, state="ok")
+            quiz = generator.generate_quiz("Cells", num_chunks=20, deadline=0.3)
+        self.assertEqual(len(quiz), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import json
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+from llm_client import DeadlineExceeded
+from model_router import ModelRouter, RoutingError, load_routes
+from usage import BudgetExceeded
+
+
+def chain_for(answers):
+    """A make_chain whose chain for each model answers with answers[model]."""
+    def make_chain(model):
+        chain = MagicMock()
+        answer = answers[model]
+        if isinstance(answer, Exception):
+            chain.invoke.side_effect = answer
+        else:
+            chain.invoke.return_value = MagicMock(content=answer, usage_metadata=None)
+        return chain
+    return make_chain
+
+
+def parse_list(response):
+    try:
+        topics = json.loads(response.content)
+    except ValueError:
+        return None
+    return topics if isinstance(topics, list) and len(topics) >= 2 else None
+
+
+class TestModelRouter(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch("llm_client.get_usage_tracker")
+        tracker = self.patcher.start()
+        tracker.return_value.check.return_value = MagicMock(exhausted=False, state="ok")
+        tracker.return_value.record.return_value = 0.0
+        self.router = ModelRouter({"discover_topics": ["small", "large"]})
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_cheap_model_answer_is_used_when_valid(self):
+        topics = self.router.invoke("discover_topics", chain_for({"small": '["Cells", "Genes"]', "large": "unused"}),
+                                    {"text_sample": "..."}, parse_list)
+        self.assertEqual(topics, ["Cells", "Genes"])
+        stats = self.router.stats()
+        self.assertEqual([(r["model"], r["accepted"]) for r in stats], [("small", 1)])
+        self.assertEqual(stats[0]["acceptance_rate"], 1.0)
+
+    def test_invalid_or_failed_output_escalates(self):
+        answers = {"small": "Here are some topics: Cells", "large": '["Cells", "Genes"]'}
+        self.assertEqual(self.router.invoke("discover_topics", chain_for(answers), {}, parse_list), ["Cells", "Genes"])
+        answers["small"] = ValueError("server error")
+        self.assertEqual(self.router.invoke("discover_topics", chain_for(answers), {}, parse_list), ["Cells", "Genes"])
+        stats = {r["model"]: r for r in self.router.stats()}
+        self.assertEqual(stats["small"]["escalated"], 2)
+        self.assertEqual(stats["small"]["acceptance_rate"], 0.0)
+        self.assertEqual(stats["large"]["accepted"], 2)
+
+    def test_low_confidence_escalates_except_on_the_last_tier(self):
+        answers = {"small": "5", "large": "6"}
+        result = self.router.invoke("discover_topics", chain_for(answers), {},
+                                    lambda r: int(r.content), lambda score: not 4 <= score <= 6)
+        self.assertEqual(result, 6)
+
+    def test_all_tiers_failing_raises(self):
+        with self.assertRaises(RoutingError):
+            self.router.invoke("discover_topics", chain_for({"small": "nope", "large": "nope"}), {}, parse_list)
+        self.assertEqual({r["model"]: r["rejected"] for r in self.router.stats()}, {"small": 0, "large": 1})
+
+    def test_budget_and_deadline_errors_are_not_escalated(self):
+        for error in (BudgetExceeded("spent"), DeadlineExceeded("late")):
+            make_chain = MagicMock(side_effect=chain_for({"small": error, "large": '["a", "b"]'}))
+            with self.assertRaises(type(error)):
+                self.router.invoke("discover_topics", make_chain, {}, parse_list)
+            self.assertEqual(make_chain.call_args_list[-1].args, ("small",))
+
+    def test_unknown_call_types_use_the_default_model(self):
+        self.assertEqual(self.router.tiers("something_new"), ["gpt-4o"])
+
+    def test_routes_can_be_overridden_from_the_environment(self):
+        with patch.dict(os.environ, {"KNOWVAL_MODEL_ROUTES": '{"quiz_batch": "gpt-4.1", "expand_topic": ["a", "b"]}'}):
+            routes = load_routes()
+        self.assertEqual(routes["quiz_batch"], ["gpt-4.1"])
+        self.assertEqual(routes["expand_topic"], ["a", "b"])
+        self.assertEqual(routes["evaluate_answer"], ["gpt-4o-mini", "gpt-4o"])
+        with patch.dict(os.environ, {"KNOWVAL_MODEL_ROUTES": "not json"}):
+            self.assertEqual(load_routes()["quiz_batch"], ["gpt-4o"])
+
+
+if __name__ == "__main__":
+    unittest.main()
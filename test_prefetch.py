@@ -0,0 +1,76 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from prefetch import QuizPrefetcher
+
+
+class TestQuizPrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.generator = MagicMock()
+        self.generator.generate_quiz.side_effect = lambda topic, **kwargs: [{"question": f"{topic} next"}]
+        self.prefetcher = QuizPrefetcher(self.generator, max_entries=2, ttl=60)
+
+    def tearDown(self):
+        self.prefetcher.close()
+
+    def test_prefetched_quiz_is_taken_once(self):
+        self.assertTrue(self.prefetcher.prefetch("Cells", "Hard", "u", "s1", exclude_questions=["Old question?"]))
+        self.assertFalse(self.prefetcher.prefetch("Cells", "Hard", "u", "s1"))
+
+        self.assertEqual(self.prefetcher.take("cells ", "Hard", "u", "s1", wait=5), [{"question": "Cells next"}])
+        self.assertIsNone(self.prefetcher.take("Cells", "Hard", "u", "s1"))
+        kwargs = self.generator.generate_quiz.call_args.kwargs
+        self.assertEqual(kwargs["exclude_questions"], ["Old question?"])
+        self.assertEqual((kwargs["username"], kwargs["session_id"], kwargs["difficulty"]), ("u", "s1", "Hard"))
+        self.assertEqual(self.prefetcher.stats()["hits"], 1)
+
+    def test_take_waits_for_in_flight_generation(self):
+        release = threading.Event()
+        self.generator.generate_quiz.side_effect = lambda topic, **kwargs: release.wait(5) and [{"question": "Q"}]
+        self.prefetcher.prefetch("Cells", "Medium", "u", "s1")
+
+        threading.Timer(0.05, release.set).start()
+        self.assertEqual(self.prefetcher.take("Cells", "Medium", "u", "s1"), [{"question": "Q"}])
+        self.assertEqual(self.generator.generate_quiz.call_count, 1)
+
+    def test_unfinished_prefetch_is_dropped_after_the_wait(self):
+        release = threading.Event()
+        self.generator.generate_quiz.side_effect = lambda topic, **kwargs: release.wait(5) and [{"question": "Q"}]
+        self.prefetcher.prefetch("Cells", "Medium", "u", "s1")
+
+        self.assertIsNone(self.prefetcher.take("Cells", "Medium", "u", "s1", wait=0.01))
+        self.assertEqual(self.prefetcher.stats()["abandoned"], 1)
+        # The settings can be prefetched again rather than staying blocked by the dropped entry
+        self.assertTrue(self.prefetcher.prefetch("Cells", "Medium", "u", "s1"))
+        release.set()
+
+    def test_entries_are_bounded_and_expire(self):
+        for topic in ("A", "B", "C"):
+            self.prefetcher.prefetch(topic, "Medium", "u", "s1")
+        self.assertEqual(self.prefetcher.stats()["evicted"], 1)
+        self.assertIsNone(self.prefetcher.take("A", "Medium", "u", "s1"))
+
+        self.prefetcher.ttl = 0
+        time.sleep(0.01)
+        self.assertIsNone(self.prefetcher.take("C", "Medium", "u", "s1"))
+        self.assertEqual(self.prefetcher.stats()["expired"], 2)
+
+    def test_invalidate_drops_session_entries(self):
+        self.prefetcher.prefetch("A", "Medium", "u", "s1")
+        self.prefetcher.prefetch("A", "Medium", "u", "s2")
+        self.prefetcher.invalidate("s1")
+        self.assertIsNone(self.prefetcher.take("A", "Medium", "u", "s1", wait=5))
+        self.assertIsNotNone(self.prefetcher.take("A", "Medium", "u", "s2", wait=5))
+
+    def test_failed_generation_is_a_miss(self):
+        self.generator.generate_quiz.side_effect = RuntimeError("LLM down")
+        self.prefetcher.prefetch("A", "Medium", "u", "s1")
+        time.sleep(0.05)
+        self.assertIsNone(self.prefetcher.take("A", "Medium", "u", "s1", wait=5))
+        self.assertEqual(self.prefetcher.stats()["failed"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
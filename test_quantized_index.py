@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from lexical_index import HybridRetriever
+from quantized_index import QuantizedIndex, build_from_chroma, bytes_per_vector, normalize, quantize, restore_to_chroma
+from vector_partitions import COMPACT_PLACEHOLDER, VectorStoreRouter
+
+
+def _docs(count, user="alice", session="s1", **metadata):
+    return [Document(page_content=f"chunk {i}", metadata={"user_id": user, "session_id": session, **metadata})
+            for i in range(count)]
+
+
+class TestQuantization(unittest.TestCase):
+    def test_int8_round_trip_and_size(self):
+        vectors = normalize(np.random.default_rng(0).normal(size=(50, 64)))
+        codes, scales = quantize(vectors, "int8")
+        self.assertEqual(codes.dtype, np.int8)
+        self.assertLess(np.abs(codes * scales[:, None] - vectors).max(), 0.01)
+        self.assertEqual(bytes_per_vector(64, "int8"), 68)
+        self.assertEqual(bytes_per_vector(64, "float16"), 128)
+
+
+class TestQuantizedIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.vectors = normalize(np.random.default_rng(1).normal(size=(300, 32)))
+        self.ids = [f"c{i}" for i in range(300)]
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _index(self, dtype, **kwargs):
+        index = QuantizedIndex(os.path.join(self.temp_dir, f"{dtype}.db"), dtype, **kwargs)
+        index.add(_docs(300), self.ids, self.vectors)
+        return index
+
+    def test_rerank_recovers_exact_neighbours(self):
+        query = self.vectors[7] + 0.3 * self.vectors[11]
+        exact = [self.ids[i] for i in np.argsort(-(self.vectors @ normalize(query)[0]))[:10]]
+        for dtype in ("float16", "int8"):
+            results = self._index(dtype).search(query, k=10, username="alice", session_id="s1")
+            self.assertEqual(results, exact, dtype)
+
+    def test_codes_are_cached_until_the_index_changes(self):
+        index = self._index("int8")
+        with index.pool.read() as conn:
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(qv_vectors)")}
+        self.assertEqual(columns, {"doc_id", "user_id", "session_id", "content_hash", "dtype", "scale", "code"})
+        self.assertEqual(index.resident_bytes(), 0)
+        index.search(self.vectors[0], k=5, username="alice", session_id="s1")
+        self.assertEqual(index.resident_bytes(), 300 * bytes_per_vector(32, "int8"))
+        self.assertGreater(index.disk_bytes(), 0)
+
+        # A write through another instance (another process, say) makes the cached codes stale
+        QuantizedIndex(index.db_path, "int8").add(_docs(1), ["new"], [-self.vectors[0]])
+        self.assertEqual(index.search(-self.vectors[0], k=1, username="alice", session_id="s1"), ["new"])
+
+    def test_mmr_and_no_rerank(self):
+        index = self._index("int8", rerank_factor=0)
+        self.assertEqual(len(index.search(self.vectors[0], k=5, username="alice", session_id="s1")), 5)
+        self.assertEqual(len(index.search(self.vectors[0], k=5, username="alice", session_id="s1",
+                                          mmr=True, fetch_k=20)), 5)
+
+    def test_scope_and_delete(self):
+        index = self._index("int8")
+        index.add(_docs(2, "bob", "s2"), ["b0", "b1"], self.vectors[:2])
+        index.add(_docs(1, "carol", "s3", content_hash="h1"), ["h1:0"], self.vectors[:1])
+        self.assertEqual(index.search(self.vectors[0], k=5, username="bob", session_id="s2")[:1], ["b0"])
+        self.assertEqual(index.search(self.vectors[0], k=5, username="carol", session_id="s3", hashes=["h1"]), ["h1:0"])
+        self.assertEqual(index.delete_session("s1"), 300)
+        self.assertEqual(index.delete_ids(["h1:0"]), 1)
+        self.assertEqual(index.count(username="alice", session_id="s1"), 0)
+        self.assertEqual(set(index.full_vectors(["c0", "b0", "h1:0"])), {"b0"})
+
+
+class TestCompactRouter(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.index = QuantizedIndex(os.path.join(self.temp_dir, "vectors.db"), "int8")
+        self.router = VectorStoreRouter(os.path.join(self.temp_dir, "chroma"), DeterministicFakeEmbedding(size=16),
+                                        mode="session", vector_index=self.index)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_chunks_are_mirrored_and_searched(self):
+        store = self.router.add_documents(_docs(6), "alice", "s1")
+        self.assertEqual(store._collection.count(), 6)
+        self.assertEqual(self.index.count(username="alice", session_id="s1"), 6)
+        # Chroma keeps the text but not the vectors
+        stored = store._collection.get(include=["embeddings", "documents"])
+        self.assertEqual([list(e) for e in stored["embeddings"]], [COMPACT_PLACEHOLDER] * 6)
+        self.assertEqual(len(self.index.full_vectors(stored["ids"])), 6)
+
+        docs = HybridRetriever(self.router, vector_index=self.index).search("chunk 3", k=2, username="alice",
+                                                                            session_id="s1")
+        self.assertEqual((docs[0].page_content, docs[0].metadata["session_id"]), ("chunk 3", "s1"))
+
+        self.router.delete_session("s1", "alice")
+        self.assertEqual(self.index.count(username="alice", session_id="s1"), 0)
+
+    def test_deduplicated_copy_keeps_the_full_vectors(self):
+        self.router.add_content(_docs(3), "h1", "alice", "s1")
+        self.assertTrue(self.router.copy_content("h1", self.router.collection_name("alice", "s1"), "bob", "s2"))
+        source, copy = ([f"h1:{i}@{self.router.collection_name(*scope)}" for i in range(3)]
+                        for scope in (("alice", "s1"), ("bob", "s2")))
+        stored = self.index.full_vectors(source + copy)
+        for a, b in zip(source, copy):
+            np.testing.assert_array_equal(stored[a], stored[b])
+        self.assertEqual(sorted(self.index.search(stored[source[0]], k=5, username="bob", session_id="s2",
+                                                  hashes=["h1"])), copy)
+
+    def test_existing_store_is_converted_and_restored(self):
+        plain = VectorStoreRouter(os.path.join(self.temp_dir, "chroma"), DeterministicFakeEmbedding(size=16),
+                                  mode="session")
+        plain.add_documents(_docs(4), "alice", "s1")
+        name = plain.collection_name("alice", "s1")
+        original = plain.get_store(collection_name=name)._collection.get(include=["embeddings"])
+
+        self.assertEqual(build_from_chroma(plain, self.index), {name: 4})
+        self.assertEqual(self.index.count(username="alice", session_id="s1"), 4)
+        converted = plain.get_store(collection_name=name)._collection.get(include=["embeddings", "documents"])
+        self.assertEqual(len(converted["embeddings"][0]), len(COMPACT_PLACEHOLDER))
+        self.assertEqual(sorted(converted["documents"]), [f"chunk {i}" for i in range(4)])
+
+        self.assertEqual(restore_to_chroma(plain, self.index), {name: 4})
+        restored = plain.get_store(collection_name=name)._collection.get(ids=original["ids"], include=["embeddings"])
+        np.testing.assert_allclose(restored["embeddings"], original["embeddings"], atol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from rate_limiter import AdaptiveConcurrency, RateLimiter, SharedTokenBucket, TokenBucket, is_rate_limit_error
+
+
+class RateLimitError(Exception):
+    """Stands in for openai.RateLimitError."""
+    status_code = 429
+
+
+class TestTokenBuckets(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_bucket_waits_for_refill(self):
+        bucket = TokenBucket(per_minute=6000, capacity=2)  # refills 100 per second
+        self.assertLess(bucket.acquire(2), 0.005)
+        waited = bucket.acquire(1)
+        self.assertGreater(waited, 0.005)
+        # Oversized requests pass once the bucket is full instead of waiting forever
+        bucket.debit(-10)
+        self.assertLess(bucket.acquire(50), 0.005)
+
+    def test_bucket_times_out(self):
+        bucket = TokenBucket(per_minute=1, capacity=1)
+        bucket.acquire(1)
+        with self.assertRaises(TimeoutError):
+            bucket.acquire(1, timeout=0.01)
+
+    def test_shared_bucket_is_seen_by_every_instance(self):
+        db_path = os.path.join(self.temp_dir, "limits.db")
+        first = SharedTokenBucket(db_path, "chat:tokens", per_minute=60, capacity=100)
+        second = SharedTokenBucket(db_path, "chat:tokens", per_minute=60, capacity=100)
+        self.assertEqual(first._reserve(80), 0)
+        self.assertGreater(second._reserve(80), 0)
+        first.pool.close_all()
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+    def test_grows_when_healthy_and_halves_on_throttle(self):
+        concurrency = AdaptiveConcurrency(initial=4, maximum=8, cooldown=0)
+        for _ in range(4):
+            concurrency.on_success(0.1)
+        self.assertEqual(concurrency.limit, 5)
+        concurrency.on_throttle()
+        self.assertEqual(concurrency.limit, 2.5)
+
+    def test_shrinks_when_latency_climbs(self):
+        concurrency = AdaptiveConcurrency(initial=10, cooldown=0)
+        concurrency.on_success(0.1)
+        for _ in range(5):
+            concurrency.on_success(1.0)
+        self.assertLess(concurrency.limit, 10)
+
+    def test_latency_is_judged_per_route(self):
+        # Slow and fast call types interleaved are each at their own normal latency
+        concurrency = AdaptiveConcurrency(initial=8, maximum=8, cooldown=0)
+        for _ in range(50):
+            concurrency.on_success(0.8, "evaluate:gpt-4o-mini")
+            concurrency.on_success(10.0, "quiz:gpt-4o")
+        self.assertEqual(concurrency.limit, 8)
+        for _ in range(5):
+            concurrency.on_success(3.0, "evaluate:gpt-4o-mini")
+        self.assertLess(concurrency.limit, 8)
+
+    def test_slots_cap_in_flight_calls(self):
+        concurrency = AdaptiveConcurrency(initial=2, maximum=2)
+        peak, lock = [0], threading.Lock()
+
+        def work():
+            with concurrency.slot():
+                with lock:
+                    peak[0] = max(peak[0], concurrency.in_flight)
+                time.sleep(0.02)
+
+        threads = [threading.Thread(target=work) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(peak[0], 2)
+
+
+class TestRateLimiter(unittest.TestCase):
+    @patch("rate_limiter.time.sleep")
+    def test_rate_limited_calls_are_retried_with_backoff(self, sleep):
+        limiter = RateLimiter(concurrency=4)
+        func = MagicMock(side_effect=[RateLimitError("slow down"), RateLimitError("slow down"), "ok"])
+        self.assertEqual(limiter.call(func, "prompt"), "ok")
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(limiter.stats()["throttled"], 2)
+        self.assertLess(limiter.concurrency.limit, 4)
+
+    @patch("rate_limiter.time.sleep")
+    def test_other_errors_are_not_retried(self, sleep):
+        limiter = RateLimiter()
+        with self.assertRaises(ValueError):
+            limiter.call(MagicMock(side_effect=ValueError("bad request")))
+        sleep.assert_not_called()
+
+    @patch("rate_limiter.time.sleep")
+    def test_gives_up_after_max_retries(self, sleep):
+        limiter = RateLimiter(max_retries=1)
+        with self.assertRaises(RateLimitError):
+            limiter.call(MagicMock(side_effect=RateLimitError("slow down")))
+
+    def test_invoke_llm_goes_through_the_limiter(self):
+        from llm_client import invoke_llm
+        limiter = RateLimiter(tokens_per_minute=100000)
+        chain = MagicMock()
+        chain.invoke.return_value = MagicMock(content="answer", usage_metadata={"input_tokens": 50, "output_tokens": 10})
+        with patch("llm_client.get_rate_limiter", return_value=limiter), \
+                patch("llm_client.get_usage_tracker") as tracker:
+            tracker.return_value.check.return_value = MagicMock(exhausted=False, state="ok")
+            invoke_llm("quiz_batch", chain, {"topic": "cells"})
+        self.assertEqual(limiter.stats()["calls"], 1)
+        self.assertTrue(is_rate_limit_error(RateLimitError()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from resources import ManagerRegistry
+from vector_partitions import VectorStoreRouter
+
+
+class FakeEmbeddingRegistry(ManagerRegistry):
+    def _create_router(self):
+        return VectorStoreRouter(self.persist_directory, DeterministicFakeEmbedding(size=8), mode="shared")
+
+
+class TestManagerRegistry(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.registry = FakeEmbeddingRegistry(
+            persist_directory=os.path.join(self.temp_dir, "chroma_db"),
+            users_db=os.path.join(self.temp_dir, "users.db"),
+            sessions_db=os.path.join(self.temp_dir, "sessions.db"),
+        )
+
+    def tearDown(self):
+        self.registry.close()
+        for name in ("auth", "sessions"):
+            if name in self.registry._instances:
+                self.registry._instances[name].pool.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def test_concurrent_access_builds_one_instance(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.registry.sessions)) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len({id(r) for r in results}), 1)
+        self.assertIs(self.registry.sessions, results[0])
+
+    def test_vector_managers_share_router(self):
+        self.assertIs(self.registry.vector_gc.router, self.registry.router)
+
+    def test_session_delete_cascades_through_shared_gc(self):
+        sessions = self.registry.sessions
+        session_id = sessions.create_session("user@example.com", name="Doomed")
+        self.registry.router.get_store().add_texts(
+            ["chunk"], metadatas=[{"user_id": "user@example.com", "session_id": session_id}])
+        sessions.delete_session(session_id)
+        self.assertEqual(self.registry.router.get_store().get(where={"session_id": session_id})["ids"], [])
+
+    def test_health_reports_each_component(self):
+        health = self.registry.health()
+        self.assertTrue(health["auth_db"]["ok"])
+        self.assertTrue(health["sessions_db"]["ok"])
+        self.assertTrue(health["vector_store"]["ok"])
+        self.assertIn("latency_ms", health["openai"])
+
+    def test_embeddings_chunk_by_tokens_except_against_the_fake_server(self):
+        proxy = {"OPENAI_API_KEY": "test-key", "OPENAI_BASE_URL": "https://proxy.example.com/v1"}
+        for env, checked in ((proxy, True), (dict(proxy, KNOWVAL_FAKE_OPENAI="1"), False)):
+            registry = ManagerRegistry(persist_directory=os.path.join(self.temp_dir, "chroma_db"),
+                                       documents_db=os.path.join(self.temp_dir, "documents.db"),
+                                       lexical_db=os.path.join(self.temp_dir, "lexical.db"))
+            with patch.dict(os.environ, env):
+                self.assertEqual(registry.router.embeddings.check_embedding_ctx_length, checked)
+            registry.close()
+
+    def test_closed_registry_refuses_new_managers(self):
+        self.registry.close()
+        with self.assertRaises(RuntimeError):
+            self.registry.get("evaluator")
+
+
+if __name__ == "__main__":
+    unittest.main()
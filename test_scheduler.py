@@ -0,0 +1,126 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from llm_client import DeadlineExceeded, deadline_scope
+from scheduler import BULK, INTERACTIVE, PREFETCH, FairScheduler
+
+
+class TestFairScheduler(unittest.TestCase):
+    def setUp(self):
+        self.order = []
+        self.threads = []
+
+    def tearDown(self):
+        for t in self.threads:
+            t.join(5)
+
+    def _queue(self, scheduler, user, priority, name=None, hold=0.0):
+        """Starts a call on a thread and waits until it is queued (or admitted)."""
+        before = sum(scheduler.stats()["queued"].values()) + scheduler.in_flight
+
+        def run():
+            with scheduler.slot(user, priority):
+                self.order.append(name or user)
+                time.sleep(hold)
+
+        t = threading.Thread(target=run)
+        t.start()
+        self.threads.append(t)
+        deadline = time.monotonic() + 5
+        while sum(scheduler.stats()["queued"].values()) + scheduler.in_flight + len(self.order) <= before:
+            if time.monotonic() > deadline:
+                self.fail("call was never queued")
+            time.sleep(0.001)
+
+    def _block(self, scheduler):
+        """Holds the only slot until the returned event is set."""
+        release, held = threading.Event(), threading.Event()
+
+        def run():
+            with scheduler.slot("blocker", INTERACTIVE):
+                held.set()
+                release.wait(5)
+
+        t = threading.Thread(target=run)
+        t.start()
+        self.threads.append(t)
+        held.wait(5)
+        return release
+
+    def test_interactive_work_goes_first(self):
+        scheduler = FairScheduler(capacity=lambda: 1)
+        release = self._block(scheduler)
+        self._queue(scheduler, "prefetcher", PREFETCH)
+        self._queue(scheduler, "bulk", BULK)
+        self._queue(scheduler, "first-question", INTERACTIVE)
+        release.set()
+        self.tearDown()
+        self.assertEqual(self.order, ["first-question", "bulk", "prefetcher"])
+
+    def test_users_take_turns(self):
+        scheduler = FairScheduler(capacity=lambda: 1, per_user_limit=1)
+        release = self._block(scheduler)
+        for i in range(3):
+            self._queue(scheduler, "alice", BULK, name=f"alice-{i}")
+        self._queue(scheduler, "bob", BULK, name="bob-0")
+        release.set()
+        self.tearDown()
+        self.assertEqual(self.order, ["alice-0", "bob-0", "alice-1", "alice-2"])
+
+    def test_per_user_cap_leaves_room_for_others(self):
+        scheduler = FairScheduler(capacity=lambda: 4, per_user_limit=1)
+        self._queue(scheduler, "alice", BULK, name="alice-0", hold=0.2)
+        self._queue(scheduler, "alice", BULK, name="alice-1")
+        self._queue(scheduler, "bob", BULK, name="bob-0")
+        self.assertEqual(scheduler.stats()["queued"][BULK], 1)
+        self.tearDown()
+        self.assertEqual(self.order, ["alice-0", "bob-0", "alice-1"])
+        stats = scheduler.stats()
+        self.assertEqual(stats["wait_ms"][BULK]["admitted"], 3)
+        self.assertGreater(stats["wait_ms"][BULK]["max"], 100)
+
+    def test_waiting_stops_at_the_deadline(self):
+        scheduler = FairScheduler(capacity=lambda: 1)
+        release = self._block(scheduler)
+        start = time.monotonic()
+        with deadline_scope(0.2), self.assertRaises(DeadlineExceeded):
+            with scheduler.slot("alice", BULK):
+                self.fail("admitted past the deadline")
+        self.assertLess(time.monotonic() - start, 0.45)
+        # The abandoned ticket doesn't take the slot once it frees up
+        self.assertEqual(scheduler.stats()["queued"][BULK], 0)
+        release.set()
+        self.threads[0].join(5)
+        self._queue(scheduler, "bob", BULK)
+        self.threads[-1].join(5)
+        self.assertEqual(self.order, ["bob"])
+
+    def test_first_batch_is_interactive_and_the_rest_bulk(self):
+        with patch("generator.VectorStoreRouter"), patch("generator.OpenAIEmbeddings"):
+            from generator import QuizGenerator
+            generator = QuizGenerator()
+        store = MagicMock()
+        store.max_marginal_relevance_search.return_value = [MagicMock(page_content=f"chunk {i}", id=f"c{i}")
+                                                            for i in range(10)]
+        generator.router.scope.return_value = (store, None)
+        generator._expand_topic = MagicMock(return_value="cells")
+        priorities = []
+
+        def batch(chunks, topic, difficulty, priority):
+            priorities.append(priority)
+            return [{"chunk_index": i, "question": f"Question about {c}?", "options": {"A": "x", "B": "y"},
+                     "correct_answer": "A"} for i, c in enumerate(chunks)]
+
+        generator.generate_batch_questions = batch
+        with patch("generator.get_usage_tracker") as tracker:
+            tracker.return_value.check.return_value = MagicMock(exhausted=False, degraded=False, state="ok")
+            generator.generate_quiz("Cells", num_chunks=10, username="alice")
+            generator.generate_quiz("Cells", num_chunks=10, username="alice", priority=PREFETCH)
+        self.assertEqual(priorities, [INTERACTIVE, BULK, PREFETCH, PREFETCH])
+        self.assertEqual(generator._expand_topic.call_args_list[-1].args, ("Cells", PREFETCH))
+
+
+if __name__ == "__main__":
+    unittest.main()
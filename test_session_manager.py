@@ -0,0 +1,205 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from session_manager import SessionListCache, SessionManager
+from quiz_codec import MAGIC, encode_quiz, decode_quiz
+
+QUIZ = [
+    {"chunk_id": 1, "chunk_content": "Git is a VCS.", "question": "What is Git?",
+     "options": {"A": "VCS", "B": "DB", "C": "OS", "D": "IDE"}, "correct_answer": "A",
+     "explanation": "Git is a version control system.", "keywords": ["version control"]},
+    {"chunk_id": 2, "chunk_content": "Branches are pointers.", "question": "What is a branch?",
+     "options": {"A": "File", "B": "Pointer", "C": "Tag", "D": "Remote"}, "correct_answer": "B",
+     "explanation": "A branch is a movable pointer.", "keywords": ["pointer"]},
+]
+
+
+class TestIncrementalQuizState(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "sessions.db")
+
+    def tearDown(self):
+        SessionManager(db_path=self.db_path).pool.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def test_incremental_updates_round_trip(self):
+        manager = SessionManager(db_path=self.db_path)
+        sid = manager.create_session("user@example.com", name="Git")
+        self.assertTrue(manager.start_quiz(sid, QUIZ))
+
+        answer = {"question": "What is Git?", "user_choice": "A", "correct_choice": "A",
+                  "is_correct": True, "explanation": "Git is a version control system."}
+        self.assertTrue(manager.record_answer(sid, 0, answer, 10))
+        self.assertTrue(manager.update_progress(sid, 1, 10, False))
+
+        state = manager.load_quiz_state(sid)
+        self.assertEqual(state["quiz_data"], QUIZ)
+        self.assertEqual(state["current_index"], 1)
+        self.assertEqual(state["user_answers"], {0: answer})
+        self.assertEqual(state["score"], 10)
+        self.assertFalse(state["answer_submitted"])
+
+    def test_answers_do_not_rewrite_quiz_payload(self):
+        manager = SessionManager(db_path=self.db_path)
+        sid = manager.create_session("user@example.com")
+        manager.start_quiz(sid, QUIZ)
+        with manager.pool.read() as conn:
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                conn.execute(f"CREATE TEMP TRIGGER forbid_quiz_{event.lower()} AFTER {event} ON quizzes "
+                             "BEGIN SELECT RAISE(ABORT, 'quiz rewritten'); END")
+        self.assertTrue(manager.record_answer(sid, 0, {"is_correct": False}, 0))
+        self.assertTrue(manager.update_progress(sid, 1, 0, False))
+
+    def test_delete_session_removes_quiz_rows(self):
+        manager = SessionManager(db_path=self.db_path)
+        sid = manager.create_session("user@example.com")
+        manager.start_quiz(sid, QUIZ)
+        manager.record_answer(sid, 0, {"is_correct": True}, 10)
+        self.assertTrue(manager.delete_session(sid))
+        self.assertIsNone(manager.load_quiz_state(sid))
+        with manager.pool.read() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM quiz_answers").fetchone()[0], 0)
+
+    def test_migrates_legacy_quiz_state_table(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE sessions (id TEXT PRIMARY KEY, user_id TEXT, name TEXT, created_at TEXT)")
+        conn.execute("CREATE TABLE quiz_state (session_id TEXT PRIMARY KEY, quiz_data TEXT, current_index INTEGER, "
+                     "user_answers TEXT, score INTEGER, answer_submitted INTEGER)")
+        conn.execute("INSERT INTO quiz_state VALUES (?, ?, ?, ?, ?, ?)",
+                     ("legacy", json.dumps(QUIZ), 1, json.dumps({"0": {"is_correct": True}}), 10, 1))
+        conn.commit()
+        conn.close()
+
+        manager = SessionManager(db_path=self.db_path)
+        state = manager.load_quiz_state("legacy")
+        self.assertEqual(state["quiz_data"], QUIZ)
+        self.assertEqual(state["current_index"], 1)
+        self.assertEqual(state["user_answers"], {0: {"is_correct": True}})
+        self.assertEqual(state["score"], 10)
+        self.assertTrue(state["answer_submitted"])
+        with manager.pool.read() as conn:
+            legacy = conn.execute("SELECT 1 FROM sqlite_master WHERE name='quiz_state'").fetchone()
+        self.assertIsNone(legacy)
+
+
+class TestSessionListing(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.manager = SessionManager(db_path=os.path.join(self.temp_dir, "sessions.db"))
+        self.ids = [self.manager.create_session("power@example.com", name=f"Topic {i:03d}") for i in range(120)]
+        self.manager.create_session("other@example.com", name="Topic 000")
+
+    def tearDown(self):
+        self.manager.pool.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def test_paginated_listing_returns_sidebar_columns_only(self):
+        page = self.manager.list_user_sessions("power@example.com", limit=50)
+        self.assertEqual(len(page), 50)
+        self.assertEqual(set(page[0]), {"id", "name", "created_at"})
+        second = self.manager.list_user_sessions("power@example.com", limit=50, offset=50)
+        self.assertFalse({s["id"] for s in page} & {s["id"] for s in second})
+        self.assertEqual(self.manager.count_user_sessions("power@example.com"), 120)
+
+    def test_search_escapes_wildcards(self):
+        self.manager.create_session("power@example.com", name="100% Git_Basics")
+        self.assertEqual(len(self.manager.list_user_sessions("power@example.com", search="Topic 01")), 10)
+        self.assertEqual([s["name"] for s in self.manager.list_user_sessions("power@example.com", search="%")],
+                         ["100% Git_Basics"])
+        self.assertEqual(self.manager.count_user_sessions("power@example.com", search="_"), 1)
+
+    def test_listing_uses_user_index(self):
+        with self.manager.pool.read() as conn:
+            plan = conn.execute("EXPLAIN QUERY PLAN SELECT id, name, created_at FROM sessions WHERE user_id=? "
+                                "ORDER BY created_at DESC LIMIT 50", ("power@example.com",)).fetchall()
+        detail = " ".join(row[3] for row in plan)
+        self.assertIn("idx_sessions_user_created", detail)
+        self.assertNotIn("TEMP B-TREE", detail)
+
+    def test_cache_is_invalidated_on_create_rename_and_delete(self):
+        user = "power@example.com"
+        first = self.manager.list_user_sessions(user, limit=5)
+        with self.manager.pool.read() as conn:
+            conn.execute("UPDATE sessions SET name='stale' WHERE id=?", (first[0]["id"],))
+        self.assertEqual(self.manager.list_user_sessions(user, limit=5), first)  # served from cache
+
+        self.manager.update_session_name(first[0]["id"], "Renamed")
+        self.assertEqual(self.manager.list_user_sessions(user, limit=5)[0]["name"], "Renamed")
+
+        self.manager.delete_session(first[0]["id"])
+        self.assertNotIn(first[0]["id"], [s["id"] for s in self.manager.list_user_sessions(user, limit=5)])
+        self.assertEqual(self.manager.count_user_sessions(user), 119)
+
+        new_id = self.manager.create_session(user, name="Newest")
+        self.assertEqual(self.manager.get_session(new_id)["name"], "Newest")
+        self.assertEqual(self.manager.count_user_sessions(user), 120)
+
+    def _version(self, user):
+        with self.manager.pool.read() as conn:
+            return self.manager._listing_version(conn, user)
+
+    def test_unchanged_rename_keeps_cache(self):
+        user = "power@example.com"
+        self.manager.list_user_sessions(user, limit=5)
+        self.manager.update_session_name(self.ids[0], "Topic 000")
+        self.assertIsNotNone(self.manager.listing_cache.get(user, ("page", 5, 0, ""), self._version(user)))
+
+    def test_read_racing_a_write_is_not_cached(self):
+        user = "power@example.com"
+        cache = self.manager.listing_cache
+        version = self._version(user)
+        stale = self.manager.list_user_sessions(user, limit=5)
+        self.manager.create_session(user, name="Landed mid-read")
+        cache.put(user, ("page", 5, 0, ""), stale, version)
+        self.assertIsNone(cache.get(user, ("page", 5, 0, ""), self._version(user)))
+
+    def test_writes_from_another_worker_invalidate_the_cache(self):
+        user = "power@example.com"
+        # Another API worker or Streamlit replica: same database, its own in-memory cache
+        other = SessionManager(db_path=self.manager.db_path)
+        other.listing_cache = SessionListCache()
+        first = other.list_user_sessions(user, limit=5)
+        self.assertEqual(other.count_user_sessions(user), 120)
+
+        self.manager.update_session_name(first[0]["id"], "Renamed elsewhere")
+        self.manager.create_session(user, name="Created elsewhere")
+        self.assertEqual(other.list_user_sessions(user, limit=5)[0]["name"], "Created elsewhere")
+        self.assertIn("Renamed elsewhere", [s["name"] for s in other.list_user_sessions(user, limit=5)])
+        self.assertEqual(other.count_user_sessions(user), 121)
+
+
+class TestCompactQuizEncoding(unittest.TestCase):
+    def test_items_with_chunk_ref_drop_source_text(self):
+        quiz = [dict(QUIZ[0], chunk_ref="doc-1"), QUIZ[1]]
+        blob = encode_quiz(quiz)
+        self.assertTrue(blob.startswith(MAGIC))
+        decoded = decode_quiz(blob)
+        self.assertNotIn("chunk_content", decoded[0])
+        self.assertEqual(decoded[0]["chunk_ref"], "doc-1")
+        self.assertEqual(decoded[1], QUIZ[1])
+        self.assertLess(len(encode_quiz(QUIZ * 15)), len(json.dumps(QUIZ * 15)) / 4)
+
+    def test_legacy_json_text_still_decodes(self):
+        self.assertEqual(decode_quiz(json.dumps(QUIZ)), QUIZ)
+
+    def test_session_manager_stores_binary_blob(self):
+        temp_dir = tempfile.mkdtemp()
+        manager = SessionManager(db_path=os.path.join(temp_dir, "sessions.db"))
+        try:
+            manager.start_quiz("s1", QUIZ)
+            with manager.pool.read() as conn:
+                stored = conn.execute("SELECT quiz_data FROM quizzes WHERE session_id='s1'").fetchone()[0]
+            self.assertIsInstance(stored, bytes)
+            self.assertEqual(manager.load_quiz_state("s1")["quiz_data"], QUIZ)
+        finally:
+            manager.pool.close_all()
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from tracing import Tracer, TracedEmbeddings, count, tracer
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_spans_nest_and_record_attributes(self):
+        local = Tracer()
+        with local.span("generate_quiz", topic="cells") as root:
+            with local.span("llm_batch") as child:
+                child.add("tokens_in", 10)
+                child.add("tokens_in", 5)
+            root.set(questions=3)
+
+        trace = local.recent_traces()[0]
+        self.assertEqual(trace["name"], "generate_quiz")
+        names = [s["name"] for s in trace["spans"]]
+        self.assertEqual(names, ["generate_quiz", "llm_batch"])
+        root_dict, child_dict = trace["spans"]
+        self.assertEqual(child_dict["parent_id"], root_dict["span_id"])
+        self.assertEqual(child_dict["trace_id"], root_dict["trace_id"])
+        self.assertEqual(child_dict["attributes"]["tokens_in"], 15)
+        self.assertEqual(root_dict["attributes"], {"topic": "cells", "questions": 3})
+
+    def test_errors_are_recorded_and_reraised(self):
+        local = Tracer()
+        with self.assertRaises(ValueError):
+            with local.span("json_parse"):
+                raise ValueError("bad json")
+        self.assertEqual(local.spans()[0].error, "ValueError: bad json")
+
+    def test_jsonl_and_otlp_export(self):
+        jsonl_path = os.path.join(self.temp_dir, "trace.jsonl")
+        otlp_path = os.path.join(self.temp_dir, "trace.otlp.jsonl")
+        for path, fmt in ((jsonl_path, "jsonl"), (otlp_path, "otlp")):
+            local = Tracer(export_path=path, export_format=fmt)
+            with local.span("store", chunks=4):
+                pass
+
+        with open(jsonl_path) as f:
+            record = json.loads(f.readline())
+        self.assertEqual((record["name"], record["attributes"]["chunks"]), ("store", 4))
+
+        with open(otlp_path) as f:
+            span = json.loads(f.readline())["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+        self.assertEqual(span["name"], "store")
+        self.assertEqual(len(span["traceId"]), 32)
+        self.assertEqual(span["attributes"], [{"key": "chunks", "value": {"intValue": "4"}}])
+
+    def test_summary_and_ring_buffer(self):
+        local = Tracer(buffer_size=3)
+        for _ in range(5):
+            with local.span("embed"):
+                pass
+        summary = local.summary()
+        self.assertEqual(summary[0]["stage"], "embed")
+        self.assertEqual(summary[0]["count"], 3)
+
+    def test_helpers_use_the_module_tracer(self):
+        tracer.clear()
+        embeddings = MagicMock()
+        embeddings.embed_documents.return_value = [[0.0], [1.0]]
+
+        count("ignored_without_span")
+        with tracer.span("ingest"):
+            TracedEmbeddings(embeddings).embed_documents(["a", "bc"])
+            count("dedup_hits")
+
+        spans = {s.name: s for s in tracer.spans()}
+        self.assertEqual(spans["embed"].attributes, {"texts": 2, "chars": 3})
+        self.assertEqual(spans["ingest"].attributes, {"dedup_hits": 1})
+        tracer.clear()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import usage
+from llm_client import invoke_llm
+from usage import BudgetExceeded, TrackedEmbeddings, UsageTracker, count_tokens, estimate_cost, usage_scope
+
+
+class TestUsageTracking(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.tracker = UsageTracker(os.path.join(self.temp_dir, "usage.db"))
+        self.patcher = patch("llm_client.get_usage_tracker", return_value=self.tracker)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.tracker.pool.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def _chain(self, content="answer", usage_metadata=None):
+        chain = MagicMock()
+        chain.invoke.return_value = MagicMock(content=content, usage_metadata=usage_metadata)
+        return chain
+
+    def test_reported_usage_is_recorded_per_user_and_session(self):
+        chain = self._chain(usage_metadata={"input_tokens": 1000, "output_tokens": 200})
+        with usage_scope("alice", "s1"):
+            invoke_llm("quiz_batch", chain, {"topic": "cells"})
+
+        totals = self.tracker.usage_for("alice", session_id="s1")
+        self.assertEqual((totals["calls"], totals["tokens_in"], totals["tokens_out"]), (1, 1000, 200))
+        self.assertAlmostEqual(totals["cost"], estimate_cost("gpt-4o", 1000, 200))
+        self.assertEqual(self.tracker.usage_for("bob")["calls"], 0)
+
+    def test_missing_usage_is_estimated(self):
+        with usage_scope("alice"):
+            invoke_llm("expand_topic", self._chain(content="a b c d " * 10), {"topic": "x" * 40})
+        totals = self.tracker.usage_for("alice")
+        self.assertGreater(totals["tokens_in"], 0)
+        self.assertGreater(totals["tokens_out"], 0)
+
+    def test_budget_degrades_then_refuses_calls(self):
+        self.tracker.set_budget("alice", daily_tokens=1000)
+        self.assertEqual(self.tracker.check("alice").state, "ok")
+
+        self.tracker.record("quiz_batch", "gpt-4o", 850, user_id="alice")
+        self.assertEqual(self.tracker.check("alice").state, "degraded")
+
+        self.tracker.record("quiz_batch", "gpt-4o", 200, user_id="alice")
+        chain = self._chain()
+        with usage_scope("alice"), self.assertRaises(BudgetExceeded):
+            invoke_llm("quiz_batch", chain, {"topic": "cells"})
+        chain.invoke.assert_not_called()
+        # Other users are unaffected, and no default limit means unlimited
+        self.assertEqual(self.tracker.check("bob").state, "ok")
+
+    def test_embeddings_are_counted(self):
+        embeddings = MagicMock(model="text-embedding-3-small")
+        embeddings.embed_documents.return_value = [[0.0]]
+        with usage_scope("alice", "s1"):
+            TrackedEmbeddings(embeddings, self.tracker).embed_documents(["some text to embed"])
+        self.assertGreater(self.tracker.usage_for("alice")["tokens_in"], 0)
+
+    def test_token_count_falls_back_without_tiktoken(self):
+        with patch.dict(usage._encoders, {"offline-model": None}):
+            self.assertEqual(count_tokens("x" * 40, "offline-model"), 10)
+        self.assertEqual(count_tokens("", "gpt-4o"), 0)
+
+
+class TestBudgetDegradation(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.tracker = UsageTracker(os.path.join(self.temp_dir, "usage.db"), daily_tokens=1000)
+
+    def tearDown(self):
+        self.tracker.pool.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def test_generate_quiz_shrinks_and_skips_expansion_when_degraded(self):
+        with patch("generator.VectorStoreRouter"), patch("generator.OpenAIEmbeddings"):
+            from generator import QuizGenerator, DEGRADED_QUIZ_SIZE
+            generator = QuizGenerator()
+        store = MagicMock()
+        store.max_marginal_relevance_search.return_value = []
+        generator.router.scope.return_value = (store, None)
+        generator._expand_topic = MagicMock()
+
+        self.tracker.record("quiz_batch", "gpt-4o", 900, user_id="alice")
+        with patch("generator.get_usage_tracker", return_value=self.tracker):
+            self.assertEqual(generator.generate_quiz("Cells", username="alice"), [])
+            generator._expand_topic.assert_not_called()
+            self.assertEqual(store.max_marginal_relevance_search.call_args.kwargs["k"], DEGRADED_QUIZ_SIZE * 2)
+
+            self.tracker.record("quiz_batch", "gpt-4o", 200, user_id="alice")
+            with self.assertRaises(BudgetExceeded):
+                generator.generate_quiz("Cells", username="alice")
+
+
+if __name__ == "__main__":
+    unittest.main()
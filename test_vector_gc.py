@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from vector_gc import VectorGarbageCollector
+from vector_partitions import VectorStoreRouter
+from session_manager import SessionManager
+
+
+class TestVectorGarbageCollector(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.persist_directory = os.path.join(self.temp_dir, "chroma_db")
+        self.sessions = SessionManager(db_path=os.path.join(self.temp_dir, "sessions.db"))
+        self.router = VectorStoreRouter(self.persist_directory, DeterministicFakeEmbedding(size=8), mode="shared")
+        self.store = self.router.get_store()
+        self.collector = VectorGarbageCollector(self.sessions, self.persist_directory, router=self.router)
+        self.sessions.delete_hooks.append(self.collector.delete_session_vectors)
+
+        self.live = self.sessions.create_session("user@example.com", name="Live")
+        self.deleted = self.sessions.create_session("user@example.com", name="Deleted")
+        old = time.time() - 2 * 24 * 3600
+        self._add("live", self.live, old, 3)
+        self._add("deleted", self.deleted, old, 2)
+        self._add("unsaved-old", "never-saved-old", old, 4)
+        self._add("unsaved-new", "never-saved-new", time.time(), 1)
+        self.store.add_documents([Document(page_content="cli chunk", metadata={"source": "cli"})])
+
+    def _add(self, prefix, session_id, ingested_at, count):
+        self.store.add_documents([
+            Document(page_content=f"{prefix} chunk {i}",
+                     metadata={"user_id": "user@example.com", "session_id": session_id, "ingested_at": ingested_at})
+            for i in range(count)
+        ])
+
+    def tearDown(self):
+        self.sessions.pool.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def _count(self, session_id):
+        # Compaction closes the client, so earlier store handles are stale afterwards
+        return len(self.router.get_store().get(where={"session_id": session_id})["ids"])
+
+    def test_delete_session_cascades_to_vector_store(self):
+        self.assertTrue(self.sessions.delete_session(self.deleted))
+        self.assertEqual(self._count(self.deleted), 0)
+        self.assertEqual(self._count(self.live), 3)
+
+    def _delete_row_without_cascade(self, session_id):
+        """Simulates a session deleted before deletes cascaded to the vector store."""
+        with self.sessions.pool.transaction() as conn:
+            conn.execute("DELETE FROM sessions WHERE id=?", (session_id,))
+
+    def test_collect_removes_orphans_outside_grace_period(self):
+        self._delete_row_without_cascade(self.deleted)
+        self.assertEqual(self.collector.find_orphans(), {self.deleted: 2, "never-saved-old": 4})
+
+        report = self.collector.collect()
+        self.assertEqual(report["chunks_deleted"], 6)
+        self.assertEqual(report["orphaned_sessions"], 2)
+        self.assertIn("bytes_reclaimed", report)
+        self.assertEqual(self._count("never-saved-old"), 0)
+        self.assertEqual(self._count("never-saved-new"), 1)
+        self.assertEqual(self._count(self.live), 3)
+        self.assertTrue(report["compacted"])
+        self.assertEqual(self.router.get_store()._collection.count(), 5)  # live + recent unsaved + CLI chunk
+
+    def test_compaction_skipped_while_another_client_is_open(self):
+        other = VectorStoreRouter(self.persist_directory, DeterministicFakeEmbedding(size=8), mode="shared")
+        other.get_store()
+        self._delete_row_without_cascade(self.deleted)
+        report = self.collector.collect()
+        self.assertEqual(report["chunks_deleted"], 2 + 4)
+        self.assertFalse(report["compacted"])
+        other.close()
+        self.assertEqual(self._count(self.live), 3)
+
+    def test_dry_run_deletes_nothing(self):
+        self._delete_row_without_cascade(self.deleted)
+        report = self.collector.collect(dry_run=True)
+        self.assertEqual(report["orphaned_chunks"], 6)
+        self.assertEqual(report["chunks_deleted"], 0)
+        self.assertEqual(self.store._collection.count(), 11)
+
+
+if __name__ == '__main__':
+    unittest.main()
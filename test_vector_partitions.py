@@ -0,0 +1,86 @@
+import shutil
+import tempfile
+import unittest
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from vector_partitions import VectorStoreRouter, SHARED_COLLECTION, build_metadata_filter
+
+
+def _docs(user, session, count):
+    return [Document(page_content=f"{user} {session} chunk {i}", metadata={"user_id": user, "session_id": session})
+            for i in range(count)]
+
+
+class TestVectorStoreRouter(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.embeddings = DeterministicFakeEmbedding(size=8)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _router(self, mode, **kwargs):
+        return VectorStoreRouter(self.temp_dir, self.embeddings, mode=mode, **kwargs)
+
+    def test_build_metadata_filter(self):
+        self.assertIsNone(build_metadata_filter())
+        self.assertEqual(build_metadata_filter("u"), {"user_id": "u"})
+        self.assertEqual(build_metadata_filter("u", "s"), {"$and": [{"user_id": "u"}, {"session_id": "s"}]})
+
+    def test_scope_filters_per_mode(self):
+        shared_store, shared_filter = self._router("shared").scope("u", "s")
+        self.assertEqual(shared_store._collection.name, SHARED_COLLECTION)
+        self.assertEqual(shared_filter, {"$and": [{"user_id": "u"}, {"session_id": "s"}]})
+
+        user_store, user_filter = self._router("user").scope("u", "s")
+        self.assertTrue(user_store._collection.name.startswith("kv_user_"))
+        self.assertEqual(user_filter, {"session_id": "s"})
+
+        session_store, session_filter = self._router("session").scope("u", "s")
+        self.assertTrue(session_store._collection.name.startswith("kv_session_"))
+        self.assertIsNone(session_filter)
+
+        # Scopes without a session fall back to the shared collection
+        self.assertEqual(self._router("session").collection_name("u", None), SHARED_COLLECTION)
+
+    def test_session_partitions_isolate_search(self):
+        router = self._router("session")
+        router.add_documents(_docs("alice", "s1", 3), "alice", "s1")
+        router.add_documents(_docs("bob", "s2", 2), "bob", "s2")
+
+        store, filter_dict = router.scope("alice", "s1")
+        results = store.similarity_search("chunk", k=10, filter=filter_dict)
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(d.metadata["user_id"] == "alice" for d in results))
+
+        self.assertEqual(router.delete_session("s1", "alice"), 3)
+        self.assertNotIn(router.collection_name("alice", "s1"), router.list_collections())
+
+    def test_handle_cache_is_bounded(self):
+        router = self._router("session", max_open_collections=2)
+        first = router.get_store("u", "s1")
+        self.assertIs(router.get_store("u", "s1"), first)
+        router.get_store("u", "s2")
+        router.get_store("u", "s3")
+        self.assertEqual(len(router._handles), 2)
+        self.assertIsNot(router.get_store("u", "s1"), first)
+
+    def test_migrates_shared_collection_without_reembedding(self):
+        shared = self._router("shared")
+        shared.add_documents(_docs("alice", "s1", 3) + _docs("bob", "s2", 2), "alice", "s1")
+        shared.get_store().add_documents([Document(page_content="cli chunk", metadata={"source": "cli"})])
+
+        router = self._router("user")
+        router.embeddings = None  # any embedding call during migration would fail
+        copied = router.migrate_shared_collection(delete_source=True)
+        self.assertEqual(sorted(copied.values()), [2, 3])
+        self.assertEqual(shared.get_store()._collection.count(), 1)
+
+        store, filter_dict = router.scope("bob", "s2")
+        self.assertEqual(len(store.get(where=filter_dict)["ids"]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
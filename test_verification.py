@@ -53,7 +53,7 @@ def test_pipeline():
     try:
         question = quiz[0]['question']
         keywords = quiz[0]['keywords']
-        chunk_content = quiz[0]['chunk_content']
+        chunk_content = quiz_generator.resolve_chunk_content(quiz[0])
         user_answer = "Python is a high-level programming language created by Guido van Rossum."
         
         evaluator = AnswerEvaluator()
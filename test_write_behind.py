@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from session_manager import SessionManager
+from test_session_manager import QUIZ
+
+
+class TestWriteBehindQueue(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "sessions.db")
+        self.manager = SessionManager(db_path=self.db_path, write_behind=True)
+        self.manager.write_queue.flush_interval = 60  # only flush when the test asks
+        self.sid = self.manager.create_session("user@example.com")
+        self.manager.start_quiz(self.sid, QUIZ)
+
+    def tearDown(self):
+        self.manager.close()
+        self.manager.pool.close_all()
+        shutil.rmtree(self.temp_dir)
+
+    def _stored_progress(self):
+        with self.manager.pool.read() as conn:
+            return conn.execute("SELECT current_index, score, answer_submitted FROM quiz_progress WHERE session_id=?",
+                                (self.sid,)).fetchone()
+
+    def test_rapid_updates_coalesce_into_one_write(self):
+        self.manager.record_answer(self.sid, 0, {"is_correct": True}, 10)
+        self.manager.update_progress(self.sid, 1, 10, False)
+        self.manager.record_answer(self.sid, 1, {"is_correct": False}, 10)
+
+        stats = self.manager.write_queue.stats()
+        self.assertEqual(stats["queue_depth"], 3)  # progress row + two answer rows
+        self.assertEqual(stats["coalesced"], 2)
+        self.assertEqual(tuple(self._stored_progress()), (0, 0, 0))
+
+        self.assertEqual(self.manager.write_queue.flush(), 3)
+        self.assertEqual(tuple(self._stored_progress()), (1, 10, 1))
+        stats = self.manager.write_queue.stats()
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertEqual(stats["flushes"], 1)
+        self.assertGreater(stats["last_flush_ms"], 0)
+
+    def test_load_reads_its_own_pending_writes(self):
+        self.manager.record_answer(self.sid, 0, {"is_correct": True}, 10)
+        state = self.manager.load_quiz_state(self.sid)
+        self.assertEqual(state["user_answers"], {0: {"is_correct": True}})
+        self.assertEqual(state["score"], 10)
+
+    def test_background_thread_flushes(self):
+        self.manager.write_queue.flush_interval = 0.01
+        self.manager.update_progress(self.sid, 1, 0, False)
+        deadline = time.time() + 5
+        while self.manager.write_queue.stats()["queue_depth"] and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        self.assertEqual(self._stored_progress()[0], 1)
+
+    def test_close_flushes_pending_writes(self):
+        self.manager.update_progress(self.sid, 2, 20, False)
+        self.manager.close()
+        self.assertEqual(tuple(self._stored_progress()), (2, 20, 0))
+
+    def test_closing_one_manager_keeps_the_shared_queue_for_the_others(self):
+        other = SessionManager(db_path=self.db_path, write_behind=True)
+        queue = self.manager.write_queue
+        self.assertIs(other.write_queue, queue)
+
+        other.update_progress(self.sid, 3, 30, False)
+        other.close()
+        self.assertEqual(tuple(self._stored_progress()), (3, 30, 0))
+        self.manager.update_progress(self.sid, 4, 40, False)
+        self.assertEqual(self.manager.write_queue.stats()["queue_depth"], 1)
+
+        self.manager.close()
+        self.assertTrue(queue._closed)
+        self.assertEqual(tuple(self._stored_progress()), (4, 40, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
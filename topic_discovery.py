@@ -5,49 +5,52 @@ sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 import os
 import json
 from typing import List
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import PromptTemplate
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
+from lazy_imports import LazyImport
+from lexical_index import HybridRetriever, LexicalIndex
+from llm_client import DeadlineExceeded
+from model_router import RoutingError, invoke_routed
+from tracing import span
+from usage import BudgetExceeded, usage_scope
+from vector_partitions import VectorStoreRouter
+
+# LangChain and OpenAI take seconds to import, so they are loaded on first use
+ChatOpenAI = LazyImport("langchain_openai", "ChatOpenAI")
+OpenAIEmbeddings = LazyImport("langchain_openai", "OpenAIEmbeddings")
+PromptTemplate = LazyImport("langchain_core.prompts", "PromptTemplate")
 
 class TopicManager:
-    def __init__(self, persist_directory: str = "./chroma_db"):
+    def __init__(self, persist_directory: str = "./chroma_db", router: VectorStoreRouter = None,
+                 lexical_index: LexicalIndex = None, vector_index=None):
         self.persist_directory = persist_directory
-        self.embeddings = OpenAIEmbeddings()
-        self.vector_store = Chroma(persist_directory=self.persist_directory, embedding_function=self.embeddings)
+        # A shared router brings its own embedding client, so managers don't each open one
+        self.embeddings = router.embeddings if router else OpenAIEmbeddings()
+        self.router = router or VectorStoreRouter(self.persist_directory, self.embeddings)
+        self.retriever = HybridRetriever(self.router, lexical_index, vector_index=vector_index)
 
     def discover_topics(self, username: str = None, session_id: str = None) -> List[str]:
         """
         Analyzes the documents to discover main topics or chapters.
         """
+        with span("discover_topics") as topics_span, usage_scope(username, session_id):
+            try:
+                topics = self._discover_topics(username, session_id)
+            except (BudgetExceeded, DeadlineExceeded) as e:
+                print(f"Skipping topic discovery: {e}")
+                topics = ["General Knowledge"]
+            topics_span.set(topics=len(topics))
+            return topics
+
+    def _discover_topics(self, username: str = None, session_id: str = None) -> List[str]:
         # Retrieve chunks that might contain structural info
         # We search for terms likely to appear in introductions or table of contents
-        filters = []
-        if username:
-            filters.append({"user_id": username})
-        if session_id:
-            filters.append({"session_id": session_id})
-        
-        if len(filters) > 1:
-            filter_dict = {"$and": filters}
-        elif len(filters) == 1:
-            filter_dict = filters[0]
-        else:
-            filter_dict = None
-        
-        docs = self.vector_store.similarity_search(
-            "Table of Contents, Chapters, Overview, Syllabus, Introduction", 
-            k=15,
-            filter=filter_dict
-        )
+        docs = self.retriever.search("Table of Contents, Chapters, Overview, Syllabus, Introduction", k=15,
+                                     username=username, session_id=session_id)
         
         if not docs:
             return ["General Knowledge"]
 
         text_sample = "\n\n".join([d.page_content[:500] for d in docs]) # Limit context size
         
-        llm = ChatOpenAI(model="gpt-4o", temperature=0.5)
-        
         prompt_template = """
         You are Knowval AI, an expert curriculum designer.
         Your task is to analyze the following text segments from a document and extract a list of 5 to 10 main chapters, topics, or skills covered.
@@ -67,17 +70,21 @@ class TopicManager:
             template=prompt_template
         )
         
-        chain = prompt | llm
-        response = chain.invoke({"text_sample": text_sample})
-        
-        try:
-            content = response.content.strip()
-            if content.startswith("```json"):
-                content = content.replace("```json", "").replace("```", "")
-            topics = json.loads(content)
-            if isinstance(topics, list):
+        def parse(response):
+            with span("json_parse"):
+                content = response.content.strip()
+                if content.startswith("```json"):
+                    content = content.replace("```json", "").replace("```", "")
+                topics = json.loads(content)
+            # A cheap model that returns prose or a single topic is retried on the next tier
+            if isinstance(topics, list) and len(topics) >= 2 and all(isinstance(t, str) for t in topics):
                 return topics
-            return ["General Knowledge"]
-        except Exception as e:
+            return None
+
+        try:
+            return invoke_routed("discover_topics",
+                                 lambda model: prompt | ChatOpenAI(model=model, temperature=0.5, max_retries=0),
+                                 {"text_sample": text_sample}, parse)
+        except RoutingError as e:
             print(f"Error discovering topics: {e}")
             return ["General Knowledge"]
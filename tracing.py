@@ -0,0 +1,212 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
+
+_current_span: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("knowval_span", default=None)
+
+
+class Span:
+    """One timed stage of the pipeline. Attributes carry counts such as chunks, tokens or cache hits."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, span_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, key: str, amount: float = 1):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_ns / 1e9,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def to_otel(self) -> Dict[str, Any]:
+        """The span in OTLP/JSON form, as read by the OpenTelemetry Collector's file receiver."""
+        def value(v):
+            if isinstance(v, bool):
+                return {"boolValue": v}
+            if isinstance(v, int):
+                return {"intValue": str(v)}
+            if isinstance(v, float):
+                return {"doubleValue": v}
+            return {"stringValue": str(v)}
+
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": value(v)} for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Tracer:
+    """
+    Records nested spans for the RAG pipeline.
+
+    Finished spans are kept in an in-memory ring buffer (for the debug panel) and, when
+    `export_path` is set, appended to a file: one span per line, either as plain JSON
+    ("jsonl") or as OTLP/JSON ("otlp").
+    """
+
+    def __init__(self, export_path: str = None, export_format: str = "jsonl", buffer_size: int = 5000,
+                 service_name: str = "knowval"):
+        if export_format not in ("jsonl", "otlp"):
+            raise ValueError(f"Unknown trace export format '{export_format}', expected 'jsonl' or 'otlp'")
+        self.export_path = export_path
+        self.export_format = export_format
+        self.service_name = service_name
+        self._spans = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Times the enclosed block as a child of the current span (or as a new trace)."""
+        parent = _current_span.get()
+        span = Span(name, parent.trace_id if parent else os.urandom(16).hex(), os.urandom(8).hex(),
+                    parent.span_id if parent else None, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_ns = time.time_ns()
+            self._finish(span)
+
+    def traced(self, name: str = None):
+        """Decorator form of `span`."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name or func.__qualname__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _finish(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+            if self.export_path:
+                try:
+                    with open(self.export_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(self._export_record(span), default=str) + "\n")
+                except OSError as e:
+                    print(f"Trace export failed: {e}")
+
+    def _export_record(self, span: Span) -> Dict[str, Any]:
+        if self.export_format == "jsonl":
+            return span.to_dict()
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "knowval.tracing"}, "spans": [span.to_otel()]}],
+        }]}
+
+    def spans(self) -> List[Span]:
+        with self._lock:
+            return list(self._spans)
+
+    def recent_traces(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """The latest finished traces, newest first, each with its spans in start order."""
+        by_trace: Dict[str, List[Span]] = {}
+        for span in self.spans():
+            by_trace.setdefault(span.trace_id, []).append(span)
+        traces = []
+        for trace_id, spans in by_trace.items():
+            root = next((s for s in spans if s.parent_id is None), None)
+            if root is None:
+                continue  # root still running or evicted from the buffer
+            traces.append({"trace_id": trace_id, "name": root.name, "start": root.start_ns,
+                           "duration_ms": round(root.duration_ms, 3),
+                           "spans": [s.to_dict() for s in sorted(spans, key=lambda s: s.start_ns)]})
+        traces.sort(key=lambda t: t["start"], reverse=True)
+        return traces[:limit]
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Per-stage count, total and p95 latency over the buffered spans, slowest stages first."""
+        durations: Dict[str, List[float]] = {}
+        for span in self.spans():
+            durations.setdefault(span.name, []).append(span.duration_ms)
+        rows = []
+        for name, values in durations.items():
+            values.sort()
+            rows.append({"stage": name, "count": len(values), "total_ms": round(sum(values), 1),
+                         "avg_ms": round(sum(values) / len(values), 1),
+                         "p95_ms": round(values[min(len(values) - 1, int(len(values) * 0.95))], 1)})
+        rows.sort(key=lambda r: r["total_ms"], reverse=True)
+        return rows
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def count(key: str, amount: float = 1):
+    """Adds to a counter on the current span, if any (e.g. cache hits deep inside a stage)."""
+    span = _current_span.get()
+    if span is not None:
+        span.add(key, amount)
+
+
+class TracedEmbeddings:
+    """Wraps an embedding client so every embedding call shows up as an `embed` span."""
+
+    def __init__(self, embeddings):
+        self.wrapped = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with tracer.span("embed", texts=len(texts), chars=sum(len(t) for t in texts)):
+            return self.wrapped.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with tracer.span("embed_query", chars=len(text)):
+            return self.wrapped.embed_query(text)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+
+tracer = Tracer(export_path=os.getenv("KNOWVAL_TRACE_FILE"), export_format=os.getenv("KNOWVAL_TRACE_FORMAT", "jsonl"))
+span = tracer.span
+traced = tracer.traced
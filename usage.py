@@ -0,0 +1,234 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Tuple
+from db import get_pool
+
+# USD per 1M tokens: (input, output)
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "text-embedding-ada-002": (0.10, 0.0),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+}
+DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
+# Share of a budget after which callers should degrade (smaller quizzes, local grading)
+DEGRADE_AT = 0.8
+BUDGET_WINDOW = 24 * 3600
+
+_scope: "contextvars.ContextVar[Tuple[Optional[str], Optional[str]]]" = contextvars.ContextVar(
+    "knowval_usage_scope", default=(None, None))
+_encoders: Dict[str, Any] = {}
+_encoders_lock = threading.Lock()
+
+
+class BudgetExceeded(Exception):
+    """Raised instead of making a model call once a user's budget is used up."""
+
+
+def _encoder(model: str):
+    with _encoders_lock:
+        if model not in _encoders:
+            try:
+                import tiktoken
+                try:
+                    _encoders[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    _encoders[model] = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                # e.g. no network to fetch the BPE file; fall back to the ~4 chars/token rule
+                print(f"tiktoken unavailable for {model}, estimating tokens from length: {e}")
+                _encoders[model] = None
+        return _encoders[model]
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Token count of `text` for `model`; approximated from its length when tiktoken can't load."""
+    if not text:
+        return 0
+    encoder = _encoder(model)
+    if encoder is None:
+        return max(1, len(text) // 4)
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def estimate_cost(model: str, tokens_in: int, tokens_out: int = 0) -> float:
+    price_in, price_out = MODEL_PRICES.get(model, MODEL_PRICES["gpt-4o"])
+    return (tokens_in * price_in + tokens_out * price_out) / 1_000_000
+
+
+@contextmanager
+def usage_scope(user_id: str = None, session_id: str = None):
+    """Attributes model calls made inside the block to a user and session."""
+    token = _scope.set((user_id, session_id))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def current_scope() -> Tuple[Optional[str], Optional[str]]:
+    return _scope.get()
+
+
+class BudgetStatus:
+    """A user's usage over the budget window against their limits. `state` is ok, degraded or exhausted."""
+
+    def __init__(self, tokens: int, cost: float, token_limit: Optional[int], cost_limit: Optional[float]):
+        self.tokens = tokens
+        self.cost = cost
+        self.token_limit = token_limit
+        self.cost_limit = cost_limit
+        fractions = []
+        if token_limit:
+            fractions.append(tokens / token_limit)
+        if cost_limit:
+            fractions.append(cost / cost_limit)
+        self.used_fraction = max(fractions, default=0.0)
+        if self.used_fraction >= 1:
+            self.state = "exhausted"
+        elif self.used_fraction >= DEGRADE_AT:
+            self.state = "degraded"
+        else:
+            self.state = "ok"
+
+    @property
+    def degraded(self) -> bool:
+        return self.state != "ok"
+
+    @property
+    def exhausted(self) -> bool:
+        return self.state == "exhausted"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"state": self.state, "tokens": self.tokens, "cost": round(self.cost, 6),
+                "token_limit": self.token_limit, "cost_limit": self.cost_limit,
+                "used_fraction": round(self.used_fraction, 4)}
+
+
+class UsageTracker:
+    """
+    Records model token usage per user and session in SQLite and enforces rolling 24h budgets.
+
+    Default limits come from KNOWVAL_DAILY_TOKEN_BUDGET / KNOWVAL_DAILY_COST_BUDGET (unset means
+    unlimited); `set_budget` overrides them per user.
+    """
+
+    def __init__(self, db_path: str = "usage.db", daily_tokens: int = None, daily_cost: float = None):
+        self.db_path = db_path
+        self.pool = get_pool(db_path)
+        env_tokens = os.getenv("KNOWVAL_DAILY_TOKEN_BUDGET")
+        env_cost = os.getenv("KNOWVAL_DAILY_COST_BUDGET")
+        self.daily_tokens = daily_tokens if daily_tokens is not None else (int(env_tokens) if env_tokens else None)
+        self.daily_cost = daily_cost if daily_cost is not None else (float(env_cost) if env_cost else None)
+        self._init_db()
+
+    def _init_db(self):
+        with self.pool.transaction() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS usage
+                         (id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL, user_id TEXT, session_id TEXT,
+                          call_type TEXT, model TEXT, tokens_in INTEGER, tokens_out INTEGER, cost REAL,
+                          estimated INTEGER)''')
+            # Budget checks sum one user's recent rows
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_user_ts ON usage (user_id, ts)")
+            conn.execute('''CREATE TABLE IF NOT EXISTS budgets
+                         (user_id TEXT PRIMARY KEY, daily_tokens INTEGER, daily_cost REAL)''')
+
+    def record(self, call_type: str, model: str, tokens_in: int, tokens_out: int = 0, user_id: str = None,
+               session_id: str = None, estimated: bool = False) -> float:
+        """Stores one call's usage (attributed to the current usage scope by default). Returns its cost."""
+        scope_user, scope_session = current_scope()
+        cost = estimate_cost(model, tokens_in, tokens_out)
+        try:
+            with self.pool.transaction() as conn:
+                conn.execute(
+                    "INSERT INTO usage (ts, user_id, session_id, call_type, model, tokens_in, tokens_out, cost, estimated) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (time.time(), user_id or scope_user or "", session_id or scope_session or "", call_type, model,
+                     tokens_in, tokens_out, cost, int(estimated)))
+        except Exception as e:
+            print(f"Error recording usage: {e}")
+        return cost
+
+    def set_budget(self, user_id: str, daily_tokens: int = None, daily_cost: float = None):
+        with self.pool.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO budgets VALUES (?, ?, ?)", (user_id, daily_tokens, daily_cost))
+
+    def usage_for(self, user_id: str = None, since: float = None, session_id: str = None) -> Dict[str, Any]:
+        """Totals for a user (optionally one session) since a timestamp (default: the budget window)."""
+        since = since if since is not None else time.time() - BUDGET_WINDOW
+        query = ("SELECT COUNT(*), COALESCE(SUM(tokens_in), 0), COALESCE(SUM(tokens_out), 0), COALESCE(SUM(cost), 0) "
+                 "FROM usage WHERE user_id = ? AND ts >= ?")
+        params = [user_id or "", since]
+        if session_id:
+            query += " AND session_id = ?"
+            params.append(session_id)
+        with self.pool.read() as conn:
+            calls, tokens_in, tokens_out, cost = conn.execute(query, params).fetchone()
+        return {"calls": calls, "tokens_in": tokens_in, "tokens_out": tokens_out, "cost": cost}
+
+    def check(self, user_id: str = None, pending_tokens: int = 0) -> BudgetStatus:
+        """The user's budget state, counting `pending_tokens` of a call that is about to be made."""
+        if user_id is None:
+            user_id = current_scope()[0]
+        token_limit, cost_limit = self.daily_tokens, self.daily_cost
+        with self.pool.read() as conn:
+            override = conn.execute("SELECT daily_tokens, daily_cost FROM budgets WHERE user_id = ?",
+                                    (user_id or "",)).fetchone()
+        if override:
+            token_limit = override["daily_tokens"] if override["daily_tokens"] is not None else token_limit
+            cost_limit = override["daily_cost"] if override["daily_cost"] is not None else cost_limit
+        if not token_limit and not cost_limit:
+            return BudgetStatus(0, 0.0, None, None)
+        used = self.usage_for(user_id)
+        return BudgetStatus(used["tokens_in"] + used["tokens_out"] + pending_tokens, used["cost"],
+                            token_limit, cost_limit)
+
+
+class TrackedEmbeddings:
+    """Wraps an embedding client so embedding tokens are counted against the current user."""
+
+    def __init__(self, embeddings, tracker: "UsageTracker" = None):
+        self.wrapped = embeddings
+        self.tracker = tracker
+
+    @property
+    def model(self) -> str:
+        model = getattr(self.wrapped, "model", None)
+        return model if isinstance(model, str) else DEFAULT_EMBEDDING_MODEL
+
+    def _record(self, call_type: str, texts):
+        tokens = sum(count_tokens(t, self.model) for t in texts)
+        (self.tracker or get_usage_tracker()).record(call_type, self.model, tokens, estimated=True)
+
+    def embed_documents(self, texts):
+        vectors = self.wrapped.embed_documents(texts)
+        self._record("embed_documents", texts)
+        return vectors
+
+    def embed_query(self, text):
+        vector = self.wrapped.embed_query(text)
+        self._record("embed_query", [text])
+        return vector
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+
+_trackers: Dict[str, UsageTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def get_usage_tracker(db_path: str = None) -> UsageTracker:
+    """Returns the process-wide tracker for a database (default: KNOWVAL_USAGE_DB or usage.db)."""
+    db_path = db_path or os.getenv("KNOWVAL_USAGE_DB", "usage.db")
+    key = os.path.abspath(db_path)
+    with _trackers_lock:
+        tracker = _trackers.get(key)
+        if tracker is None or not os.path.exists(db_path):
+            tracker = UsageTracker(db_path)
+            _trackers[key] = tracker
+        return tracker
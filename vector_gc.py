@@ -0,0 +1,178 @@
+__import__('pysqlite3')
+import sys
+sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Set
+from vector_partitions import VectorStoreRouter
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class VectorGarbageCollector:
+    """
+    Removes vector-store chunks whose session no longer exists and compacts the store.
+
+    Chunks are orphaned when their session is deleted, or when they were ingested under a
+    deferred (never saved) session id. Chunks younger than `grace_period` seconds are kept so
+    an ingestion that is still creating its session row is never collected.
+    """
+
+    def __init__(self, session_manager, persist_directory: str = "./chroma_db", router: VectorStoreRouter = None,
+                 grace_period: float = 24 * 3600, page_size: int = 5000):
+        self.session_manager = session_manager
+        self.persist_directory = persist_directory
+        # Get/delete never embed, so no embedding function (and no API key) is needed here
+        self.router = router or VectorStoreRouter(persist_directory)
+        self.grace_period = grace_period
+        self.page_size = page_size
+        self._thread = None
+        self._stop = threading.Event()
+        self._orphan_owners: Dict[str, str] = {}
+        self.last_report: Dict[str, Any] = {}
+
+    def delete_session_vectors(self, session_id: str, user_id: str = None) -> int:
+        """Deletes every chunk tagged with the session. Returns the number of chunks removed."""
+        try:
+            return self.router.delete_session(session_id, user_id)
+        except Exception as e:
+            print(f"Error deleting vectors for session {session_id}: {e}")
+            return 0
+
+    def _live_session_ids(self) -> Set[str]:
+        with self.session_manager.pool.read() as conn:
+            return {row[0] for row in conn.execute("SELECT id FROM sessions")}
+
+    def find_orphans(self) -> Dict[str, int]:
+        """Returns {session_id: chunk_count} for sessions whose chunks are eligible for collection."""
+        live = self._live_session_ids()
+        cutoff = time.time() - self.grace_period
+        orphans: Dict[str, int] = {}
+        recent: Set[str] = set()
+        self._orphan_owners = {}
+        for name in self.router.list_collections():
+            store = self.router.get_store(collection_name=name)
+            offset = 0
+            while True:
+                page = store.get(include=["metadatas"], limit=self.page_size, offset=offset)
+                metadatas = page["metadatas"]
+                if not metadatas:
+                    break
+                for metadata in metadatas:
+                    session_id = (metadata or {}).get("session_id")
+                    # Chunks without a session (e.g. CLI ingestion) are never collected
+                    if not session_id or session_id in live:
+                        continue
+                    if (metadata.get("ingested_at") or 0) > cutoff:
+                        recent.add(session_id)
+                    orphans[session_id] = orphans.get(session_id, 0) + 1
+                    self._orphan_owners[session_id] = metadata.get("user_id")
+                offset += len(metadatas)
+        return {sid: count for sid, count in orphans.items() if sid not in recent}
+
+    def compact(self) -> bool:
+        """
+        VACUUMs the store's SQLite file so deleted rows give their pages back to the filesystem.
+        Runs only with the Chroma client closed and no other process using the directory, so
+        it is skipped while the app is running; the router reopens the client on next use.
+        """
+        db_file = os.path.join(self.persist_directory, "chroma.sqlite3")
+        if not os.path.exists(db_file):
+            return False
+        with self.router.exclusive_access() as exclusive:
+            if not exclusive:
+                print("Vector store compaction skipped: the store is in use by another client")
+                return False
+            try:
+                conn = sqlite3.connect(db_file, timeout=30)
+                try:
+                    conn.execute("VACUUM")
+                finally:
+                    conn.close()
+                return True
+            except Exception as e:
+                print(f"Vector store compaction skipped: {e}")
+                return False
+
+    def collect(self, dry_run: bool = False, compact: bool = True) -> Dict[str, Any]:
+        """Deletes orphaned chunks, compacts the store (with `compact`) and reports the space reclaimed."""
+        start = time.perf_counter()
+        bytes_before = _directory_size(self.persist_directory)
+        orphans = self.find_orphans()
+        deleted = 0
+        if not dry_run:
+            for session_id in orphans:
+                deleted += self.delete_session_vectors(session_id, self._orphan_owners.get(session_id))
+        released = []
+        if self.router.document_store and not dry_run:
+            # References held by deleted sessions keep shared files alive until released here
+            released = self.router.document_store.release_orphans(
+                self._live_session_ids(), time.time() - self.grace_period)
+            deleted += self.router.delete_content(released)
+        compacted = self.compact() if deleted and compact else False
+        bytes_after = _directory_size(self.persist_directory)
+        self.last_report = {
+            "orphaned_sessions": len(orphans),
+            "orphaned_chunks": sum(orphans.values()),
+            "released_documents": len(released),
+            "chunks_deleted": deleted,
+            "compacted": compacted,
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_after,
+            "bytes_reclaimed": max(0, bytes_before - bytes_after),
+            "duration_s": round(time.perf_counter() - start, 3),
+        }
+        print(f"Vector GC: {self.last_report}")
+        return self.last_report
+
+    def start_background(self, interval: float = 3600):
+        """Runs `collect()` every `interval` seconds on a daemon thread."""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    # Live searches hold the client, so compaction is left to the offline CLI run
+                    self.collect(compact=False)
+                except Exception as e:
+                    print(f"Vector GC failed: {e}")
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="vector-gc", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from document_store import DocumentStore
+    from session_manager import SessionManager
+
+    parser = argparse.ArgumentParser(description="Remove orphaned chunks from the vector store and compact it.")
+    parser.add_argument("--persist-directory", default="./chroma_db")
+    parser.add_argument("--sessions-db", default="sessions.db")
+    parser.add_argument("--documents-db", default="documents.db")
+    parser.add_argument("--grace-hours", type=float, default=24)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    router = VectorStoreRouter(args.persist_directory, document_store=DocumentStore(args.documents_db))
+    collector = VectorGarbageCollector(SessionManager(args.sessions_db), args.persist_directory, router=router,
+                                       grace_period=args.grace_hours * 3600)
+    print(json.dumps(collector.collect(dry_run=args.dry_run), indent=2))
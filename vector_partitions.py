@@ -0,0 +1,427 @@
+from __future__ import annotations
+
+__import__('pysqlite3')
+import sys
+sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+
+import fcntl
+import hashlib
+import os
+import threading
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple
+from lazy_imports import LazyImport
+from rate_limiter import RateLimitedEmbeddings
+from tracing import TracedEmbeddings
+from usage import TrackedEmbeddings
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+# langchain_chroma imports chromadb, which is slow; the router only needs it once a store is opened
+Chroma = LazyImport("langchain_chroma", "Chroma")
+
+PARTITION_MODES = ("shared", "user", "session")
+SHARED_COLLECTION = "langchain"  # langchain-chroma's default collection name
+PARTITION_PREFIX = "kv_"
+# What Chroma stores as a chunk's embedding under compact storage, which keeps the real ones
+COMPACT_PLACEHOLDER = [0.0]
+# Every process with a client open holds a shared lock on this file; maintenance needs it exclusively
+DIRECTORY_LOCK = ".knowval.lock"
+
+# Routers in this process with a client open, per persist directory
+_open_directories: Counter = Counter()
+_open_directories_lock = threading.Lock()
+
+
+def build_metadata_filter(username: str = None, session_id: str = None) -> Optional[Dict[str, Any]]:
+    """Builds the Chroma `where` filter that isolates a user and/or session."""
+    filters = []
+    if username:
+        filters.append({"user_id": username})
+    if session_id:
+        filters.append({"session_id": session_id})
+
+    if len(filters) > 1:
+        return {"$and": filters}
+    elif len(filters) == 1:
+        return filters[0]
+    return None
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()[:20]
+
+
+class VectorStoreRouter:
+    """
+    Maps a (user, session) scope onto a Chroma collection.
+
+    - "shared": one collection for everyone, isolated with a metadata filter (the original layout).
+    - "user": one collection per user; only the session filter remains.
+    - "session": one collection per session; no filter is needed at all.
+
+    Search cost then grows with one user's (or session's) documents rather than the whole
+    tenant base. Collection handles are cached (LRU) over a single persistent client.
+    Scopes that lack the field a mode partitions on (e.g. CLI ingestion without a session)
+    fall back to the shared collection.
+
+    With a `document_store`, deduplicated files are stored once per collection, tagged with
+    their content hash and the partition's own fields, and a session's scope also covers the
+    files it references. Partitioning is kept: in "user" mode a user's sessions share one copy
+    of a file, and in "session" mode each session gets its own copy, whose embeddings are
+    copied from an existing one rather than computed again. With a
+    `lexical_index`, every chunk added or deleted here is mirrored in the BM25 index, and
+    with a `vector_index` (compact storage), in the quantized index searches use instead;
+    the collections then keep only the chunks' text and metadata.
+    """
+
+    def __init__(self, persist_directory: str = "./chroma_db", embeddings=None, mode: str = None,
+                 max_open_collections: int = 64, document_store=None, lexical_index=None,
+                 vector_index=None):
+        mode = mode or os.getenv("KNOWVAL_VECTOR_PARTITION", "shared")
+        if mode not in PARTITION_MODES:
+            raise ValueError(f"Unknown vector partition mode '{mode}', expected one of {PARTITION_MODES}")
+        self.persist_directory = persist_directory
+        self.embeddings = embeddings
+        # Stores embed through these wrappers so every embedding call is traced, counted and rate limited
+        self._embedding_function = (TracedEmbeddings(TrackedEmbeddings(RateLimitedEmbeddings(embeddings)))
+                                    if embeddings is not None else None)
+        self.mode = mode
+        self.max_open_collections = max_open_collections
+        self.document_store = document_store
+        self.lexical_index = lexical_index
+        self.vector_index = vector_index
+        self._client = None
+        self._directory_lock = None
+        self._handles: "OrderedDict[str, Chroma]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    @property
+    def client(self):
+        """The persistent Chroma client, opened on first use."""
+        with self._lock:
+            if self._client is None:
+                import chromadb
+                os.makedirs(self.persist_directory, exist_ok=True)
+                # Blocks while another process is compacting the directory
+                self._directory_lock = open(os.path.join(self.persist_directory, DIRECTORY_LOCK), "a")
+                fcntl.flock(self._directory_lock, fcntl.LOCK_SH)
+                self._client = chromadb.PersistentClient(path=self.persist_directory)
+                with _open_directories_lock:
+                    _open_directories[os.path.abspath(self.persist_directory)] += 1
+            return self._client
+
+    def close(self):
+        """Closes the Chroma client and its database files; the next use reopens it."""
+        with self._lock:
+            self._handles.clear()
+            client, self._client = self._client, None
+            if client is not None:
+                with _open_directories_lock:
+                    directory = os.path.abspath(self.persist_directory)
+                    _open_directories[directory] -= 1
+                    last = _open_directories[directory] <= 0
+                if last:
+                    from chromadb.api.shared_system_client import SharedSystemClient
+                    # Chroma keeps one system per directory for the whole process; stopping it releases the
+                    # files, so it only happens once no other router here has the directory open
+                    SharedSystemClient._identifier_to_refcount.pop(client._identifier, None)
+                    system = SharedSystemClient._identifier_to_system.pop(client._identifier, None)
+                    if system is not None:
+                        system.stop()
+            if self._directory_lock is not None:
+                self._directory_lock.close()
+                self._directory_lock = None
+
+    @contextmanager
+    def exclusive_access(self):
+        """
+        Yields whether the directory can be maintained offline: True once this router's client is
+        closed and no other router or process has the directory open. The directory stays locked,
+        and this router closed, until the block exits.
+        """
+        with self._lock:
+            with _open_directories_lock:
+                others = _open_directories[os.path.abspath(self.persist_directory)] - (self._client is not None)
+            if others:
+                yield False
+                return
+            self.close()
+            os.makedirs(self.persist_directory, exist_ok=True)
+            with open(os.path.join(self.persist_directory, DIRECTORY_LOCK), "a") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    yield False
+                    return
+                yield True
+
+    def collection_name(self, username: str = None, session_id: str = None) -> str:
+        if self.mode == "user" and username:
+            return f"{PARTITION_PREFIX}user_{_digest(username)}"
+        if self.mode == "session" and session_id:
+            return f"{PARTITION_PREFIX}session_{_digest(session_id)}"
+        return SHARED_COLLECTION
+
+    def get_store(self, username: str = None, session_id: str = None, collection_name: str = None) -> Chroma:
+        """Returns a cached handle to the scope's collection, creating the collection if needed."""
+        name = collection_name or self.collection_name(username, session_id)
+        with self._lock:
+            store = self._handles.get(name)
+            if store is None:
+                store = Chroma(client=self.client, collection_name=name, embedding_function=self._embedding_function)
+                self._handles[name] = store
+                if len(self._handles) > self.max_open_collections:
+                    self._handles.popitem(last=False)
+            else:
+                self._handles.move_to_end(name)
+            return store
+
+    def scope(self, username: str = None, session_id: str = None) -> Tuple[Chroma, Optional[Dict[str, Any]]]:
+        """Returns (vector store, remaining metadata filter) for searching a user's session."""
+        store, where = self.partition_scope(username, session_id)
+        hashes = self.content_hashes(username, session_id)
+        if hashes and where is not None:
+            # The session's own chunks, and the copies of its deduplicated files in this collection
+            where = {"$or": [where, {"content_hash": {"$in": hashes}}]}
+        return store, where
+
+    def content_hashes(self, username: str = None, session_id: str = None) -> Optional[List[str]]:
+        """The deduplicated files the scope references, or None when it has none."""
+        if self.document_store and (username or session_id):
+            return self.document_store.hashes_for(username, session_id) or None
+        return None
+
+    @property
+    def embedding_function(self):
+        """The embeddings wrapped for tracing, usage accounting and rate limiting."""
+        return self._embedding_function
+
+    def get_documents(self, ids: List[str], username: str = None, session_id: str = None) -> List[Document]:
+        """The given chunks of a user's session as Documents, in `ids` order (missing ones are left out)."""
+        from langchain_core.documents import Document
+        store = self.get_store(username, session_id)
+        page = store.get(ids=list(ids), include=["documents", "metadatas"])
+        found = {doc_id: Document(page_content=text or "", metadata=metadata or {}, id=doc_id)
+                 for doc_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"])}
+        return [found[doc_id] for doc_id in ids if doc_id in found]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embedding_function.embed_query(text)
+
+    def is_warm(self, username: str = None, session_id: str = None) -> bool:
+        """Whether searching the scope needs no client start-up or collection load."""
+        name = self.collection_name(username, session_id)
+        with self._lock:
+            return self._client is not None and name in self._handles
+
+    def partition_scope(self, username: str = None, session_id: str = None) -> Tuple[Chroma, Optional[Dict[str, Any]]]:
+        """Like `scope`, but ignoring deduplicated files: the chunks stored for this user/session alone."""
+        name = self.collection_name(username, session_id)
+        store = self.get_store(collection_name=name)
+        if name == SHARED_COLLECTION:
+            return store, build_metadata_filter(username, session_id)
+        if self.mode == "user":
+            return store, build_metadata_filter(None, session_id)
+        return store, None
+
+    def add_documents(self, chunks: List[Document], username: str = None, session_id: str = None) -> Chroma:
+        store = self.get_store(username, session_id)
+        self._add(store, chunks)
+        return store
+
+    def _content_fields(self, name: str, username: str = None, session_id: str = None) -> Dict[str, Any]:
+        """Metadata that ties a deduplicated file's copy to its partition, so sidecar scopes match Chroma's."""
+        if name == SHARED_COLLECTION:
+            return {}
+        fields = {"user_id": username, "session_id": session_id if self.mode == "session" else None}
+        return {key: value for key, value in fields.items() if value}
+
+    @staticmethod
+    def _content_id(base: str, name: str) -> str:
+        # The sidecar indexes key chunks by id across collections, so copies get their own
+        return base if name == SHARED_COLLECTION else f"{base}@{name}"
+
+    def add_content(self, chunks: List[Document], digest: str, username: str = None,
+                    session_id: str = None) -> Chroma:
+        """Stores a deduplicated file's chunks in the scope's collection, under ids derived from `digest`."""
+        name = self.collection_name(username, session_id)
+        fields = self._content_fields(name, username, session_id)
+        for chunk in chunks:
+            chunk.metadata.update(fields, content_hash=digest)
+        store = self.get_store(collection_name=name)
+        self._add(store, chunks, [self._content_id(f"{digest}:{i}", name) for i in range(len(chunks))])
+        return store
+
+    def copy_content(self, digest: str, source: str, username: str = None, session_id: str = None) -> bool:
+        """
+        Makes a deduplicated file's chunks part of the scope's collection, copying them with their
+        embeddings from the `source` collection if it doesn't hold them yet. Returns False when
+        no complete copy is found, and the file must be embedded again.
+        """
+        name = self.collection_name(username, session_id)
+        target = self.get_store(collection_name=name)
+        if target.get(where={"content_hash": digest}, limit=1, include=[])["ids"]:
+            return True
+        if source not in self.list_collections():
+            return False
+        page = self.get_store(collection_name=source).get(where={"content_hash": digest},
+                                                          include=["embeddings", "documents", "metadatas"])
+        if not page["ids"]:
+            return False
+        vectors = list(page["embeddings"])
+        if self.vector_index is not None:
+            stored = self.vector_index.full_vectors(page["ids"])
+            if len(stored) < len(page["ids"]):
+                return False
+            vectors = [stored[doc_id] for doc_id in page["ids"]]
+        from langchain_core.documents import Document
+        fields = self._content_fields(name, username, session_id)
+        chunks = []
+        for text, metadata in zip(page["documents"], page["metadatas"]):
+            metadata = {k: v for k, v in (metadata or {}).items() if k not in ("user_id", "session_id")}
+            chunks.append(Document(page_content=text or "", metadata={**metadata, **fields}))
+        ids = [self._content_id(doc_id.split("@")[0], name) for doc_id in page["ids"]]
+        self._add(target, chunks, ids, vectors)
+        return True
+
+    def _add(self, store: Chroma, chunks: List[Document], ids: List[str] = None, vectors: List[Any] = None):
+        if self.vector_index is None and vectors is None:
+            ids = store.add_documents(chunks, ids=ids)
+        else:
+            ids = ids or [str(uuid.uuid4()) for _ in chunks]
+            if vectors is None:
+                vectors = self._embedding_function.embed_documents([chunk.page_content for chunk in chunks])
+            # Under compact storage the vectors live in the compact index alone; Chroma keeps the text and metadata
+            store._collection.upsert(ids=ids, embeddings=vectors if self.vector_index is None
+                                     else [COMPACT_PLACEHOLDER] * len(ids),
+                                     documents=[c.page_content for c in chunks],
+                                     metadatas=[c.metadata or None for c in chunks])
+            if self.vector_index is not None:
+                self.vector_index.add(chunks, ids, vectors)
+        self._index_lexical(chunks, ids)
+
+    def _index_lexical(self, chunks: List[Document], ids: List[str]):
+        if self.lexical_index is None:
+            return
+        try:
+            self.lexical_index.add_documents(chunks, ids)
+        except Exception as e:
+            # Searches still work through the vector store alone
+            print(f"Lexical indexing failed: {e}")
+
+    def delete_content(self, copies: List[Tuple[str, str]]) -> int:
+        """Deletes the (content hash, collection) copies of deduplicated files that are no longer referenced."""
+        by_collection: Dict[str, List[str]] = {}
+        for digest, name in copies:
+            by_collection.setdefault(name, []).append(digest)
+        existing = self.list_collections() if copies else []
+        deleted = 0
+        for name, hashes in by_collection.items():
+            if name not in existing:
+                continue
+            store = self.get_store(collection_name=name)
+            ids = store.get(where={"content_hash": {"$in": hashes}}, include=[])["ids"]
+            if self.lexical_index is not None:
+                self.lexical_index.delete_ids(ids)
+            if self.vector_index is not None:
+                self.vector_index.delete_ids(ids)
+            for i in range(0, len(ids), 5000):
+                store.delete(ids=ids[i:i + 5000])
+            deleted += len(ids)
+        return deleted
+
+    def list_collections(self) -> List[str]:
+        """Names of the shared collection (if present) and every partition collection."""
+        names = [c if isinstance(c, str) else c.name for c in self.client.list_collections()]
+        return [n for n in names if n == SHARED_COLLECTION or n.startswith(PARTITION_PREFIX)]
+
+    def delete_session(self, session_id: str, username: str = None) -> int:
+        """
+        Removes a session's chunks; in session mode the whole collection is dropped. The session's
+        references to deduplicated files are released, deleting files nobody else references.
+        """
+        deleted = 0
+        if self.document_store:
+            deleted += self.delete_content(self.document_store.release(session_id, username))
+        if self.lexical_index is not None:
+            self.lexical_index.delete_session(session_id)
+        if self.vector_index is not None:
+            self.vector_index.delete_session(session_id)
+
+        name = self.collection_name(username, session_id)
+        if name != SHARED_COLLECTION and self.mode == "session":
+            if name not in self.list_collections():
+                return deleted
+            deleted += self.get_store(collection_name=name)._collection.count()
+            self.drop_collection(name)
+            return deleted
+
+        store = self.get_store(collection_name=name)
+        ids = store.get(where={"session_id": session_id}, include=[])["ids"]
+        for i in range(0, len(ids), 5000):
+            store.delete(ids=ids[i:i + 5000])
+        return deleted + len(ids)
+
+    def drop_collection(self, name: str):
+        with self._lock:
+            self._handles.pop(name, None)
+            self.client.delete_collection(name)
+
+    def migrate_shared_collection(self, batch_size: int = 1000, delete_source: bool = False) -> Dict[str, int]:
+        """
+        Copies chunks from the shared collection into this router's partitions, reusing the stored
+        embeddings (no re-embedding). Chunks without the partition field stay where they are.
+        Returns {collection name: chunks copied}.
+        """
+        if self.mode == "shared":
+            return {}
+        if SHARED_COLLECTION not in self.list_collections():
+            return {}
+        source = self.client.get_collection(SHARED_COLLECTION)
+        copied: Dict[str, int] = {}
+        moved_ids: List[str] = []
+        offset = 0
+        while True:
+            page = source.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+            if not page["ids"]:
+                break
+            groups: Dict[str, Dict[str, list]] = {}
+            for i, chunk_id in enumerate(page["ids"]):
+                metadata = page["metadatas"][i] or {}
+                name = self.collection_name(metadata.get("user_id"), metadata.get("session_id"))
+                if name == SHARED_COLLECTION:
+                    continue
+                group = groups.setdefault(name, {"ids": [], "embeddings": [], "documents": [], "metadatas": []})
+                group["ids"].append(chunk_id)
+                group["embeddings"].append(page["embeddings"][i])
+                group["documents"].append(page["documents"][i])
+                group["metadatas"].append(metadata)
+            for name, group in groups.items():
+                self.get_store(collection_name=name)._collection.upsert(**group)
+                copied[name] = copied.get(name, 0) + len(group["ids"])
+                moved_ids.extend(group["ids"])
+            offset += len(page["ids"])
+
+        if delete_source:
+            for i in range(0, len(moved_ids), batch_size):
+                source.delete(ids=moved_ids[i:i + batch_size])
+        return copied
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Copy chunks from the shared collection into per-user or per-session collections.")
+    parser.add_argument("mode", choices=["user", "session"])
+    parser.add_argument("--persist-directory", default="./chroma_db")
+    parser.add_argument("--delete-source", action="store_true", help="Remove migrated chunks from the shared collection")
+    args = parser.parse_args()
+
+    router = VectorStoreRouter(args.persist_directory, mode=args.mode)
+    result = router.migrate_shared_collection(delete_source=args.delete_source)
+    print(json.dumps({"collections": len(result), "chunks": sum(result.values()), "per_collection": result}, indent=2))
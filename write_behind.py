@@ -0,0 +1,168 @@
+import atexit
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+from tracing import span
+
+
+class WriteBehindQueue:
+    """
+    Buffers small SQLite writes and flushes them on a background thread.
+
+    Each write has a key (e.g. ("progress", session_id)); submitting a write for a key that is
+    still pending merges its payload into the pending one, so rapid clicks collapse into a single
+    row update. Pending writes are flushed together in one transaction every `flush_interval`
+    seconds, on `flush()`, and at interpreter exit.
+    """
+
+    def __init__(self, pool, flush_interval: float = 0.25, max_batch: int = 500):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        # key -> (writer(conn, payload), payload)
+        self._pending: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._cond = threading.Condition()
+        # Serializes flushes so an older batch can never commit after a newer one
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._stats = {
+            "submitted": 0,
+            "coalesced": 0,
+            "flushes": 0,
+            "flushed_writes": 0,
+            "failed_flushes": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, key: Hashable, writer: Callable, payload: Dict[str, Any]):
+        """Queues a write, merging it with a pending write for the same key."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Write-behind queue is closed")
+            self._stats["submitted"] += 1
+            if key in self._pending:
+                self._stats["coalesced"] += 1
+                _, pending_payload = self._pending[key]
+                payload = {**pending_payload, **payload}
+            self._pending[key] = (writer, payload)
+            self._cond.notify()
+
+    def flush(self) -> int:
+        """Writes everything pending in one transaction. Returns the number of writes flushed."""
+        with self._flush_lock:
+            with self._cond:
+                batch = self._pending
+                self._pending = OrderedDict()
+            if not batch:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                with span("sqlite_flush", writes=len(batch)), self.pool.transaction() as conn:
+                    for writer, payload in batch.values():
+                        writer(conn, payload)
+            except Exception as e:
+                print(f"Write-behind flush failed, will retry: {e}")
+                self._requeue(batch)
+                with self._cond:
+                    self._stats["failed_flushes"] += 1
+                return 0
+
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._cond:
+                self._stats["flushes"] += 1
+                self._stats["flushed_writes"] += len(batch)
+                self._stats["last_flush_ms"] = elapsed_ms
+                self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], elapsed_ms)
+                self._stats["total_flush_ms"] += elapsed_ms
+            return len(batch)
+
+    def _requeue(self, batch):
+        """Puts a failed batch back in front of newer writes, letting the newer payloads win."""
+        with self._cond:
+            merged = OrderedDict()
+            for key, (writer, payload) in batch.items():
+                if key in self._pending:
+                    newer_writer, newer_payload = self._pending[key]
+                    merged[key] = (newer_writer, {**payload, **newer_payload})
+                else:
+                    merged[key] = (writer, payload)
+            for key, value in self._pending.items():
+                merged.setdefault(key, value)
+            self._pending = merged
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # Give rapid follow-up clicks a moment to coalesce before writing
+                deadline = time.monotonic() + self.flush_interval
+                while not self._closed and len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            if not self.flush() and self._pending:
+                # Back off after a failed flush instead of spinning
+                time.sleep(self.flush_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns queue depth and flush latency counters."""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queue_depth"] = len(self._pending)
+        flushes = stats["flushes"]
+        stats["avg_flush_ms"] = stats.pop("total_flush_ms") / flushes if flushes else 0.0
+        return stats
+
+    def close(self):
+        """Stops the background thread and durably flushes anything still pending."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=5)
+        self.flush()
+        atexit.unregister(self.close)
+
+
+_queues = {}  # pool -> [queue, references]
+_queues_lock = threading.Lock()
+
+
+def get_write_queue(pool) -> WriteBehindQueue:
+    """
+    Returns the process-wide write-behind queue for a connection pool, starting it on first use.
+    Each call takes a reference; give it back with `release_write_queue`.
+    """
+    with _queues_lock:
+        entry = _queues.get(pool)
+        if entry is None or entry[0]._closed:
+            entry = _queues[pool] = [WriteBehindQueue(pool), 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def release_write_queue(queue: WriteBehindQueue):
+    """Drops a reference to a shared queue: the last one closes it, the others just flush."""
+    with _queues_lock:
+        entry = _queues.get(queue.pool)
+        last = entry is None or entry[0] is not queue or entry[1] <= 1
+        if entry is not None and entry[0] is queue:
+            entry[1] -= 1
+            if last:
+                del _queues[queue.pool]
+    if last:
+        queue.close()
+    else:
+        queue.flush()